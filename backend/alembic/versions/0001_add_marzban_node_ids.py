@@ -0,0 +1,69 @@
+"""Add node_id to orders and marzban_users
+
+Revision ID: 0001_add_marzban_node_ids
+Revises:
+Create Date: 2026-10-18 00:00:00
+
+Databases created by Base.metadata.create_all after multi-node support
+already have these columns; the upgrade skips whatever exists.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001_add_marzban_node_ids"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("orders", "marzban_users")
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+
+    if not inspector.has_table("marzban_nodes"):
+        op.create_table(
+            "marzban_nodes",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(100), nullable=False, unique=True),
+            sa.Column("url", sa.String(255), nullable=False),
+            sa.Column("username", sa.String(100), nullable=False),
+            sa.Column("password", sa.String(255), nullable=False),
+            sa.Column("weight", sa.Integer(), nullable=False),
+            sa.Column("max_users", sa.Integer(), nullable=True),
+            sa.Column(
+                "status",
+                sa.Enum("ACTIVE", "DRAINING", "DISABLED", name="marzbannodestatus"),
+                nullable=True
+            ),
+            sa.Column("notes", sa.Text(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_marzban_nodes_status", "marzban_nodes", ["status"])
+        op.create_index("ix_marzban_nodes_id", "marzban_nodes", ["id"])
+
+    for table in TABLES:
+        columns = {column["name"] for column in inspector.get_columns(table)}
+        if "node_id" in columns:
+            continue
+        op.add_column(
+            table,
+            sa.Column(
+                "node_id",
+                sa.Integer(),
+                sa.ForeignKey("marzban_nodes.id", name=f"fk_{table}_node_id"),
+                nullable=True
+            )
+        )
+        op.create_index(f"ix_{table}_node_id", table, ["node_id"])
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.drop_index(f"ix_{table}_node_id", table_name=table)
+        op.drop_column(table, "node_id")
@@ -0,0 +1,69 @@
+"""Add (..., created_at, id) indexes for keyset pagination
+
+Revision ID: 0003_add_keyset_indexes
+Revises: 0002_add_user_token_version
+Create Date: 2026-10-18 00:00:00
+
+Replaces the single-column created_at indexes on orders and payments.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003_add_keyset_indexes"
+down_revision: Union[str, None] = "0002_add_user_token_version"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = {
+    "orders": {
+        "ix_orders_user_created": ["user_id", "created_at", "id"],
+        "ix_orders_status_created": ["status", "created_at", "id"],
+        "ix_orders_created": ["created_at", "id"],
+    },
+    "payments": {
+        "ix_payments_user_created": ["user_id", "created_at", "id"],
+        "ix_payments_status_created": ["status", "created_at", "id"],
+        "ix_payments_created": ["created_at", "id"],
+    },
+    "agents": {
+        "ix_agents_status_created": ["status", "created_at", "id"],
+        "ix_agents_created": ["created_at", "id"],
+    },
+}
+
+# Superseded by the composite indexes above
+OLD_INDEXES = {
+    "orders": "ix_orders_created_at",
+    "payments": "ix_payments_created_at",
+}
+
+
+def _index_names(inspector, table: str) -> set:
+    return {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+
+    for table, indexes in INDEXES.items():
+        existing = _index_names(inspector, table)
+        for name, columns in indexes.items():
+            if name not in existing:
+                op.create_index(name, table, columns)
+
+    for table, name in OLD_INDEXES.items():
+        if name in _index_names(inspector, table):
+            op.drop_index(name, table_name=table)
+
+
+def downgrade() -> None:
+    for table, name in OLD_INDEXES.items():
+        op.create_index(name, table, ["created_at"])
+
+    for table, indexes in INDEXES.items():
+        for name in indexes:
+            op.drop_index(name, table_name=table)
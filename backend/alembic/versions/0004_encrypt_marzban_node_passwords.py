@@ -0,0 +1,64 @@
+"""Store Marzban node passwords encrypted
+
+Revision ID: 0004_encrypt_marzban_node_passwords
+Revises: 0003_add_keyset_indexes
+Create Date: 2026-10-18 00:00:00
+
+Existing plaintext passwords are encrypted with the key from settings
+(SECRET_ENCRYPTION_KEY, or derived from SECRET_KEY), so run it with the
+application's environment.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils.security import encrypt_secret, decrypt_secret
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004_encrypt_marzban_node_passwords"
+down_revision: Union[str, None] = "0003_add_keyset_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+nodes = sa.table(
+    "marzban_nodes",
+    sa.column("id", sa.Integer),
+    sa.column("password", sa.String),
+    sa.column("password_encrypted", sa.Text),
+)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    columns = {column["name"] for column in sa.inspect(bind).get_columns("marzban_nodes")}
+    if "password" not in columns:
+        return
+
+    op.add_column("marzban_nodes", sa.Column("password_encrypted", sa.Text(), nullable=True))
+    for node_id, password in bind.execute(sa.select(nodes.c.id, nodes.c.password)).all():
+        bind.execute(
+            nodes.update()
+            .where(nodes.c.id == node_id)
+            .values(password_encrypted=encrypt_secret(password))
+        )
+
+    with op.batch_alter_table("marzban_nodes") as batch:
+        batch.alter_column("password_encrypted", existing_type=sa.Text(), nullable=False)
+        batch.drop_column("password")
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    op.add_column("marzban_nodes", sa.Column("password", sa.String(255), nullable=True))
+    for node_id, token in bind.execute(sa.select(nodes.c.id, nodes.c.password_encrypted)).all():
+        bind.execute(
+            nodes.update()
+            .where(nodes.c.id == node_id)
+            .values(password=decrypt_secret(token))
+        )
+
+    with op.batch_alter_table("marzban_nodes") as batch:
+        batch.alter_column("password", existing_type=sa.String(255), nullable=False)
+        batch.drop_column("password_encrypted")
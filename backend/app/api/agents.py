@@ -1,26 +1,33 @@
 """
 Agent Management API (Admin only)
 """
+from datetime import date, timedelta
+from typing import Optional
 from decimal import Decimal
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 
 from app.database import get_db
-from app.utils.deps import get_admin_user
-from app.utils.security import hash_password
+from app.utils.deps import get_admin_user, invalidate_principal
+from app.utils.security import password_hasher
+from app.utils.pagination import paginate, count_rows
 from app.models.user import User, UserRole, UserStatus
 from app.models.agent import Agent
-from app.models.transaction import Transaction, TransactionType, ReferenceType
 from app.schemas.agent import (
     AgentCreate,
     AgentUpdate,
     CreditAdjustment,
     AgentResponse,
-    AgentListResponse
+    AgentListResponse,
+    StatementEntry,
+    AgentStatementResponse,
+    ReconciliationResponse
 )
 from app.schemas.auth import MessageResponse
+from app.services import stats, ledger
+from app.services.credit import manual_adjustment
 
 router = APIRouter()
 
@@ -68,7 +75,7 @@ async def create_agent(
     user = User(
         username=request.username,
         email=request.email,
-        password_hash=hash_password(request.password),
+        password_hash=await password_hasher.hash(request.password),
         role=UserRole.AGENT,
         status=UserStatus.ACTIVE
     )
@@ -88,6 +95,7 @@ async def create_agent(
         notes=request.notes
     )
     db.add(agent)
+    await stats.bump_counters(db, agents=1)
     await db.commit()
 
     # Refresh with user relationship
@@ -106,13 +114,13 @@ async def list_agents(
     page_size: int = Query(20, ge=1, le=100),
     status_filter: Optional[str] = Query(None, alias="status"),
     search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (overrides page)"),
+    include_total: bool = True,
     admin: User = Depends(get_admin_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """List all agents with pagination (Admin only)"""
-    from typing import Optional
-
-    query = select(Agent).options(joinedload(Agent.user))
+    """List all agents with pagination, newest first (Admin only)"""
+    query = select(Agent)
 
     # Filters
     if status_filter:
@@ -125,25 +133,24 @@ async def list_agents(
             (Agent.shop_name.ilike(f"%{search}%"))
         )
 
-    # Count total
-    count_query = select(func.count(Agent.id))
-    if status_filter:
-        count_query = count_query.where(Agent.status == status_filter)
-    result = await db.execute(count_query)
-    total = result.scalar()
+    # Count total (with the same filters, search included)
+    total, total_exact = await count_rows(db, query) if include_total else (None, True)
 
     # Paginate
-    query = query.order_by(Agent.created_at.desc())
-    query = query.offset((page - 1) * page_size).limit(page_size)
-
-    result = await db.execute(query)
-    agents = result.scalars().all()
+    try:
+        agents, next_cursor = await paginate(
+            db, query.options(joinedload(Agent.user)), Agent, page, page_size, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
     return AgentListResponse(
         agents=[agent_to_response(a) for a in agents],
         total=total,
+        total_exact=total_exact,
         page=page,
-        page_size=page_size
+        page_size=page_size,
+        next_cursor=next_cursor
     )
 
 
@@ -220,6 +227,7 @@ async def delete_agent(
     agent.status = UserStatus.DISABLED
     agent.user.status = UserStatus.DISABLED
     await db.commit()
+    invalidate_principal(agent.user_id)
 
     return MessageResponse(message="Agent disabled successfully")
 
@@ -243,24 +251,8 @@ async def adjust_credit(
             detail="Agent not found"
         )
 
-    # Calculate balances
-    balance_before = agent.total_credit
-    new_confirmed = Decimal(agent.credit_confirmed) + request.amount
-    agent.credit_confirmed = new_confirmed
-    balance_after = agent.total_credit
-
-    # Create transaction log
-    transaction = Transaction(
-        user_id=agent.user_id,
-        type=TransactionType.CHARGE_MANUAL,
-        amount=request.amount,
-        balance_before=Decimal(str(balance_before)),
-        balance_after=Decimal(str(balance_after)),
-        reference_type=ReferenceType.MANUAL,
-        notes=request.notes or f"Manual adjustment by admin",
-        created_by=admin.id
-    )
-    db.add(transaction)
+    # Locks the agent row, like the other credit operations
+    await manual_adjustment(agent.user, request.amount, admin, request.notes, db)
     await db.commit()
     await db.refresh(agent)
 
@@ -288,5 +280,81 @@ async def enable_agent(
     agent.status = UserStatus.ACTIVE
     agent.user.status = UserStatus.ACTIVE
     await db.commit()
+    invalidate_principal(agent.user_id)
 
     return MessageResponse(message="Agent enabled successfully")
+
+
+@router.get("/{agent_id}/statement", response_model=AgentStatementResponse)
+async def get_agent_statement(
+    agent_id: int,
+    date_from: Optional[date] = Query(None, description="Default: 30 days ago"),
+    date_to: Optional[date] = Query(None, description="Default: today"),
+    cursor: Optional[int] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Agent account statement (Admin only)
+
+    Opening/closing balances come from balance checkpoints, so they cost
+    the same for any period. Entries are paged oldest first by cursor.
+    """
+    result = await db.execute(select(Agent.user_id).where(Agent.id == agent_id))
+    user_id = result.scalar_one_or_none()
+
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Agent not found"
+        )
+
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=30)
+    if date_from > date_to:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="date_from must not be after date_to"
+        )
+
+    statement = await ledger.agent_statement(db, user_id, date_from, date_to, cursor, limit)
+
+    return AgentStatementResponse(
+        agent_id=agent_id,
+        date_from=date_from,
+        date_to=date_to,
+        opening_balance=statement["opening_balance"],
+        closing_balance=statement["closing_balance"],
+        total_credits=statement["total_credits"],
+        total_debits=statement["total_debits"],
+        entries=[
+            StatementEntry(
+                id=tx.id,
+                type=tx.type.value,
+                amount=tx.amount,
+                balance_before=tx.balance_before,
+                balance_after=tx.balance_after,
+                reference_type=tx.reference_type.value if tx.reference_type else None,
+                reference_id=tx.reference_id,
+                notes=tx.notes,
+                created_at=tx.created_at
+            )
+            for tx in statement["entries"]
+        ],
+        next_cursor=statement["next_cursor"]
+    )
+
+
+@router.post("/reconcile", response_model=ReconciliationResponse)
+async def reconcile_agent_balances(
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Checkpoint new transactions and verify every agent's stored credit
+    against the ledger (Admin only)
+    """
+    checkpoints = await ledger.create_checkpoints(db)
+    report = await ledger.reconcile_balances(db)
+    return {"checkpoints": checkpoints, **report}
@@ -8,8 +8,9 @@ from sqlalchemy import select
 
 from app.database import get_db
 from app.config import settings
-from app.utils.security import hash_password, verify_password, create_access_token
-from app.utils.deps import get_current_user
+from app.utils.security import create_access_token, password_hasher, token_cache
+from app.utils.deps import get_current_user, get_admin_user, invalidate_principal, principal_cache
+from app.utils.rate_limit import rate_limit
 from app.models.user import User, UserRole, UserStatus
 from app.models.end_user import EndUser
 from app.schemas.auth import (
@@ -24,7 +25,39 @@ from app.schemas.auth import (
 router = APIRouter()
 
 
-@router.post("/login", response_model=TokenResponse)
+def issue_token(user: User, response: Response) -> TokenResponse:
+    """Create a JWT for the user and set it in the httpOnly cookie"""
+    expires_delta = timedelta(days=settings.ACCESS_TOKEN_EXPIRE_DAYS)
+    access_token = create_access_token(
+        data={"sub": str(user.id), "role": user.role.value, "ver": user.token_version},
+        expires_delta=expires_delta
+    )
+
+    response.set_cookie(
+        key="access_token",
+        value=access_token,
+        httponly=True,
+        secure=not settings.DEBUG,  # Only HTTPS in production
+        samesite="lax",
+        max_age=settings.ACCESS_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
+    )
+
+    return TokenResponse(
+        access_token=access_token,
+        token_type="bearer",
+        expires_in=settings.ACCESS_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
+    )
+
+
+@router.post(
+    "/login",
+    response_model=TokenResponse,
+    dependencies=[
+        Depends(rate_limit("login:ip", settings.LOGIN_RATE_PER_IP)),
+        Depends(rate_limit("login:username", settings.LOGIN_RATE_PER_USERNAME, scope="username")),
+        Depends(rate_limit("login:global", settings.LOGIN_RATE_GLOBAL, scope="global")),
+    ]
+)
 async def login(
     request: LoginRequest,
     response: Response,
@@ -40,7 +73,11 @@ async def login(
     )
     user = result.scalar_one_or_none()
 
-    if not user or not verify_password(request.password, user.password_hash):
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await password_hasher.verify(request.password, user.password_hash)
+
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password"
@@ -52,31 +89,21 @@ async def login(
             detail="Account is disabled"
         )
 
-    # Create token
-    expires_delta = timedelta(days=settings.ACCESS_TOKEN_EXPIRE_DAYS)
-    access_token = create_access_token(
-        data={"sub": user.id, "role": user.role.value},
-        expires_delta=expires_delta
-    )
+    # Upgrade the stored hash if the cost parameters changed
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
+        invalidate_principal(user.id)
 
-    # Set cookie
-    response.set_cookie(
-        key="access_token",
-        value=access_token,
-        httponly=True,
-        secure=not settings.DEBUG,  # Only HTTPS in production
-        samesite="lax",
-        max_age=settings.ACCESS_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
-    )
-
-    return TokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        expires_in=settings.ACCESS_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
-    )
+    # Create token and set cookie
+    return issue_token(user, response)
 
 
-@router.post("/register", response_model=UserResponse)
+@router.post(
+    "/register",
+    response_model=UserResponse,
+    dependencies=[Depends(rate_limit("register:ip", settings.REGISTER_RATE_PER_IP))]
+)
 async def register(
     request: RegisterRequest,
     db: AsyncSession = Depends(get_db)
@@ -110,7 +137,7 @@ async def register(
     user = User(
         username=request.username,
         email=request.email,
-        password_hash=hash_password(request.password),
+        password_hash=await password_hasher.hash(request.password),
         role=UserRole.END_USER,
         status=UserStatus.ACTIVE
     )
@@ -160,21 +187,39 @@ async def get_me(current_user: User = Depends(get_current_user)):
 @router.post("/change-password", response_model=MessageResponse)
 async def change_password(
     request: ChangePasswordRequest,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Change current user's password.
+    Revokes all existing tokens; a new one is set in the cookie.
     """
     # Verify current password
-    if not verify_password(request.current_password, current_user.password_hash):
+    valid, _ = await password_hasher.verify(request.current_password, current_user.password_hash)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect"
         )
 
     # Update password
-    current_user.password_hash = hash_password(request.new_password)
+    current_user.password_hash = await password_hasher.hash(request.new_password)
+    current_user.token_version += 1
     await db.commit()
+    invalidate_principal(current_user.id)
+    issue_token(current_user, response)
 
     return MessageResponse(message="Password changed successfully")
+
+
+@router.get("/metrics")
+async def auth_metrics(admin: User = Depends(get_admin_user)):
+    """
+    Password hashing pool and auth cache statistics (Admin only)
+    """
+    return {
+        "password_hasher": password_hasher.stats(),
+        "token_cache": token_cache.stats(),
+        "principal_cache": principal_cache.stats(),
+    }
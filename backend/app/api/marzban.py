@@ -4,11 +4,16 @@ Wrapper endpoints for Marzban operations
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 
-from app.utils.deps import get_current_user, get_agent_user
+from app.database import get_db
+from app.config import settings
+from app.utils.deps import get_current_user, get_agent_user, get_admin_user
+from app.utils.rate_limit import rate_limit
 from app.models.user import User
 from app.services.marzban import get_marzban_client, MarzbanClient
+from app.services.marzban_nodes import get_node_registry, MarzbanNodeRegistry
 
 router = APIRouter()
 
@@ -27,15 +32,20 @@ class MarzbanUserInfo(BaseModel):
     subscription_url: Optional[str]
 
 
-@router.get("/check-username/{username}", response_model=UsernameCheckResponse)
+@router.get(
+    "/check-username/{username}",
+    response_model=UsernameCheckResponse,
+    dependencies=[Depends(rate_limit("check_username", settings.CHECK_USERNAME_RATE_PER_USER, scope="user"))]
+)
 async def check_username(
     username: str,
     current_user: User = Depends(get_current_user),
-    marzban: MarzbanClient = Depends(get_marzban_client)
+    db: AsyncSession = Depends(get_db),
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
 ):
     """Check if a username is available in Marzban"""
     try:
-        exists = await marzban.check_username_exists(username)
+        exists = await registry.username_exists(db, username)
         return UsernameCheckResponse(
             username=username,
             available=not exists
@@ -51,10 +61,12 @@ async def check_username(
 async def get_marzban_user(
     username: str,
     current_user: User = Depends(get_agent_user),
-    marzban: MarzbanClient = Depends(get_marzban_client)
+    db: AsyncSession = Depends(get_db),
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
 ):
     """Get Marzban user info (Agent/Admin only)"""
     try:
+        marzban = await registry.client_for_username(db, username)
         user = await marzban.get_user(username)
         if not user:
             raise HTTPException(
@@ -85,10 +97,12 @@ async def get_marzban_user(
 async def sync_marzban_user(
     username: str,
     current_user: User = Depends(get_agent_user),
-    marzban: MarzbanClient = Depends(get_marzban_client)
+    db: AsyncSession = Depends(get_db),
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
 ):
     """Sync user data from Marzban (Agent/Admin only)"""
     try:
+        marzban = await registry.client_for_username(db, username)
         user = await marzban.get_user(username)
         if not user:
             raise HTTPException(
@@ -115,17 +129,48 @@ async def sync_marzban_user(
         )
 
 
+async def connection_status(marzban: MarzbanClient) -> dict:
+    """Status of the default panel, without hitting it while the breaker is open"""
+    if marzban.breaker.stats()["state"] == "open":
+        return {"status": "circuit_open"}
+    try:
+        await marzban.authenticate()
+        return {"status": "connected"}
+    except Exception as e:
+        return {"status": "disconnected", "error": str(e)}
+
+
 @router.get("/health")
 async def marzban_health(
     marzban: MarzbanClient = Depends(get_marzban_client)
 ):
     """Check Marzban connection health"""
-    try:
-        await marzban.authenticate()
-        return {"status": "connected", "url": marzban.base_url}
-    except Exception as e:
-        return {
-            "status": "disconnected",
-            "url": marzban.base_url,
-            "error": str(e)
-        }
+    health = await connection_status(marzban)
+    return {"status": health["status"]}
+
+
+@router.get("/health/details")
+async def marzban_health_details(
+    admin: User = Depends(get_admin_user),
+    marzban: MarzbanClient = Depends(get_marzban_client),
+    db: AsyncSession = Depends(get_db),
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
+):
+    """Connection, breaker, cache and pool details of every panel (Admin only)"""
+    nodes = await registry.list_nodes(db)
+    return {
+        **await connection_status(marzban),
+        "url": marzban.base_url,
+        "breaker": marzban.breaker.stats(),
+        "cache": marzban.cache.stats(),
+        "pool": marzban.pool_stats(),
+        "nodes": [
+            {
+                "id": node.id,
+                "name": node.name,
+                "status": node.status.value,
+                "breaker": client.breaker.stats() if client else None
+            }
+            for node, client in ((node, registry.existing_client(node)) for node in nodes)
+        ]
+    }
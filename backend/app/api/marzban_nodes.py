@@ -0,0 +1,177 @@
+"""
+Marzban Node Management API (Admin only)
+"""
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from app.database import get_db
+from app.config import settings
+from app.utils.deps import get_admin_user
+from app.models.user import User
+from app.models.marzban_node import MarzbanNode, MarzbanNodeStatus
+from app.schemas.marzban_node import (
+    MarzbanNodeCreate,
+    MarzbanNodeUpdate,
+    MarzbanNodeResponse,
+    MarzbanNodeListResponse
+)
+from app.schemas.auth import MessageResponse
+from app.services.marzban_nodes import get_node_registry, MarzbanNodeRegistry
+
+router = APIRouter()
+
+
+def node_to_response(
+    node: MarzbanNode,
+    active_users: int,
+    registry: MarzbanNodeRegistry
+) -> MarzbanNodeResponse:
+    return MarzbanNodeResponse(
+        id=node.id,
+        name=node.name,
+        url=node.url,
+        username=node.username,
+        weight=node.weight,
+        max_users=node.max_users,
+        status=node.status.value,
+        notes=node.notes,
+        active_users=active_users,
+        breaker_state=registry.get_client(node).breaker.state,
+        created_at=node.created_at
+    )
+
+
+async def _get_node_or_404(node_id: int, db: AsyncSession) -> MarzbanNode:
+    node = await db.get(MarzbanNode, node_id)
+    if not node:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Marzban node not found"
+        )
+    return node
+
+
+@router.get("", response_model=MarzbanNodeListResponse)
+async def list_nodes(
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db),
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
+):
+    """List registered Marzban nodes with their load (Admin only)"""
+    nodes = await registry.list_nodes(db)
+    counts = await registry.active_user_counts(db)
+
+    return MarzbanNodeListResponse(
+        nodes=[node_to_response(n, counts.get(n.id, 0), registry) for n in nodes],
+        strategy=settings.MARZBAN_PLACEMENT_STRATEGY
+    )
+
+
+@router.post("", response_model=MarzbanNodeResponse)
+async def create_node(
+    request: MarzbanNodeCreate,
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db),
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
+):
+    """Register a new Marzban node (Admin only)"""
+    result = await db.execute(
+        select(MarzbanNode).where(MarzbanNode.name == request.name)
+    )
+    if result.scalar_one_or_none():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Node name already exists"
+        )
+
+    node = MarzbanNode(**request.model_dump(), status=MarzbanNodeStatus.ACTIVE)
+    db.add(node)
+    await db.commit()
+    await db.refresh(node)
+
+    return node_to_response(node, 0, registry)
+
+
+@router.get("/{node_id}", response_model=MarzbanNodeResponse)
+async def get_node(
+    node_id: int,
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db),
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
+):
+    """Get a Marzban node (Admin only)"""
+    node = await _get_node_or_404(node_id, db)
+    counts = await registry.active_user_counts(db)
+
+    return node_to_response(node, counts.get(node.id, 0), registry)
+
+
+@router.put("/{node_id}", response_model=MarzbanNodeResponse)
+async def update_node(
+    node_id: int,
+    request: MarzbanNodeUpdate,
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db),
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
+):
+    """Update a Marzban node (Admin only)"""
+    node = await _get_node_or_404(node_id, db)
+
+    update_data = request.model_dump(exclude_unset=True)
+    if "status" in update_data:
+        try:
+            update_data["status"] = MarzbanNodeStatus(update_data["status"])
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid status. Use ACTIVE, DRAINING or DISABLED"
+            )
+    for field, value in update_data.items():
+        setattr(node, field, value)
+
+    await db.commit()
+    await db.refresh(node)
+    counts = await registry.active_user_counts(db)
+
+    return node_to_response(node, counts.get(node.id, 0), registry)
+
+
+@router.delete("/{node_id}", response_model=MessageResponse)
+async def delete_node(
+    node_id: int,
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Disable a Marzban node (Admin only).
+    Nodes are never deleted because orders keep referencing them.
+    """
+    node = await _get_node_or_404(node_id, db)
+    node.status = MarzbanNodeStatus.DISABLED
+    await db.commit()
+
+    return MessageResponse(message="Marzban node disabled successfully")
+
+
+@router.post("/{node_id}/check")
+async def check_node(
+    node_id: int,
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db),
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
+):
+    """Test the connection to a Marzban node (Admin only)"""
+    node = await _get_node_or_404(node_id, db)
+    client = registry.get_client(node)
+
+    try:
+        await client.authenticate()
+        return {"status": "connected", "url": client.base_url, "breaker": client.breaker.stats()}
+    except Exception as e:
+        return {
+            "status": "disconnected",
+            "url": client.base_url,
+            "error": str(e),
+            "breaker": client.breaker.stats()
+        }
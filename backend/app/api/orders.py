@@ -2,15 +2,20 @@
 Order Management API
 Create orders, view orders, manage user subscriptions
 """
+import asyncio
+import logging
 from datetime import datetime
 from decimal import Decimal
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 
+from app.config import settings
 from app.database import get_db
 from app.utils.deps import get_current_user, get_admin_user, get_agent_user
+from app.utils.pagination import paginate, count_rows
 from app.models.user import User, UserRole
 from app.models.agent import Agent
 from app.models.end_user import EndUser
@@ -19,16 +24,22 @@ from app.models.order import Order, OrderStatus
 from app.models.marzban_user import MarzbanUser, MarzbanUserStatus
 from app.schemas.order import (
     OrderCreate,
+    OrderBulkCreate,
+    BulkOrderItem,
+    BulkOrderResponse,
     OrderResponse,
     OrderDetailResponse,
-    OrderListResponse
+    OrderListResponse,
+    username_error
 )
 from app.schemas.auth import MessageResponse
-from app.services.marzban import get_marzban_client, MarzbanClient
+from app.services.marzban_nodes import get_node_registry, MarzbanNodeRegistry
 from app.services.credit import deduct_credit, refund_credit, get_user_credit_info
 from app.services.refund import calculate_refund
+from app.services import stats, analytics
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 def order_to_response(order: Order) -> OrderResponse:
@@ -79,16 +90,96 @@ def order_to_detail(order: Order) -> OrderDetailResponse:
     )
 
 
+def marzban_note(creator_name: str, plan: Plan, price: Decimal) -> str:
+    """Note stored on the Marzban user"""
+    return f"""RAD Panel User
+Created by: {creator_name}
+Created at: {datetime.utcnow().isoformat()}
+Plan: {plan.name}
+Price: {price} IRR
+"""
+
+
+def add_order(
+    db: AsyncSession,
+    user_id: int,
+    plan: Plan,
+    price: Decimal,
+    username: str,
+    alias: str,
+    node_id: int,
+    on_hold: bool,
+    marzban_data: dict
+) -> Order:
+    """Add an order and its MarzbanUser row for a user created in Marzban"""
+    order = Order(
+        user_id=user_id,
+        plan=plan,
+        amount=price,
+        marzban_username=username,
+        alias=alias,
+        node_id=node_id,
+        status=OrderStatus.ACTIVE
+    )
+    db.add(order)
+
+    expire_date = None
+    if marzban_data.get("expire"):
+        expire_date = datetime.fromtimestamp(marzban_data["expire"])
+
+    marzban_user = MarzbanUser(
+        order=order,
+        username=username,
+        node_id=node_id,
+        subscription_url=marzban_data.get("subscription_url"),
+        expire_date=expire_date,
+        data_limit_gb=plan.data_limit_gb,
+        data_used_gb=0,
+        status=MarzbanUserStatus.ACTIVE if not on_hold else MarzbanUserStatus.DISABLED,
+        last_synced_at=datetime.utcnow()
+    )
+    db.add(marzban_user)
+
+    return order
+
+
+def check_credit(user: User, credit_info: Optional[dict], amount: Decimal) -> None:
+    """Raise unless the wallet can pay `amount` and may create users"""
+    if not credit_info:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User profile not found"
+        )
+
+    if credit_info["total_credit"] < amount:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient credit. Required: {amount}, Available: {credit_info['total_credit']}"
+        )
+
+    # Check if agent has negative credit (can't create users)
+    if user.role == UserRole.AGENT and credit_info["profile"].is_negative:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Cannot create users with negative credit. Please recharge your wallet."
+        )
+
+
 @router.post("", response_model=OrderDetailResponse)
 async def create_order(
     request: OrderCreate,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
-    marzban: MarzbanClient = Depends(get_marzban_client)
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
 ):
     """
     Create a new order and user in Marzban.
     Deducts credit from user's wallet.
+
+    Credit is checked first without a lock, and the Marzban user is created
+    with no database transaction open. Only then is the wallet row locked,
+    the credit re-checked and deducted. If that fails, the Marzban user is
+    deleted again.
     """
     # Get plan
     result = await db.execute(
@@ -108,51 +199,39 @@ async def create_order(
     else:
         price = plan.price_public
 
-    # Check credit
+    # Check credit (fail fast; re-checked under lock before deducting)
     credit_info = await get_user_credit_info(current_user, db)
-    if not credit_info:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User profile not found"
-        )
+    check_credit(current_user, credit_info, price)
+    profile = credit_info["profile"]
 
-    if credit_info["total_credit"] < float(price):
+    # Pick the Marzban node for this user
+    try:
+        node = await registry.choose_node(db)
+    except Exception as e:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Insufficient credit. Required: {price}, Available: {credit_info['total_credit']}"
-        )
-
-    # Check if agent has negative credit (can't create users)
-    if current_user.role == UserRole.AGENT:
-        result = await db.execute(
-            select(Agent).where(Agent.user_id == current_user.id)
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
         )
-        agent = result.scalar_one_or_none()
-        if agent and agent.is_negative:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Cannot create users with negative credit. Please recharge your wallet."
-            )
+    marzban = registry.get_client(node)
 
     # Check username availability
-    username_exists = await marzban.check_username_exists(request.username)
+    username_exists = await registry.username_exists(db, request.username)
     if username_exists:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Username '{request.username}' already exists in Marzban"
         )
 
+    # End the read transaction so no connection is held while Marzban
+    # creates the user
+    await db.commit()
+
     # Build note for Marzban
     creator_name = current_user.username
-    if current_user.role == UserRole.AGENT and credit_info.get("profile"):
-        creator_name = credit_info["profile"].full_name
+    if current_user.role == UserRole.AGENT:
+        creator_name = profile.full_name
 
-    note = f"""RAD Panel User
-Created by: {creator_name}
-Created at: {datetime.utcnow().isoformat()}
-Plan: {plan.name}
-Price: {price} IRR
-"""
+    note = marzban_note(creator_name, plan, price)
 
     # Create user in Marzban
     try:
@@ -169,81 +248,248 @@ Price: {price} IRR
             detail=f"Failed to create user in Marzban: {str(e)}"
         )
 
-    # Create order record
-    order = Order(
-        user_id=current_user.id,
-        plan_id=plan.id,
-        amount=price,
-        marzban_username=request.username,
-        alias=request.alias,
-        status=OrderStatus.ACTIVE
-    )
-    db.add(order)
-    await db.flush()
+    try:
+        # Lock the wallet and make sure it can still pay
+        credit_info = await get_user_credit_info(current_user, db, for_update=True)
+        check_credit(current_user, credit_info, price)
+
+        # Create order and marzban user records
+        order = add_order(
+            db, current_user.id, plan, price, request.username, request.alias,
+            node.id if node else None, request.on_hold, marzban_data
+        )
+        await db.flush()
 
-    # Create marzban user record
-    expire_date = None
-    if marzban_data.get("expire"):
-        expire_date = datetime.fromtimestamp(marzban_data["expire"])
+        await deduct_credit(current_user, price, order.id, db, profile=credit_info["profile"])
+        await stats.bump_counters(db, active_orders=1)
+        await analytics.record_sale(db, current_user.id, plan.id, price)
 
-    marzban_user = MarzbanUser(
-        order_id=order.id,
-        username=request.username,
-        subscription_url=marzban_data.get("subscription_url"),
-        expire_date=expire_date,
-        data_limit_gb=plan.data_limit_gb,
-        status=MarzbanUserStatus.ACTIVE if not request.on_hold else MarzbanUserStatus.DISABLED,
-        last_synced_at=datetime.utcnow()
+        await db.commit()
+    except Exception:
+        # Not paid for: remove the Marzban user again
+        await db.rollback()
+        try:
+            await marzban.delete_user(request.username)
+        except Exception as e:
+            logger.error(f"Failed to delete unpaid Marzban user {request.username}: {e}")
+        raise
+
+    return order_to_detail(order)
+
+
+@router.post("/bulk", response_model=BulkOrderResponse)
+async def create_orders_bulk(
+    request: OrderBulkCreate,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
+):
+    """
+    Create up to BULK_ORDER_MAX_ITEMS orders of one plan.
+
+    Credit for all valid usernames is reserved in one transaction, then
+    the Marzban users are created in parallel (BULK_ORDER_CONCURRENCY).
+    Items that fail are refunded in one transaction; results are per item.
+    """
+    # Check the size before expanding a pattern
+    if not 1 <= request.size <= settings.BULK_ORDER_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Between 1 and {settings.BULK_ORDER_MAX_ITEMS} usernames are allowed"
+        )
+    usernames = request.expand_usernames()
+
+    result = await db.execute(
+        select(Plan).where(Plan.id == request.plan_id)
     )
-    db.add(marzban_user)
+    plan = result.scalar_one_or_none()
 
-    # Deduct credit
-    await deduct_credit(current_user, price, order.id, db)
+    if not plan or plan.status != PlanStatus.ACTIVE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid or inactive plan"
+        )
 
-    await db.commit()
+    if current_user.role == UserRole.AGENT:
+        price = plan.price_agent
+    else:
+        price = plan.price_public
+
+    # Reject invalid, repeated and already used usernames up front
+    errors = {}
+    unique = {}
+    duplicates = set()
+    for index, username in enumerate(usernames):
+        if username in unique:
+            duplicates.add(index)
+            continue
+        unique[username] = index
+        error = username_error(username)
+        if error:
+            errors[username] = error
 
-    # Reload with relationships
     result = await db.execute(
-        select(Order)
-        .options(joinedload(Order.plan), joinedload(Order.marzban_user))
-        .where(Order.id == order.id)
+        select(Order.marzban_username).where(Order.marzban_username.in_(list(unique)))
     )
-    order = result.scalar_one()
+    for (username,) in result.all():
+        errors.setdefault(username, f"Username '{username}' already exists")
 
-    return order_to_detail(order)
+    candidates = [username for username in unique if username not in errors]
+    reserved = price * len(candidates)
+
+    refunded = Decimal(0)
+    orders = {}
+
+    if candidates:
+        try:
+            node = await registry.choose_node(db)
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e)
+            )
+        marzban = registry.get_client(node)
+
+        # Check and reserve credit for the whole batch (profile row locked
+        # only until the reservation is committed)
+        credit_info = await get_user_credit_info(current_user, db, for_update=True)
+        check_credit(current_user, credit_info, reserved)
+        profile = credit_info["profile"]
+
+        await deduct_credit(
+            current_user, reserved, None, db, profile=profile,
+            notes=f"Bulk order reservation: {len(candidates)} x {plan.name}"
+        )
+        # The reservation stands on its own; failed items are refunded below
+        await db.commit()
+
+        creator_name = current_user.username
+        if current_user.role == UserRole.AGENT:
+            creator_name = profile.full_name
+        note = marzban_note(creator_name, plan, price)
+        semaphore = asyncio.Semaphore(settings.BULK_ORDER_CONCURRENCY)
+
+        async def create_user(username: str) -> dict:
+            async with semaphore:
+                return await marzban.create_user(
+                    username=username,
+                    days=plan.days,
+                    data_limit_gb=plan.data_limit_gb,
+                    note=note,
+                    on_hold=request.on_hold
+                )
+
+        results = await asyncio.gather(
+            *(create_user(username) for username in candidates),
+            return_exceptions=True
+        )
+        for username, data in zip(candidates, results):
+            if isinstance(data, Exception):
+                errors[username] = f"Failed to create user in Marzban: {data}"
+            else:
+                orders[username] = add_order(
+                    db, current_user.id, plan, price, username, request.alias,
+                    node.id if node else None, request.on_hold, data
+                )
+
+        failed = len(candidates) - len(orders)
+        try:
+            if failed:
+                refunded = price * failed
+                await refund_credit(
+                    current_user,
+                    refunded,
+                    None,
+                    f"Refund for {failed} failed bulk orders",
+                    db
+                )
+            if orders:
+                await stats.bump_counters(db, active_orders=len(orders))
+                await analytics.record_sale(
+                    db, current_user.id, plan.id, price * len(orders), count=len(orders)
+                )
+            await db.commit()
+        except Exception:
+            # Could not record the orders: undo the Marzban users and refund
+            # the whole reservation
+            await db.rollback()
+            await asyncio.gather(
+                *(marzban.delete_user(username) for username in orders),
+                return_exceptions=True
+            )
+            # The rollback expired the user; reload it before refunding
+            await db.refresh(current_user)
+            await refund_credit(
+                current_user,
+                reserved,
+                None,
+                "Refund for failed bulk order",
+                db
+            )
+            await db.commit()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to save orders; the reservation was refunded"
+            )
+
+    items = []
+    for index, username in enumerate(usernames):
+        if index in duplicates:
+            items.append(BulkOrderItem(
+                username=username, success=False, error="Duplicate username in request"
+            ))
+        elif username in orders:
+            items.append(BulkOrderItem(
+                username=username, success=True, order=order_to_detail(orders[username])
+            ))
+        else:
+            items.append(BulkOrderItem(
+                username=username, success=False, error=errors[username]
+            ))
+
+    return BulkOrderResponse(
+        plan_id=plan.id,
+        requested=len(usernames),
+        created=len(orders),
+        failed=len(usernames) - len(orders),
+        amount_charged=reserved - refunded,
+        amount_refunded=refunded,
+        items=items
+    )
 
 
 @router.get("/my", response_model=OrderListResponse)
 async def get_my_orders(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (overrides page)"),
+    include_total: bool = True,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get current user's orders"""
-    query = (
-        select(Order)
-        .options(joinedload(Order.plan), joinedload(Order.marzban_user))
-        .where(Order.user_id == current_user.id)
-        .order_by(Order.created_at.desc())
-    )
+    """Get current user's orders (newest first)"""
+    query = select(Order).where(Order.user_id == current_user.id)
 
     # Count
-    count_result = await db.execute(
-        select(func.count(Order.id)).where(Order.user_id == current_user.id)
-    )
-    total = count_result.scalar()
+    total, total_exact = await count_rows(db, query) if include_total else (None, True)
 
     # Paginate
-    query = query.offset((page - 1) * page_size).limit(page_size)
-    result = await db.execute(query)
-    orders = result.scalars().all()
+    try:
+        orders, next_cursor = await paginate(
+            db,
+            query.options(joinedload(Order.plan), joinedload(Order.marzban_user)),
+            Order, page, page_size, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
     return OrderListResponse(
         orders=[order_to_response(o) for o in orders],
         total=total,
+        total_exact=total_exact,
         page=page,
-        page_size=page_size
+        page_size=page_size,
+        next_cursor=next_cursor
     )
 
 
@@ -282,7 +528,7 @@ async def delete_order(
     order_id: int,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
-    marzban: MarzbanClient = Depends(get_marzban_client)
+    registry: MarzbanNodeRegistry = Depends(get_node_registry)
 ):
     """
     Delete an order and its Marzban user.
@@ -292,6 +538,7 @@ async def delete_order(
         select(Order)
         .options(joinedload(Order.plan), joinedload(Order.marzban_user))
         .where(Order.id == order_id)
+        .with_for_update(of=Order)  # Concurrent deletes must not refund twice
     )
     order = result.scalar_one_or_none()
 
@@ -317,6 +564,7 @@ async def delete_order(
     # Get usage from Marzban
     used_gb = 0
     try:
+        marzban = await registry.client_for_node_id(db, order.node_id)
         usage = await marzban.get_user_usage(order.marzban_username)
         if usage:
             used_gb = usage["used_gb"]
@@ -330,12 +578,15 @@ async def delete_order(
 
     # Delete from Marzban
     try:
+        marzban = await registry.client_for_node_id(db, order.node_id)
         await marzban.delete_user(order.marzban_username)
     except Exception as e:
         # Log but don't fail - maybe already deleted
         pass
 
     # Update order status
+    if order.status == OrderStatus.ACTIVE:
+        await stats.bump_counters(db, active_orders=-1)
     order.status = OrderStatus.DELETED
     order.deleted_at = datetime.utcnow()
 
@@ -358,6 +609,7 @@ async def delete_order(
             f"Refund for deleted order #{order.id}",
             db
         )
+        await analytics.record_refund(db, order.user_id, order.plan_id, refund_amount)
         refund_message = f"Refunded {refund_amount} to wallet"
 
     await db.commit()
@@ -372,35 +624,35 @@ async def list_all_orders(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     status_filter: str = Query(None, alias="status"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (overrides page)"),
+    include_total: bool = True,
     admin: User = Depends(get_admin_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """List all orders (Admin only)"""
-    query = (
-        select(Order)
-        .options(joinedload(Order.plan), joinedload(Order.marzban_user))
-    )
+    """List all orders, newest first (Admin only)"""
+    query = select(Order)
 
     if status_filter:
         query = query.where(Order.status == OrderStatus(status_filter))
 
-    query = query.order_by(Order.created_at.desc())
-
     # Count
-    count_query = select(func.count(Order.id))
-    if status_filter:
-        count_query = count_query.where(Order.status == OrderStatus(status_filter))
-    count_result = await db.execute(count_query)
-    total = count_result.scalar()
+    total, total_exact = await count_rows(db, query) if include_total else (None, True)
 
     # Paginate
-    query = query.offset((page - 1) * page_size).limit(page_size)
-    result = await db.execute(query)
-    orders = result.scalars().all()
+    try:
+        orders, next_cursor = await paginate(
+            db,
+            query.options(joinedload(Order.plan), joinedload(Order.marzban_user)),
+            Order, page, page_size, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
     return OrderListResponse(
         orders=[order_to_response(o) for o in orders],
         total=total,
+        total_exact=total_exact,
         page=page,
-        page_size=page_size
+        page_size=page_size,
+        next_cursor=next_cursor
     )
@@ -7,15 +7,18 @@ Payments API
 import os
 import uuid
 from datetime import datetime
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 from decimal import Decimal
 
 from app.database import get_db
 from app.config import settings
 from app.utils.deps import get_admin_user, get_current_user
+from app.utils.rate_limit import rate_limit
+from app.utils.pagination import paginate, count_rows
 from app.models.user import User, UserRole
 from app.models.payment import Payment, PaymentStatus
 from app.models.payment_method import PaymentMethod
@@ -28,6 +31,7 @@ from app.schemas.payment import (
 )
 from app.schemas.auth import MessageResponse
 from app.services.credit import add_pending_credit, approve_payment, reject_payment
+from app.services import stats, analytics
 
 router = APIRouter()
 
@@ -48,7 +52,11 @@ def payment_to_response(payment: Payment) -> PaymentResponse:
     )
 
 
-@router.post("/payments/upload", response_model=PaymentResponse)
+@router.post(
+    "/payments/upload",
+    response_model=PaymentResponse,
+    dependencies=[Depends(rate_limit("upload", settings.UPLOAD_RATE_PER_USER, scope="user"))]
+)
 async def upload_payment(
     amount: Decimal = Form(..., gt=0),
     payment_method_id: int = Form(...),
@@ -106,6 +114,7 @@ async def upload_payment(
 
     # Add pending credit
     await add_pending_credit(current_user, amount, payment.id, db)
+    await stats.bump_counters(db, pending_payments=1)
 
     await db.commit()
 
@@ -124,33 +133,34 @@ async def upload_payment(
 async def get_my_payments(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (overrides page)"),
+    include_total: bool = True,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get current user's payment history"""
-    query = (
-        select(Payment)
-        .options(joinedload(Payment.user), joinedload(Payment.payment_method))
-        .where(Payment.user_id == current_user.id)
-        .order_by(Payment.created_at.desc())
-    )
+    """Get current user's payment history (newest first)"""
+    query = select(Payment).where(Payment.user_id == current_user.id)
 
     # Count
-    count_result = await db.execute(
-        select(func.count(Payment.id)).where(Payment.user_id == current_user.id)
-    )
-    total = count_result.scalar()
+    total, total_exact = await count_rows(db, query) if include_total else (None, True)
 
     # Paginate
-    query = query.offset((page - 1) * page_size).limit(page_size)
-    result = await db.execute(query)
-    payments = result.scalars().all()
+    try:
+        payments, next_cursor = await paginate(
+            db,
+            query.options(joinedload(Payment.user), joinedload(Payment.payment_method)),
+            Payment, page, page_size, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
     return PaymentListResponse(
         payments=[payment_to_response(p) for p in payments],
         total=total,
+        total_exact=total_exact,
         page=page,
-        page_size=page_size
+        page_size=page_size,
+        next_cursor=next_cursor
     )
 
 
@@ -161,37 +171,37 @@ async def list_payments(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     status_filter: str = Query(None, alias="status"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (overrides page)"),
+    include_total: bool = True,
     admin: User = Depends(get_admin_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """List all payments (Admin only)"""
-    query = (
-        select(Payment)
-        .options(joinedload(Payment.user), joinedload(Payment.payment_method))
-    )
+    """List all payments, newest first (Admin only)"""
+    query = select(Payment)
 
     if status_filter:
         query = query.where(Payment.status == PaymentStatus(status_filter))
 
-    query = query.order_by(Payment.created_at.desc())
-
     # Count
-    count_query = select(func.count(Payment.id))
-    if status_filter:
-        count_query = count_query.where(Payment.status == PaymentStatus(status_filter))
-    count_result = await db.execute(count_query)
-    total = count_result.scalar()
+    total, total_exact = await count_rows(db, query) if include_total else (None, True)
 
     # Paginate
-    query = query.offset((page - 1) * page_size).limit(page_size)
-    result = await db.execute(query)
-    payments = result.scalars().all()
+    try:
+        payments, next_cursor = await paginate(
+            db,
+            query.options(joinedload(Payment.user), joinedload(Payment.payment_method)),
+            Payment, page, page_size, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
     return PaymentListResponse(
         payments=[payment_to_response(p) for p in payments],
         total=total,
+        total_exact=total_exact,
         page=page,
-        page_size=page_size
+        page_size=page_size,
+        next_cursor=next_cursor
     )
 
 
@@ -199,11 +209,13 @@ async def list_payments(
 async def list_pending_payments(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (overrides page)"),
+    include_total: bool = True,
     admin: User = Depends(get_admin_user),
     db: AsyncSession = Depends(get_db)
 ):
     """List pending payments for approval (Admin only)"""
-    return await list_payments(page, page_size, "PENDING", admin, db)
+    return await list_payments(page, page_size, "PENDING", cursor, include_total, admin, db)
 
 
 @router.put("/admin/payments/{payment_id}/approve", response_model=PaymentResponse)
@@ -218,6 +230,7 @@ async def approve_payment_endpoint(
         select(Payment)
         .options(joinedload(Payment.user), joinedload(Payment.payment_method))
         .where(Payment.id == payment_id)
+        .with_for_update(of=Payment)  # Approve/reject at most once
     )
     payment = result.scalar_one_or_none()
 
@@ -248,6 +261,8 @@ async def approve_payment_endpoint(
         request.admin_notes,
         db
     )
+    await stats.bump_counters(db, pending_payments=-1, revenue=payment.amount)
+    await analytics.record_revenue(db, payment.user_id, payment.amount)
 
     await db.commit()
     await db.refresh(payment)
@@ -267,6 +282,7 @@ async def reject_payment_endpoint(
         select(Payment)
         .options(joinedload(Payment.user), joinedload(Payment.payment_method))
         .where(Payment.id == payment_id)
+        .with_for_update(of=Payment)  # Approve/reject at most once
     )
     payment = result.scalar_one_or_none()
 
@@ -297,6 +313,7 @@ async def reject_payment_endpoint(
         request.admin_notes,
         db
     )
+    await stats.bump_counters(db, pending_payments=-1)
 
     await db.commit()
     await db.refresh(payment)
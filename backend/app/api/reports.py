@@ -1,22 +1,30 @@
 """
-Reports API - Excel export
+Reports API - Transaction export (XLSX, CSV, Parquet) and background report jobs
 """
-import io
-from datetime import datetime, date
-from decimal import Decimal
-from fastapi import APIRouter, Depends, Query
+import os
+from datetime import datetime, date, timedelta
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from sqlalchemy.orm import joinedload
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
 from typing import Optional, List
 
 from app.database import get_db
 from app.utils.deps import get_admin_user
 from app.models.user import User
-from app.models.transaction import Transaction, TransactionType
+from app.models.report_job import ReportJob, ReportJobStatus
+from app.schemas.report_job import ReportJobCreate, ReportJobResponse
+from app.schemas.analytics import SalesSeriesResponse, RevenueSeriesResponse
+from app.utils.range_requests import file_response
+from app.services.report_jobs import submit_report, report_worker
+from app.services import stats, analytics
+from app.services.export import (
+    validate_export,
+    export_filename,
+    export_media_type,
+    transaction_export_query,
+    stream_transactions
+)
 
 router = APIRouter()
 
@@ -27,144 +35,263 @@ async def export_transactions(
     date_to: Optional[date] = Query(None),
     agent_ids: Optional[List[int]] = Query(None),
     types: Optional[List[str]] = Query(None),
-    admin: User = Depends(get_admin_user),
-    db: AsyncSession = Depends(get_db)
+    export_format: str = Query("xlsx", alias="format"),
+    columns: Optional[List[str]] = Query(None),
+    compression: Optional[str] = Query(None),
+    admin: User = Depends(get_admin_user)
 ):
     """
-    Export transactions to Excel file.
+    Export transactions to an Excel, CSV or Parquet file.
 
     Filters:
     - date_from, date_to: Date range
     - agent_ids: Filter by specific agent user IDs
     - types: Transaction types (CHARGE_PENDING, CHARGE_APPROVED, etc.)
+
+    Output:
+    - format: xlsx (default), csv or parquet
+    - columns: Columns to include (id, date, time, user, type, amount,
+      balance_before, balance_after, notes); default all
+    - compression: gzip or zstd (csv and parquet only)
+
+    Rows are read in chunks and streamed, so memory use does not grow
+    with the size of the report.
     """
-    query = (
-        select(Transaction)
-        .options(joinedload(Transaction.user))
-        .order_by(Transaction.created_at.desc())
-    )
+    try:
+        columns = validate_export(export_format, columns, compression)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
 
-    # Apply filters
-    if date_from:
-        query = query.where(Transaction.created_at >= datetime.combine(date_from, datetime.min.time()))
-    if date_to:
-        query = query.where(Transaction.created_at <= datetime.combine(date_to, datetime.max.time()))
-    if agent_ids:
-        query = query.where(Transaction.user_id.in_(agent_ids))
-    if types:
-        type_enums = [TransactionType(t) for t in types if t in [e.value for e in TransactionType]]
-        if type_enums:
-            query = query.where(Transaction.type.in_(type_enums))
-
-    result = await db.execute(query)
-    transactions = result.scalars().all()
-
-    # Create Excel workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Transactions"
-
-    # Header style
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-    header_alignment = Alignment(horizontal="center")
-
-    # Headers
-    headers = [
-        "ID",
-        "تاریخ",
-        "ساعت",
-        "کاربر",
-        "نوع تراکنش",
-        "مبلغ",
-        "موجودی قبل",
-        "موجودی بعد",
-        "توضیحات"
-    ]
-
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-
-    # Data rows
-    for row_num, tx in enumerate(transactions, 2):
-        ws.cell(row=row_num, column=1, value=tx.id)
-        ws.cell(row=row_num, column=2, value=tx.created_at.strftime("%Y-%m-%d"))
-        ws.cell(row=row_num, column=3, value=tx.created_at.strftime("%H:%M:%S"))
-        ws.cell(row=row_num, column=4, value=tx.user.username if tx.user else "")
-        ws.cell(row=row_num, column=5, value=tx.type.value)
-        ws.cell(row=row_num, column=6, value=float(tx.amount))
-        ws.cell(row=row_num, column=7, value=float(tx.balance_before))
-        ws.cell(row=row_num, column=8, value=float(tx.balance_after))
-        ws.cell(row=row_num, column=9, value=tx.notes or "")
-
-    # Auto-adjust column widths
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column].width = adjusted_width
-
-    # Save to bytes
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    # Generate filename
-    now = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"RAD_Report_{now}.xlsx"
+    query = transaction_export_query(date_from, date_to, agent_ids, types, columns)
+    filename = export_filename(export_format, compression)
 
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        stream_transactions(query, columns, export_format, compression),
+        media_type=export_media_type(export_format, compression),
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 
-@router.get("/stats")
-async def get_stats(
+def job_to_response(job: ReportJob, cached: bool = False) -> ReportJobResponse:
+    return ReportJobResponse(
+        id=job.id,
+        status=job.status.value,
+        params=job.params,
+        cached=cached,
+        file_name=job.file_name,
+        file_size=job.file_size,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at
+    )
+
+
+async def _get_job_or_404(job_id: int, db: AsyncSession) -> ReportJob:
+    job = await db.get(ReportJob, job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Report job not found"
+        )
+    return job
+
+
+@router.post("/jobs", response_model=ReportJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_report_job(
+    request: ReportJobCreate,
     admin: User = Depends(get_admin_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get dashboard statistics (Admin only)"""
-    from sqlalchemy import func
-    from app.models.agent import Agent
-    from app.models.order import Order, OrderStatus
-    from app.models.payment import Payment, PaymentStatus
+    """
+    Generate a transaction export in the background (Admin only).
 
-    # Count agents
-    result = await db.execute(select(func.count(Agent.id)))
-    total_agents = result.scalar() or 0
+    Takes the same filters and output options as /export. If an identical
+    report is already queued, or was generated and no transaction has been
+    added since, that job is returned instead (cached=true).
+    Poll GET /jobs/{id} (optionally with ?wait=seconds) until COMPLETED,
+    then download from /jobs/{id}/download.
+    """
+    try:
+        job, cached = await submit_report(db, admin.id, request.model_dump())
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
 
-    # Count active orders
-    result = await db.execute(
-        select(func.count(Order.id)).where(Order.status == OrderStatus.ACTIVE)
-    )
-    active_orders = result.scalar() or 0
+    return job_to_response(job, cached)
 
-    # Count pending payments
+
+@router.get("/jobs", response_model=List[ReportJobResponse])
+async def list_report_jobs(
+    limit: int = Query(50, ge=1, le=200),
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """List recent report jobs (Admin only)"""
     result = await db.execute(
-        select(func.count(Payment.id)).where(Payment.status == PaymentStatus.PENDING)
+        select(ReportJob).order_by(ReportJob.id.desc()).limit(limit)
     )
-    pending_payments = result.scalar() or 0
+    return [job_to_response(job) for job in result.scalars().all()]
 
-    # Total revenue (approved payments)
-    result = await db.execute(
-        select(func.sum(Payment.amount)).where(Payment.status == PaymentStatus.APPROVED)
+
+@router.get("/jobs/{job_id}", response_model=ReportJobResponse)
+async def get_report_job(
+    job_id: int,
+    wait: int = Query(0, ge=0, le=60),
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get a report job (Admin only).
+    With wait > 0, blocks up to that many seconds for the job to finish.
+    """
+    job = await _get_job_or_404(job_id, db)
+
+    if wait and job.status in (ReportJobStatus.PENDING, ReportJobStatus.RUNNING):
+        await report_worker.wait(job_id, wait)
+        await db.refresh(job)
+
+    return job_to_response(job)
+
+
+@router.get("/jobs/{job_id}/download")
+async def download_report_job(
+    job_id: int,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None, alias="If-Range"),
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Download the file of a completed report job (Admin only).
+    Supports single-range requests for resuming interrupted downloads.
+    """
+    job = await _get_job_or_404(job_id, db)
+
+    if job.status != ReportJobStatus.COMPLETED:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Report is not ready (status: {job.status.value})"
+        )
+    if not job.file_path or not os.path.exists(job.file_path):
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Report file has expired, submit the report again"
+        )
+
+    return file_response(
+        job.file_path,
+        job.file_name,
+        export_media_type(job.params["format"], job.params["compression"]),
+        range_header,
+        if_range
     )
-    total_revenue = result.scalar() or Decimal(0)
+
+
+@router.get("/stats")
+async def get_stats(
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get dashboard statistics (Admin only)"""
+    counters = await stats.get_counters(db)
+
+    return {
+        "total_agents": int(counters[stats.AGENTS]),
+        "active_orders": int(counters[stats.ACTIVE_ORDERS]),
+        "pending_payments": int(counters[stats.PENDING_PAYMENTS]),
+        "total_revenue": float(counters[stats.REVENUE])
+    }
+
+
+def _analytics_range(date_from: Optional[date], date_to: Optional[date]):
+    """Default to the last 30 days"""
+    date_to = date_to or datetime.utcnow().date()
+    date_from = date_from or date_to - timedelta(days=29)
+    if date_from > date_to:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="date_from must not be after date_to"
+        )
+    return date_from, date_to
+
+
+@router.get("/analytics/sales", response_model=SalesSeriesResponse, response_model_exclude_none=True)
+async def get_sales_analytics(
+    bucket: str = Query("day", pattern="^(hour|day|month)$"),
+    date_from: Optional[date] = Query(None),
+    date_to: Optional[date] = Query(None),
+    agent_ids: Optional[List[int]] = Query(None),
+    plan_ids: Optional[List[int]] = Query(None),
+    group_by: Optional[str] = Query(None, pattern="^(agent|plan)$"),
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Orders, sales and refunds over time (Admin only).
+
+    - bucket: hour, day or month (UTC)
+    - date_from, date_to: Date range (default: last 30 days)
+    - agent_ids, plan_ids: Only these users / plans
+    - group_by: Split each period per agent or per plan
+    """
+    date_from, date_to = _analytics_range(date_from, date_to)
+
+    return {
+        "bucket": bucket,
+        "date_from": date_from,
+        "date_to": date_to,
+        "series": await analytics.sales_series(
+            db, bucket, date_from, date_to, agent_ids, plan_ids, group_by
+        )
+    }
+
+
+@router.get("/analytics/revenue", response_model=RevenueSeriesResponse, response_model_exclude_none=True)
+async def get_revenue_analytics(
+    bucket: str = Query("day", pattern="^(hour|day|month)$"),
+    date_from: Optional[date] = Query(None),
+    date_to: Optional[date] = Query(None),
+    agent_ids: Optional[List[int]] = Query(None),
+    group_by: Optional[str] = Query(None, pattern="^agent$"),
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Approved payments over time (Admin only).
+
+    - bucket: hour, day or month (UTC)
+    - date_from, date_to: Date range (default: last 30 days)
+    - agent_ids: Only these users
+    - group_by: "agent" to split each period per user
+    """
+    date_from, date_to = _analytics_range(date_from, date_to)
+
+    return {
+        "bucket": bucket,
+        "date_from": date_from,
+        "date_to": date_to,
+        "series": await analytics.revenue_series(
+            db, bucket, date_from, date_to, agent_ids, group_by
+        )
+    }
+
+
+@router.post("/stats/rebuild")
+async def rebuild_stats(
+    admin: User = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Recompute dashboard statistics and analytics rollups from the source tables (Admin only)"""
+    counters = await stats.rebuild_stats(db)
+    rollups = await analytics.rebuild_rollups(db)
 
     return {
-        "total_agents": total_agents,
-        "active_orders": active_orders,
-        "pending_payments": pending_payments,
-        "total_revenue": float(total_revenue)
+        "counters": {name: float(value) for name, value in counters.items()},
+        "rollups": rollups
     }
@@ -28,7 +28,7 @@ class ProfileResponse(BaseModel):
     shop_name: Optional[str] = None
     credit_confirmed: Optional[Decimal] = None
     credit_pending: Optional[Decimal] = None
-    total_credit: Optional[float] = None
+    total_credit: Optional[Decimal] = None
 
 
 class ProfileUpdate(BaseModel):
@@ -124,7 +124,7 @@ async def update_my_profile(
 class WalletResponse(BaseModel):
     credit_confirmed: Decimal
     credit_pending: Decimal
-    total_credit: float
+    total_credit: Decimal
     is_negative: bool
     can_create_users: bool
 
@@ -174,7 +174,7 @@ async def get_my_wallet(
         return WalletResponse(
             credit_confirmed=Decimal(0),
             credit_pending=Decimal(0),
-            total_credit=0,
+            total_credit=Decimal(0),
             is_negative=False,
             can_create_users=True
         )
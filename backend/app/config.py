@@ -18,18 +18,99 @@ class Settings(BaseSettings):
 
     # Security
     SECRET_KEY: str = "your-secret-key-change-in-production"
+    SECRET_ENCRYPTION_KEY: str = ""  # Fernet key for stored credentials (empty = derived from SECRET_KEY)
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_DAYS: int = 7
+    JWT_BACKEND: str = "jose"  # "jose" or "pyjwt" (requires PyJWT)
+    TOKEN_CACHE_SIZE: int = 10000  # Verified tokens cached (0 = off)
+    TOKEN_CACHE_TTL: int = 3600  # Max seconds a verified token is cached (capped by exp)
+    PRINCIPAL_CACHE_TTL: int = 10  # Seconds an authenticated user is cached (0 = off)
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    BCRYPT_ROUNDS: int = 12  # Hashes with another cost are upgraded on login
+    PASSWORD_HASH_WORKERS: int = 2  # Threads for bcrypt
+    PASSWORD_HASH_MAX_QUEUE: int = 32  # Waiting operations before 503
+
+    # Rate limiting (requests per minute, 0 = unlimited)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_REDIS_URL: Optional[str] = None  # Shared buckets (requires redis)
+    # Peers (IPs or CIDR networks) whose X-Real-IP header is trusted, e.g. nginx
+    RATE_LIMIT_TRUSTED_PROXIES: list = []
+    RATE_LIMIT_MAX_KEYS: int = 100000  # In-memory buckets kept
+    LOGIN_RATE_PER_IP: int = 10
+    LOGIN_RATE_PER_USERNAME: int = 5
+    LOGIN_RATE_GLOBAL: int = 300
+    REGISTER_RATE_PER_IP: int = 3
+    CHECK_USERNAME_RATE_PER_USER: int = 60
+    UPLOAD_RATE_PER_USER: int = 10
 
     # Marzban
     MARZBAN_URL: str = "https://your-marzban-panel.com"
     MARZBAN_USERNAME: str = "admin"
     MARZBAN_PASSWORD: str = "password"
+    MARZBAN_TOKEN_REFRESH_MARGIN: int = 300  # Seconds before exp to refresh
+    # Node for new users when several panels are registered:
+    # "health_aware", "least_users" or "weighted"
+    MARZBAN_PLACEMENT_STRATEGY: str = "health_aware"
+
+    # Marzban HTTP connection pool
+    MARZBAN_MAX_CONNECTIONS: int = 100
+    MARZBAN_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    MARZBAN_KEEPALIVE_EXPIRY: float = 60.0  # Seconds an idle connection is kept
+    MARZBAN_HTTP2: bool = False  # Requires h2 (pip install httpx[http2])
+    MARZBAN_CONNECT_TIMEOUT: float = 10.0
+    MARZBAN_READ_TIMEOUT: float = 30.0
+    MARZBAN_WRITE_TIMEOUT: float = 30.0
+    MARZBAN_POOL_TIMEOUT: float = 5.0  # Max wait for a free connection
+
+    # Marzban retries (GET/DELETE only) and circuit breaker
+    MARZBAN_RETRY_ATTEMPTS: int = 2
+    MARZBAN_RETRY_BACKOFF: float = 0.2  # Seconds, doubled per attempt
+    MARZBAN_RETRY_BACKOFF_MAX: float = 2.0
+    MARZBAN_BREAKER_WINDOW: int = 20  # Recent calls considered
+    MARZBAN_BREAKER_MIN_CALLS: int = 10
+    MARZBAN_BREAKER_FAILURE_RATIO: float = 0.5
+    MARZBAN_BREAKER_RESET_TIMEOUT: float = 30.0  # Seconds before a probe call
 
     # Proxy (optional, for connecting to Marzban from Iran)
     HTTP_PROXY: Optional[str] = None
     HTTPS_PROXY: Optional[str] = None
 
+    # Marzban response cache
+    MARZBAN_CACHE_TTL: int = 30  # Seconds
+    MARZBAN_CACHE_SIZE: int = 5000  # Max cached users
+
+    # Marzban sync
+    MARZBAN_SYNC_MODE: str = "bulk"  # Full sync: "bulk" (paginated listing) or "per_user"
+    MARZBAN_SYNC_CONCURRENCY: int = 20  # Parallel requests in per-user modes
+    MARZBAN_SYNC_BATCH_SIZE: int = 500  # Users per DB commit
+    MARZBAN_SYNC_PAGE_SIZE: int = 1000  # Users per listing page in bulk mode
+    MARZBAN_SYNC_INCREMENTAL_LIMIT: int = 2000  # Users checked per incremental run
+    MARZBAN_SYNC_INCREMENTAL_MINUTES: int = 60  # Incremental sync interval
+
+    # Negative credit enforcement
+    NEGATIVE_CREDIT_CONCURRENCY: int = 20  # Parallel Marzban disables
+    NEGATIVE_CREDIT_BATCH_SIZE: int = 500  # Orders per DB commit
+
+    # Ledger
+    LEDGER_CHECKPOINT_LAG_SECONDS: int = 300  # Newer transactions wait for the next checkpoint run
+
+    # Bulk orders
+    BULK_ORDER_MAX_ITEMS: int = 100  # Usernames per request
+    BULK_ORDER_CONCURRENCY: int = 10  # Parallel Marzban user creations
+
+    # Report export
+    EXPORT_CHUNK_SIZE: int = 5000  # Rows fetched per DB round trip
+    EXPORT_SPOOL_MAX_SIZE: int = 16 * 1024 * 1024  # Bytes kept in memory before spilling to disk
+    REPORT_DIR: str = "reports"  # Files of background report jobs
+    REPORT_WORKERS: int = 2  # Reports generated concurrently
+    REPORT_RETENTION_DAYS: int = 7
+
+    # Dashboard stats
+    STATS_CACHE_TTL: int = 5  # Seconds to cache dashboard counters (0 = off)
+
+    # List pagination
+    PAGINATION_COUNT_LIMIT: int = 10000  # Stop counting list totals here (0 = exact)
+
     # File Upload
     UPLOAD_DIR: str = "uploads"
     MAX_UPLOAD_SIZE: int = 5 * 1024 * 1024  # 5MB
@@ -4,15 +4,10 @@ Background Jobs - Scheduled tasks
 from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from sqlalchemy import select, and_
-from sqlalchemy.orm import joinedload
 import logging
 
-from app.database import AsyncSessionLocal
-from app.models.agent import Agent
-from app.models.user import User, UserStatus
-from app.models.order import Order, OrderStatus
-from app.services.marzban import marzban_client
+from app.config import settings
+from app.services import credit_enforcement, ledger, marzban_sync, report_jobs
 
 logger = logging.getLogger(__name__)
 
@@ -28,127 +23,36 @@ async def check_negative_credit():
     """
     logger.info("Running negative credit check...")
 
-    async with AsyncSessionLocal() as db:
-        try:
-            # Find agents with negative credit for more than 24 hours
-            cutoff_time = datetime.utcnow() - timedelta(hours=24)
-
-            result = await db.execute(
-                select(Agent)
-                .options(joinedload(Agent.user))
-                .where(
-                    and_(
-                        Agent.negative_credit_since.isnot(None),
-                        Agent.negative_credit_since < cutoff_time,
-                        Agent.status == UserStatus.ACTIVE
-                    )
-                )
-            )
-            agents = result.scalars().all()
-
-            for agent in agents:
-                logger.warning(
-                    f"Agent {agent.user.username} has negative credit for >24h. "
-                    f"Disabling their users..."
-                )
-
-                # Get all active orders for this agent
-                orders_result = await db.execute(
-                    select(Order)
-                    .where(
-                        and_(
-                            Order.user_id == agent.user_id,
-                            Order.status == OrderStatus.ACTIVE
-                        )
-                    )
-                )
-                orders = orders_result.scalars().all()
-
-                disabled_count = 0
-                for order in orders:
-                    try:
-                        # Disable in Marzban
-                        await marzban_client.disable_user(order.marzban_username)
-
-                        # Update order status
-                        order.status = OrderStatus.DISABLED
-
-                        disabled_count += 1
-                        logger.info(f"Disabled Marzban user: {order.marzban_username}")
-
-                    except Exception as e:
-                        logger.error(
-                            f"Failed to disable user {order.marzban_username}: {e}"
-                        )
-
-                await db.commit()
-
-                logger.info(
-                    f"Disabled {disabled_count} users for agent {agent.user.username}"
-                )
-
-                # TODO: Send notification to agent (email/telegram)
-
-        except Exception as e:
-            logger.error(f"Error in negative credit check: {e}")
-            await db.rollback()
+    try:
+        await credit_enforcement.enforce_negative_credit()
+    except Exception as e:
+        logger.error(f"Error in negative credit check: {e}")
 
 
 async def sync_marzban_users():
     """
     Sync user data from Marzban (usage, status, etc.)
-    Runs every hour to keep local data up to date.
+    Runs every 2 hours to keep local data up to date.
     """
     logger.info("Running Marzban sync...")
 
-    async with AsyncSessionLocal() as db:
-        try:
-            from app.models.marzban_user import MarzbanUser, MarzbanUserStatus
-
-            # Get all active Marzban users
-            result = await db.execute(
-                select(MarzbanUser)
-                .where(MarzbanUser.status == MarzbanUserStatus.ACTIVE)
-            )
-            marzban_users = result.scalars().all()
-
-            synced_count = 0
-            for mu in marzban_users:
-                try:
-                    # Get user data from Marzban
-                    user_data = await marzban_client.get_user(mu.username)
-
-                    if user_data:
-                        # Update usage
-                        used_bytes = user_data.get("used_traffic", 0)
-                        mu.data_used_gb = int(used_bytes / (1024 * 1024 * 1024))
-
-                        # Update status
-                        marzban_status = user_data.get("status", "active")
-                        if marzban_status == "disabled":
-                            mu.status = MarzbanUserStatus.DISABLED
-                        elif marzban_status == "expired":
-                            mu.status = MarzbanUserStatus.EXPIRED
-                        elif marzban_status == "limited":
-                            mu.status = MarzbanUserStatus.LIMITED
-
-                        mu.last_synced_at = datetime.utcnow()
-                        synced_count += 1
-
-                    else:
-                        # User not found in Marzban
-                        mu.status = MarzbanUserStatus.DISABLED
-                        logger.warning(f"User {mu.username} not found in Marzban")
+    try:
+        await marzban_sync.sync_marzban_users()
+    except Exception as e:
+        logger.error(f"Error in Marzban sync: {e}")
 
-                except Exception as e:
-                    logger.error(f"Failed to sync user {mu.username}: {e}")
 
-            await db.commit()
-            logger.info(f"Synced {synced_count} Marzban users")
+async def sync_marzban_users_incremental():
+    """
+    Re-check the most stale and at-risk Marzban users.
+    Cost is proportional to churn rather than to fleet size.
+    """
+    logger.info("Running incremental Marzban sync...")
 
-        except Exception as e:
-            logger.error(f"Error in Marzban sync: {e}")
-            await db.rollback()
+    try:
+        await marzban_sync.sync_marzban_users(mode="incremental")
+    except Exception as e:
+        logger.error(f"Error in incremental Marzban sync: {e}")
 
 
 async def cleanup_old_uploads():
@@ -185,6 +89,32 @@ async def cleanup_old_uploads():
         logger.error(f"Error in upload cleanup: {e}")
 
 
+async def cleanup_old_reports():
+    """
+    Delete report jobs and files older than REPORT_RETENTION_DAYS.
+    """
+    logger.info("Running report cleanup...")
+
+    try:
+        deleted = await report_jobs.cleanup_report_jobs()
+        logger.info(f"Cleaned up {deleted} old report jobs")
+    except Exception as e:
+        logger.error(f"Error in report cleanup: {e}")
+
+
+async def reconcile_ledger():
+    """
+    Checkpoint agent balances and reconcile them against the ledger.
+    Mismatches are logged by the ledger service.
+    """
+    logger.info("Running ledger reconciliation...")
+
+    try:
+        await ledger.run_ledger_maintenance()
+    except Exception as e:
+        logger.error(f"Error in ledger reconciliation: {e}")
+
+
 def start_scheduler():
     """Start the background job scheduler"""
 
@@ -206,6 +136,15 @@ def start_scheduler():
         replace_existing=True
     )
 
+    # Incremental Marzban sync between full runs
+    scheduler.add_job(
+        sync_marzban_users_incremental,
+        trigger=IntervalTrigger(minutes=settings.MARZBAN_SYNC_INCREMENTAL_MINUTES),
+        id="sync_marzban_users_incremental",
+        name="Incremental sync from Marzban",
+        replace_existing=True
+    )
+
     # Cleanup old uploads daily at 4 AM
     scheduler.add_job(
         cleanup_old_uploads,
@@ -215,6 +154,24 @@ def start_scheduler():
         replace_existing=True
     )
 
+    # Cleanup expired report files daily
+    scheduler.add_job(
+        cleanup_old_reports,
+        trigger=IntervalTrigger(days=1),
+        id="cleanup_old_reports",
+        name="Clean up old report files",
+        replace_existing=True
+    )
+
+    # Balance checkpoints and reconciliation daily
+    scheduler.add_job(
+        reconcile_ledger,
+        trigger=IntervalTrigger(days=1),
+        id="reconcile_ledger",
+        name="Checkpoint and reconcile agent balances",
+        replace_existing=True
+    )
+
     scheduler.start()
     logger.info("Background scheduler started")
 
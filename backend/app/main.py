@@ -2,16 +2,22 @@
 RAD Panel - Main Application Entry Point
 VPN Sales Management System on top of Marzban
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 import os
 
 from app.config import settings
-from app.database import engine, Base
-from app.api import auth, agents, plans, payments, payment_methods, orders, marzban, reports, users
+from app.database import engine, Base, AsyncSessionLocal
+from app.api import auth, agents, plans, payments, payment_methods, orders, marzban, marzban_nodes, reports, users
 from app.jobs.scheduler import start_scheduler, stop_scheduler
+from app.services.marzban_nodes import node_registry
+from app.services.report_jobs import report_worker
+from app.services.stats import ensure_stats
+from app.services.analytics import ensure_rollups
+from app.utils.security import password_hasher, PasswordHasherBusy
 import logging
 
 # Configure logging
@@ -31,13 +37,22 @@ async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+    # Initialise dashboard counters and analytics rollups on first start
+    async with AsyncSessionLocal() as db:
+        await ensure_stats(db)
+        await ensure_rollups(db)
+
     # Start background jobs
     start_scheduler()
+    await report_worker.start()
 
     yield
 
     # Shutdown
     stop_scheduler()
+    await report_worker.stop()
+    await node_registry.close()
+    password_hasher.shutdown()
     await engine.dispose()
 
 
@@ -59,6 +74,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"}
+    )
+
+
 # Static files (uploads)
 app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
 
@@ -71,6 +95,7 @@ app.include_router(payments.router, prefix="/api", tags=["Payments"])
 app.include_router(payment_methods.router, prefix="/api", tags=["Payment Methods"])
 app.include_router(orders.router, prefix="/api/orders", tags=["Orders"])
 app.include_router(marzban.router, prefix="/api/marzban", tags=["Marzban"])
+app.include_router(marzban_nodes.router, prefix="/api/admin/marzban-nodes", tags=["Marzban Nodes"])
 app.include_router(reports.router, prefix="/api/admin/reports", tags=["Reports"])
 
 
@@ -9,7 +9,11 @@ from app.models.payment_method import PaymentMethod, PaymentMethodType
 from app.models.payment import Payment, PaymentStatus
 from app.models.order import Order, OrderStatus
 from app.models.marzban_user import MarzbanUser, MarzbanUserStatus
+from app.models.marzban_node import MarzbanNode, MarzbanNodeStatus
 from app.models.transaction import Transaction, TransactionType, ReferenceType
+from app.models.report_job import ReportJob, ReportJobStatus
+from app.models.balance_checkpoint import BalanceCheckpoint
+from app.models.stats import StatsCounter, StatsHourlySales, StatsHourlyRevenue
 
 __all__ = [
     "User", "UserRole", "UserStatus",
@@ -20,5 +24,9 @@ __all__ = [
     "Payment", "PaymentStatus",
     "Order", "OrderStatus",
     "MarzbanUser", "MarzbanUserStatus",
+    "MarzbanNode", "MarzbanNodeStatus",
     "Transaction", "TransactionType", "ReferenceType",
+    "ReportJob", "ReportJobStatus",
+    "BalanceCheckpoint",
+    "StatsCounter", "StatsHourlySales", "StatsHourlyRevenue",
 ]
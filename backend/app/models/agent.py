@@ -1,8 +1,11 @@
 """
 Agent Model - Agent profile with credit management
 """
-from sqlalchemy import Column, Integer, String, Text, Numeric, DateTime, Enum, ForeignKey, func
+from decimal import Decimal
+
+from sqlalchemy import Column, Integer, String, Text, Numeric, DateTime, Enum, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.hybrid import hybrid_property
 
 from app.database import Base
 from app.models.user import UserStatus
@@ -10,6 +13,11 @@ from app.models.user import UserStatus
 
 class Agent(Base):
     __tablename__ = "agents"
+    __table_args__ = (
+        # Keyset pagination (newest first) of the agent list
+        Index("ix_agents_status_created", "status", "created_at", "id"),
+        Index("ix_agents_created", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), unique=True, nullable=False)
@@ -25,8 +33,8 @@ class Agent(Base):
     notes = Column(Text, nullable=True)
 
     # Financial
-    credit_confirmed = Column(Numeric(15, 2), default=0.00)
-    credit_pending = Column(Numeric(15, 2), default=0.00)
+    credit_confirmed = Column(Numeric(15, 2), default=Decimal("0.00"))
+    credit_pending = Column(Numeric(15, 2), default=Decimal("0.00"))
     negative_credit_since = Column(DateTime(timezone=True), nullable=True)
 
     # Status
@@ -37,13 +45,17 @@ class Agent(Base):
     # Relationships
     user = relationship("User", back_populates="agent")
 
-    @property
-    def total_credit(self):
-        """Calculate total credit (confirmed + pending)"""
-        return float(self.credit_confirmed or 0) + float(self.credit_pending or 0)
+    @hybrid_property
+    def total_credit(self) -> Decimal:
+        """Total credit (confirmed + pending); also usable in queries"""
+        return (self.credit_confirmed or Decimal(0)) + (self.credit_pending or Decimal(0))
 
-    @property
-    def is_negative(self):
+    @total_credit.expression
+    def total_credit(cls):
+        return func.coalesce(cls.credit_confirmed, 0) + func.coalesce(cls.credit_pending, 0)
+
+    @hybrid_property
+    def is_negative(self) -> bool:
         """Check if agent has negative credit"""
         return self.total_credit < 0
 
@@ -0,0 +1,27 @@
+"""
+BalanceCheckpoint Model - Periodic ledger balances per user
+"""
+from sqlalchemy import Column, Integer, Numeric, DateTime, ForeignKey, UniqueConstraint, func
+
+from app.database import Base
+
+
+class BalanceCheckpoint(Base):
+    """
+    Balance of a user's ledger after all their transactions up to and
+    including `last_transaction_id` (sum of balance effects, not snapshots).
+    """
+    __tablename__ = "balance_checkpoints"
+    __table_args__ = (
+        UniqueConstraint("user_id", "last_transaction_id", name="uq_balance_checkpoints_user_tx"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    last_transaction_id = Column(Integer, nullable=False)
+    balance = Column(Numeric(15, 2), nullable=False)
+    as_of = Column(DateTime(timezone=True), nullable=False)  # created_at of that transaction
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<BalanceCheckpoint user={self.user_id} tx={self.last_transaction_id}: {self.balance}>"
@@ -1,8 +1,11 @@
 """
 EndUser Model - End user profile
 """
+from decimal import Decimal
+
 from sqlalchemy import Column, Integer, String, Boolean, Numeric, DateTime, Enum, ForeignKey, func
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.hybrid import hybrid_property
 
 from app.database import Base
 from app.models.user import UserStatus
@@ -19,8 +22,8 @@ class EndUser(Base):
     verified = Column(Boolean, default=False)
 
     # Financial
-    credit_confirmed = Column(Numeric(15, 2), default=0.00)
-    credit_pending = Column(Numeric(15, 2), default=0.00)
+    credit_confirmed = Column(Numeric(15, 2), default=Decimal("0.00"))
+    credit_pending = Column(Numeric(15, 2), default=Decimal("0.00"))
 
     # Status
     status = Column(Enum(UserStatus), default=UserStatus.ACTIVE)
@@ -30,10 +33,14 @@ class EndUser(Base):
     # Relationships
     user = relationship("User", back_populates="end_user")
 
-    @property
-    def total_credit(self):
-        """Calculate total credit (confirmed + pending)"""
-        return float(self.credit_confirmed or 0) + float(self.credit_pending or 0)
+    @hybrid_property
+    def total_credit(self) -> Decimal:
+        """Total credit (confirmed + pending); also usable in queries"""
+        return (self.credit_confirmed or Decimal(0)) + (self.credit_pending or Decimal(0))
+
+    @total_credit.expression
+    def total_credit(cls):
+        return func.coalesce(cls.credit_confirmed, 0) + func.coalesce(cls.credit_pending, 0)
 
     def __repr__(self):
         return f"<EndUser {self.user_id}>"
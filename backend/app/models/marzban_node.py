@@ -0,0 +1,52 @@
+"""
+MarzbanNode Model - Registered Marzban panels
+"""
+from sqlalchemy import Column, Integer, String, Text, DateTime, Enum, func
+from sqlalchemy.orm import relationship
+import enum
+
+from app.database import Base
+from app.utils.security import encrypt_secret, decrypt_secret
+
+
+class MarzbanNodeStatus(str, enum.Enum):
+    ACTIVE = "ACTIVE"        # Receives new users
+    DRAINING = "DRAINING"    # Serves existing users, no new placements
+    DISABLED = "DISABLED"    # Not used
+
+
+class MarzbanNode(Base):
+    __tablename__ = "marzban_nodes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), unique=True, nullable=False)
+
+    # Connection
+    url = Column(String(255), nullable=False)
+    username = Column(String(100), nullable=False)
+    password_encrypted = Column(Text, nullable=False)  # See `password`
+
+    # Placement
+    weight = Column(Integer, nullable=False, default=1)
+    max_users = Column(Integer, nullable=True)  # NULL = unlimited
+
+    status = Column(Enum(MarzbanNodeStatus), default=MarzbanNodeStatus.ACTIVE, index=True)
+    notes = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    # Relationships
+    orders = relationship("Order", back_populates="node")
+    marzban_users = relationship("MarzbanUser", back_populates="node")
+
+    @property
+    def password(self) -> str:
+        """Panel password, stored encrypted"""
+        return decrypt_secret(self.password_encrypted)
+
+    @password.setter
+    def password(self, value: str) -> None:
+        self.password_encrypted = encrypt_secret(value)
+
+    def __repr__(self):
+        return f"<MarzbanNode {self.name} ({self.status})>"
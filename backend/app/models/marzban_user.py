@@ -23,6 +23,7 @@ class MarzbanUser(Base):
 
     # Marzban data
     username = Column(String(100), unique=True, nullable=False, index=True)
+    node_id = Column(Integer, ForeignKey("marzban_nodes.id"), nullable=True, index=True)  # NULL = default panel
     subscription_url = Column(Text, nullable=True)
     expire_date = Column(DateTime(timezone=True), nullable=True)
     data_limit_gb = Column(Integer, nullable=True)
@@ -35,6 +36,7 @@ class MarzbanUser(Base):
 
     # Relationships
     order = relationship("Order", back_populates="marzban_user")
+    node = relationship("MarzbanNode", back_populates="marzban_users")
 
     @property
     def data_remaining_gb(self):
@@ -1,7 +1,7 @@
 """
 Order Model - VPN purchases
 """
-from sqlalchemy import Column, Integer, String, Numeric, DateTime, Enum, ForeignKey, func
+from sqlalchemy import Column, Integer, String, Numeric, DateTime, Enum, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
 import enum
 
@@ -16,6 +16,13 @@ class OrderStatus(str, enum.Enum):
 
 class Order(Base):
     __tablename__ = "orders"
+    __mapper_args__ = {"eager_defaults": True}  # Fetch created_at on INSERT (RETURNING)
+    __table_args__ = (
+        # Keyset pagination (newest first) of user/status/all order lists
+        Index("ix_orders_user_created", "user_id", "created_at", "id"),
+        Index("ix_orders_status_created", "status", "created_at", "id"),
+        Index("ix_orders_created", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -27,16 +34,18 @@ class Order(Base):
     # Marzban info
     marzban_username = Column(String(100), unique=True, nullable=False, index=True)
     alias = Column(String(200), nullable=True)  # User's display name
+    node_id = Column(Integer, ForeignKey("marzban_nodes.id"), nullable=True, index=True)  # NULL = default panel
 
     # Status
     status = Column(Enum(OrderStatus), default=OrderStatus.ACTIVE, index=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
     deleted_at = Column(DateTime(timezone=True), nullable=True)
 
     # Relationships
     user = relationship("User", back_populates="orders")
     plan = relationship("Plan", back_populates="orders")
     marzban_user = relationship("MarzbanUser", back_populates="order", uselist=False)
+    node = relationship("MarzbanNode", back_populates="orders")
 
     def __repr__(self):
         return f"<Order {self.id} ({self.marzban_username} - {self.status})>"
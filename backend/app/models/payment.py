@@ -1,7 +1,7 @@
 """
 Payment Model - Payment submissions with receipt
 """
-from sqlalchemy import Column, Integer, String, Text, Numeric, DateTime, Enum, ForeignKey, func
+from sqlalchemy import Column, Integer, String, Text, Numeric, DateTime, Enum, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
 import enum
 
@@ -16,6 +16,12 @@ class PaymentStatus(str, enum.Enum):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        # Keyset pagination (newest first) of user/status/all payment lists
+        Index("ix_payments_user_created", "user_id", "created_at", "id"),
+        Index("ix_payments_status_created", "status", "created_at", "id"),
+        Index("ix_payments_created", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -29,7 +35,7 @@ class Payment(Base):
     processed_at = Column(DateTime(timezone=True), nullable=True)
     processed_by = Column(Integer, ForeignKey("users.id"), nullable=True)
 
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationships
     user = relationship("User", back_populates="payments", foreign_keys=[user_id])
@@ -0,0 +1,44 @@
+"""
+ReportJob Model - Transaction exports generated in the background
+"""
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Enum, ForeignKey, func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import relationship
+import enum
+
+from app.database import Base
+
+
+class ReportJobStatus(str, enum.Enum):
+    PENDING = "PENDING"      # Waiting for a worker
+    RUNNING = "RUNNING"      # Being generated
+    COMPLETED = "COMPLETED"  # File ready for download
+    FAILED = "FAILED"
+
+
+class ReportJob(Base):
+    __tablename__ = "report_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    # Export parameters (filters, format, columns, compression)
+    params = Column(JSONB, nullable=False, default={})
+    # Hash of params + newest transaction id; equal keys give identical files
+    cache_key = Column(String(64), nullable=False, index=True)
+
+    status = Column(Enum(ReportJobStatus), default=ReportJobStatus.PENDING, index=True)
+    file_path = Column(String(500), nullable=True)
+    file_name = Column(String(255), nullable=True)
+    file_size = Column(BigInteger, nullable=True)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Relationships
+    creator = relationship("User")
+
+    def __repr__(self):
+        return f"<ReportJob {self.id} ({self.status})>"
@@ -0,0 +1,49 @@
+"""
+Stats Models - Dashboard counters and hourly rollups maintained incrementally
+"""
+from sqlalchemy import Column, Integer, String, Numeric, DateTime, ForeignKey, func
+
+from app.database import Base
+
+
+class StatsCounter(Base):
+    """One row per dashboard counter (agents, active_orders, ...)"""
+    __tablename__ = "stats_counters"
+
+    name = Column(String(50), primary_key=True)
+    value = Column(Numeric(20, 2), nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<StatsCounter {self.name}={self.value}>"
+
+
+class StatsHourlySales(Base):
+    """Orders sold and refunded per hour (UTC), user and plan"""
+    __tablename__ = "stats_hourly_sales"
+
+    hour = Column(DateTime, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True)
+    plan_id = Column(Integer, ForeignKey("plans.id", ondelete="CASCADE"), primary_key=True, index=True)
+
+    orders = Column(Integer, nullable=False, default=0)
+    sales = Column(Numeric(20, 2), nullable=False, default=0)  # Sum of order amounts
+    refunds = Column(Integer, nullable=False, default=0)
+    refunded = Column(Numeric(20, 2), nullable=False, default=0)  # Sum of refund amounts
+
+    def __repr__(self):
+        return f"<StatsHourlySales {self.hour} user={self.user_id} plan={self.plan_id}>"
+
+
+class StatsHourlyRevenue(Base):
+    """Approved payments per hour (UTC) and user"""
+    __tablename__ = "stats_hourly_revenue"
+
+    hour = Column(DateTime, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True)
+
+    payments = Column(Integer, nullable=False, default=0)
+    revenue = Column(Numeric(20, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<StatsHourlyRevenue {self.hour} user={self.user_id}>"
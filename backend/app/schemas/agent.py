@@ -4,7 +4,7 @@ Agent Schemas
 from pydantic import BaseModel, Field
 from typing import Optional
 from decimal import Decimal
-from datetime import datetime
+from datetime import date, datetime
 
 
 class AgentCreate(BaseModel):
@@ -50,7 +50,7 @@ class AgentResponse(BaseModel):
     city: Optional[str]
     credit_confirmed: Decimal
     credit_pending: Decimal
-    total_credit: float
+    total_credit: Decimal
     is_negative: bool
     status: str
     created_at: datetime
@@ -61,6 +61,52 @@ class AgentResponse(BaseModel):
 
 class AgentListResponse(BaseModel):
     agents: list[AgentResponse]
-    total: int
+    total: Optional[int] = None  # None when include_total=false
+    total_exact: bool = True  # False: at least `total` (PAGINATION_COUNT_LIMIT hit)
     page: int
     page_size: int
+    next_cursor: Optional[str] = None  # Pass as `cursor` for the next page
+
+
+class StatementEntry(BaseModel):
+    id: int
+    type: str
+    amount: Decimal
+    balance_before: Decimal
+    balance_after: Decimal
+    reference_type: Optional[str]
+    reference_id: Optional[int]
+    notes: Optional[str]
+    created_at: datetime
+
+
+class BalanceMismatch(BaseModel):
+    agent_id: int
+    user_id: int
+    username: str
+    stored_balance: Decimal
+    ledger_balance: Decimal
+    last_snapshot: Optional[Decimal]
+    difference: Decimal  # stored - ledger
+    chain_breaks: int
+    bad_rows: int
+
+
+class ReconciliationResponse(BaseModel):
+    checkpoints: int
+    checked_at: datetime
+    agents: int
+    mismatches: list[BalanceMismatch]
+    duration_seconds: float
+
+
+class AgentStatementResponse(BaseModel):
+    agent_id: int
+    date_from: date
+    date_to: date
+    opening_balance: Decimal
+    closing_balance: Decimal
+    total_credits: Decimal
+    total_debits: Decimal
+    entries: list[StatementEntry]
+    next_cursor: Optional[int]
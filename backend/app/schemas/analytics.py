@@ -0,0 +1,39 @@
+"""
+Analytics Schemas
+"""
+from pydantic import BaseModel
+from typing import Optional
+from decimal import Decimal
+from datetime import date
+
+
+class SalesPoint(BaseModel):
+    period: str
+    user_id: Optional[int] = None  # group_by=agent
+    plan_id: Optional[int] = None  # group_by=plan
+    orders: int
+    sales: Decimal
+    refunds: int
+    refunded: Decimal
+    net: Decimal
+
+
+class SalesSeriesResponse(BaseModel):
+    bucket: str
+    date_from: date
+    date_to: date
+    series: list[SalesPoint]
+
+
+class RevenuePoint(BaseModel):
+    period: str
+    user_id: Optional[int] = None  # group_by=agent
+    payments: int
+    revenue: Decimal
+
+
+class RevenueSeriesResponse(BaseModel):
+    bucket: str
+    date_from: date
+    date_to: date
+    series: list[RevenuePoint]
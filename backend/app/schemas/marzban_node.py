@@ -0,0 +1,49 @@
+"""
+Marzban Node Schemas
+"""
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import datetime
+
+
+class MarzbanNodeCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    url: str = Field(..., min_length=1, max_length=255)
+    username: str = Field(..., min_length=1, max_length=100)
+    password: str = Field(..., min_length=1, max_length=255)
+    weight: int = Field(1, ge=1, le=1000)
+    max_users: Optional[int] = Field(None, ge=0)
+    notes: Optional[str] = None
+
+
+class MarzbanNodeUpdate(BaseModel):
+    name: Optional[str] = Field(None, min_length=1, max_length=100)
+    url: Optional[str] = Field(None, min_length=1, max_length=255)
+    username: Optional[str] = Field(None, min_length=1, max_length=100)
+    password: Optional[str] = Field(None, min_length=1, max_length=255)
+    weight: Optional[int] = Field(None, ge=1, le=1000)
+    max_users: Optional[int] = Field(None, ge=0)
+    status: Optional[str] = None  # ACTIVE, DRAINING, DISABLED
+    notes: Optional[str] = None
+
+
+class MarzbanNodeResponse(BaseModel):
+    id: int
+    name: str
+    url: str
+    username: str
+    weight: int
+    max_users: Optional[int]
+    status: str
+    notes: Optional[str]
+    active_users: int
+    breaker_state: str
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class MarzbanNodeListResponse(BaseModel):
+    nodes: list[MarzbanNodeResponse]
+    strategy: str
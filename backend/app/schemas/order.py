@@ -1,18 +1,69 @@
 """
 Order Schemas
 """
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, model_validator
+from typing import Annotated, Optional
 from decimal import Decimal
 from datetime import datetime
 
 
+Username = Annotated[str, Field(min_length=3, max_length=50)]
+
+_username = TypeAdapter(Username)
+
+
+def username_error(username: str) -> Optional[str]:
+    """Why `username` is not a valid order username (None if it is)"""
+    try:
+        _username.validate_python(username)
+    except ValidationError as e:
+        return f"Invalid username: {e.errors()[0]['msg']}"
+    return None
+
+
 class OrderCreate(BaseModel):
     plan_id: int
-    username: str = Field(..., min_length=3, max_length=50)
+    username: Username
+    alias: Optional[str] = Field(None, max_length=200)
+    on_hold: bool = False
+
+
+class OrderBulkCreate(BaseModel):
+    plan_id: int
+    usernames: Optional[list[str]] = None
+    pattern: Optional[str] = Field(
+        None, min_length=4, max_length=50,
+        description="Username pattern with {n}, e.g. cafe{n}"
+    )
+    start: int = Field(1, ge=0)
+    count: Optional[int] = Field(None, ge=1)
     alias: Optional[str] = Field(None, max_length=200)
     on_hold: bool = False
 
+    @model_validator(mode="after")
+    def check_source(self):
+        if (self.usernames is None) == (self.pattern is None):
+            raise ValueError("Provide either usernames or pattern")
+        if self.pattern is not None:
+            if "{n}" not in self.pattern:
+                raise ValueError("pattern must contain {n}")
+            if not self.count:
+                raise ValueError("count is required with pattern")
+        return self
+
+    @property
+    def size(self) -> int:
+        """Number of usernames requested, without expanding the pattern"""
+        return self.count if self.pattern is not None else len(self.usernames)
+
+    def expand_usernames(self) -> list[str]:
+        if self.pattern is not None:
+            return [
+                self.pattern.replace("{n}", str(n))
+                for n in range(self.start, self.start + self.count)
+            ]
+        return list(self.usernames)
+
 
 class OrderResponse(BaseModel):
     id: int
@@ -36,8 +87,27 @@ class OrderDetailResponse(OrderResponse):
     data_used_gb: Optional[int]
 
 
+class BulkOrderItem(BaseModel):
+    username: str
+    success: bool
+    order: Optional[OrderDetailResponse] = None
+    error: Optional[str] = None
+
+
+class BulkOrderResponse(BaseModel):
+    plan_id: int
+    requested: int
+    created: int
+    failed: int
+    amount_charged: Decimal
+    amount_refunded: Decimal
+    items: list[BulkOrderItem]
+
+
 class OrderListResponse(BaseModel):
     orders: list[OrderResponse]
-    total: int
+    total: Optional[int] = None  # None when include_total=false
+    total_exact: bool = True  # False: at least `total` (PAGINATION_COUNT_LIMIT hit)
     page: int
     page_size: int
+    next_cursor: Optional[str] = None  # Pass as `cursor` for the next page
@@ -39,6 +39,8 @@ class PaymentResponse(BaseModel):
 
 class PaymentListResponse(BaseModel):
     payments: list[PaymentResponse]
-    total: int
+    total: Optional[int] = None  # None when include_total=false
+    total_exact: bool = True  # False: at least `total` (PAGINATION_COUNT_LIMIT hit)
     page: int
     page_size: int
+    next_cursor: Optional[str] = None  # Pass as `cursor` for the next page
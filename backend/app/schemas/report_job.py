@@ -0,0 +1,32 @@
+"""
+Report Job Schemas
+"""
+from pydantic import BaseModel
+from typing import Optional, List, Any, Dict
+from datetime import datetime, date
+
+
+class ReportJobCreate(BaseModel):
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    agent_ids: Optional[List[int]] = None
+    types: Optional[List[str]] = None
+    format: str = "xlsx"  # xlsx, csv, parquet
+    columns: Optional[List[str]] = None
+    compression: Optional[str] = None  # gzip, zstd
+
+
+class ReportJobResponse(BaseModel):
+    id: int
+    status: str
+    params: Dict[str, Any]
+    cached: bool = False  # Served from an earlier identical report
+    file_name: Optional[str]
+    file_size: Optional[int]
+    error: Optional[str]
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
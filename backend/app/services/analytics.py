@@ -0,0 +1,300 @@
+"""
+Analytics Service
+Hourly sales/refund/revenue rollups, updated incrementally by the
+order/payment code paths and aggregated to hour/day/month on read
+"""
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, delete, func, exists, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.order import Order
+from app.models.payment import Payment, PaymentStatus
+from app.models.transaction import Transaction, TransactionType
+from app.models.stats import StatsHourlySales, StatsHourlyRevenue
+from app.services.stats import insert_for
+
+# SQLite has no date_trunc (used by tests)
+_SQLITE_BUCKET_FORMATS = {
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d 00:00:00",
+    "month": "%Y-%m-01 00:00:00",
+}
+
+
+def hour_of(moment: Optional[datetime] = None) -> datetime:
+    """Start of the (UTC) hour bucket containing `moment` (default now)"""
+    return _as_datetime(moment or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+
+
+def _bucket(db: AsyncSession, column: Any, bucket: str) -> Any:
+    """SQL expression truncating a timestamp column to a (UTC) bucket"""
+    if db.get_bind().dialect.name == "sqlite":
+        return func.strftime(_SQLITE_BUCKET_FORMATS[bucket], column)
+    if bucket not in _SQLITE_BUCKET_FORMATS:
+        raise ValueError(f"Unknown bucket: {bucket}")
+    if getattr(column.type, "timezone", False):
+        # date_trunc on timestamptz uses the session time zone
+        column = func.timezone(literal_column("'UTC'"), column)
+    # Literals, not bind parameters, so GROUP BY matches the select list
+    return func.date_trunc(literal_column(f"'{bucket}'"), column)
+
+
+def _as_datetime(value: Any) -> datetime:
+    """Naive UTC datetime from a datetime or an ISO string"""
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+async def _add(db: AsyncSession, model: Any, keys: Dict[str, Any], values: Dict[str, Any]) -> None:
+    """Add `values` to the rollup row identified by `keys`, creating it if needed"""
+    stmt = insert_for(db)(model).values(**keys, **values)
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[getattr(model, key) for key in keys],
+            set_={
+                name: getattr(model, name) + getattr(stmt.excluded, name)
+                for name in values
+            }
+        )
+    )
+
+
+async def record_sale(
+    db: AsyncSession,
+    user_id: int,
+    plan_id: int,
+    amount: Decimal,
+    at: Optional[datetime] = None,
+    count: int = 1
+) -> None:
+    """
+    Count an order in its hourly rollup (in the caller's transaction).
+    For several orders at once, pass their `count` and total `amount`.
+    """
+    await _add(
+        db, StatsHourlySales,
+        {"hour": hour_of(at), "user_id": user_id, "plan_id": plan_id},
+        {"orders": count, "sales": amount}
+    )
+
+
+async def record_refund(
+    db: AsyncSession,
+    user_id: int,
+    plan_id: int,
+    amount: Decimal,
+    at: Optional[datetime] = None
+) -> None:
+    """Count an order refund in its hourly rollup"""
+    await _add(
+        db, StatsHourlySales,
+        {"hour": hour_of(at), "user_id": user_id, "plan_id": plan_id},
+        {"refunds": 1, "refunded": amount}
+    )
+
+
+async def record_revenue(
+    db: AsyncSession,
+    user_id: int,
+    amount: Decimal,
+    at: Optional[datetime] = None
+) -> None:
+    """Count an approved payment in its hourly rollup"""
+    await _add(
+        db, StatsHourlyRevenue,
+        {"hour": hour_of(at), "user_id": user_id},
+        {"payments": 1, "revenue": amount}
+    )
+
+
+def _range(query: Any, column: Any, date_from: date, date_to: date) -> Any:
+    """Limit a query to whole days from date_from to date_to (inclusive)"""
+    start = datetime.combine(date_from, datetime.min.time())
+    end = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+    return query.where(column >= start, column < end)
+
+
+async def sales_series(
+    db: AsyncSession,
+    bucket: str,
+    date_from: date,
+    date_to: date,
+    agent_ids: Optional[List[int]] = None,
+    plan_ids: Optional[List[int]] = None,
+    group_by: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Orders, sales and refunds per bucket.
+
+    Args:
+        bucket: "hour", "day" or "month"
+        group_by: None (totals), "agent" or "plan"
+    """
+    period = _bucket(db, StatsHourlySales.hour, bucket).label("period")
+    group = [period]
+    if group_by == "agent":
+        group.append(StatsHourlySales.user_id)
+    elif group_by == "plan":
+        group.append(StatsHourlySales.plan_id)
+
+    query = (
+        select(
+            *group,
+            func.sum(StatsHourlySales.orders).label("orders"),
+            func.sum(StatsHourlySales.sales).label("sales"),
+            func.sum(StatsHourlySales.refunds).label("refunds"),
+            func.sum(StatsHourlySales.refunded).label("refunded")
+        )
+        .group_by(*group)
+        .order_by(*group)
+    )
+    query = _range(query, StatsHourlySales.hour, date_from, date_to)
+    if agent_ids:
+        query = query.where(StatsHourlySales.user_id.in_(agent_ids))
+    if plan_ids:
+        query = query.where(StatsHourlySales.plan_id.in_(plan_ids))
+
+    result = await db.execute(query)
+    series = []
+    for row in result.all():
+        sales = Decimal(row.sales or 0)
+        refunded = Decimal(row.refunded or 0)
+        point = {"period": _as_datetime(row.period).isoformat()}
+        if group_by == "agent":
+            point["user_id"] = row.user_id
+        elif group_by == "plan":
+            point["plan_id"] = row.plan_id
+        point.update({
+            "orders": int(row.orders or 0),
+            "sales": sales,
+            "refunds": int(row.refunds or 0),
+            "refunded": refunded,
+            "net": sales - refunded,
+        })
+        series.append(point)
+    return series
+
+
+async def revenue_series(
+    db: AsyncSession,
+    bucket: str,
+    date_from: date,
+    date_to: date,
+    agent_ids: Optional[List[int]] = None,
+    group_by: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Approved payments per bucket.
+
+    Args:
+        bucket: "hour", "day" or "month"
+        group_by: None (totals) or "agent"
+    """
+    period = _bucket(db, StatsHourlyRevenue.hour, bucket).label("period")
+    group = [period, StatsHourlyRevenue.user_id] if group_by == "agent" else [period]
+
+    query = (
+        select(
+            *group,
+            func.sum(StatsHourlyRevenue.payments).label("payments"),
+            func.sum(StatsHourlyRevenue.revenue).label("revenue")
+        )
+        .group_by(*group)
+        .order_by(*group)
+    )
+    query = _range(query, StatsHourlyRevenue.hour, date_from, date_to)
+    if agent_ids:
+        query = query.where(StatsHourlyRevenue.user_id.in_(agent_ids))
+
+    result = await db.execute(query)
+    return [
+        {
+            "period": _as_datetime(row.period).isoformat(),
+            **({"user_id": row.user_id} if group_by == "agent" else {}),
+            "payments": int(row.payments or 0),
+            "revenue": Decimal(row.revenue or 0),
+        }
+        for row in result.all()
+    ]
+
+
+async def rebuild_rollups(db: AsyncSession) -> Dict[str, int]:
+    """
+    Recompute all hourly rollups from orders, refund transactions and
+    approved payments. Used to initialise the tables and to repair drift.
+    """
+    sales: Dict[tuple, Dict[str, Any]] = {}
+
+    def sales_row(key: tuple) -> Dict[str, Any]:
+        return sales.setdefault(key, {"orders": 0, "sales": 0, "refunds": 0, "refunded": 0})
+
+    order_hour = _bucket(db, Order.created_at, "hour")
+    result = await db.execute(
+        select(order_hour, Order.user_id, Order.plan_id, func.count(Order.id), func.sum(Order.amount))
+        .group_by(order_hour, Order.user_id, Order.plan_id)
+    )
+    for hour, user_id, plan_id, count, amount in result.all():
+        row = sales_row((_as_datetime(hour), user_id, plan_id))
+        row["orders"], row["sales"] = count, amount or 0
+
+    refund_hour = _bucket(db, Transaction.created_at, "hour")
+    result = await db.execute(
+        select(
+            refund_hour, Transaction.user_id, Order.plan_id,
+            func.count(Transaction.id), func.sum(Transaction.amount)
+        )
+        .join(Order, Order.id == Transaction.reference_id)
+        .where(Transaction.type == TransactionType.ORDER_REFUND)
+        .group_by(refund_hour, Transaction.user_id, Order.plan_id)
+    )
+    for hour, user_id, plan_id, count, amount in result.all():
+        row = sales_row((_as_datetime(hour), user_id, plan_id))
+        row["refunds"], row["refunded"] = count, amount or 0
+
+    payment_hour = _bucket(db, Payment.processed_at, "hour")
+    result = await db.execute(
+        select(payment_hour, Payment.user_id, func.count(Payment.id), func.sum(Payment.amount))
+        .where(Payment.status == PaymentStatus.APPROVED, Payment.processed_at.isnot(None))
+        .group_by(payment_hour, Payment.user_id)
+    )
+    revenue = [
+        {"hour": _as_datetime(hour), "user_id": user_id, "payments": count, "revenue": amount or 0}
+        for hour, user_id, count, amount in result.all()
+    ]
+
+    await db.execute(delete(StatsHourlySales))
+    await db.execute(delete(StatsHourlyRevenue))
+    if sales:
+        await db.execute(
+            StatsHourlySales.__table__.insert(),
+            [
+                {"hour": hour, "user_id": user_id, "plan_id": plan_id, **values}
+                for (hour, user_id, plan_id), values in sales.items()
+            ]
+        )
+    if revenue:
+        await db.execute(StatsHourlyRevenue.__table__.insert(), revenue)
+    await db.commit()
+
+    return {"sales_rows": len(sales), "revenue_rows": len(revenue)}
+
+
+async def ensure_rollups(db: AsyncSession) -> None:
+    """Build the rollups on first start if there is data but no rollup yet"""
+    result = await db.execute(
+        select(
+            exists().where(Order.id.isnot(None)),
+            exists().where(Payment.id.isnot(None)),
+            exists().where(StatsHourlySales.hour.isnot(None)),
+            exists().where(StatsHourlyRevenue.hour.isnot(None))
+        )
+    )
+    has_orders, has_payments, has_sales, has_revenue = result.one()
+    if (has_orders or has_payments) and not (has_sales or has_revenue):
+        await rebuild_rollups(db)
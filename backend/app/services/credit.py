@@ -3,6 +3,7 @@ Credit Service - Business logic for credit management
 """
 from decimal import Decimal
 from datetime import datetime
+from typing import Optional, Union
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
@@ -12,29 +13,39 @@ from app.models.end_user import EndUser
 from app.models.transaction import Transaction, TransactionType, ReferenceType
 
 
-async def get_user_credit_info(user: User, db: AsyncSession) -> dict:
-    """Get credit info for a user (agent or end-user)"""
+def _profile_query(model, user_id: int, for_update: bool):
+    query = select(model).where(model.user_id == user_id)
+    if for_update:
+        # Lock the row until commit and refresh any copy already in the session
+        query = query.with_for_update().execution_options(populate_existing=True)
+    return query
+
+
+async def get_user_credit_info(user: User, db: AsyncSession, for_update: bool = False) -> dict:
+    """
+    Get credit info for a user (agent or end-user).
+
+    With for_update, the profile row is locked (SELECT ... FOR UPDATE) until
+    the caller's transaction ends, so concurrent credit operations on the
+    same user are serialised while other users are unaffected.
+    """
     if user.role == UserRole.AGENT:
-        result = await db.execute(
-            select(Agent).where(Agent.user_id == user.id)
-        )
+        result = await db.execute(_profile_query(Agent, user.id, for_update))
         agent = result.scalar_one_or_none()
         if agent:
             return {
-                "credit_confirmed": float(agent.credit_confirmed),
-                "credit_pending": float(agent.credit_pending),
+                "credit_confirmed": agent.credit_confirmed,
+                "credit_pending": agent.credit_pending,
                 "total_credit": agent.total_credit,
                 "profile": agent
             }
     elif user.role == UserRole.END_USER:
-        result = await db.execute(
-            select(EndUser).where(EndUser.user_id == user.id)
-        )
+        result = await db.execute(_profile_query(EndUser, user.id, for_update))
         end_user = result.scalar_one_or_none()
         if end_user:
             return {
-                "credit_confirmed": float(end_user.credit_confirmed),
-                "credit_pending": float(end_user.credit_pending),
+                "credit_confirmed": end_user.credit_confirmed,
+                "credit_pending": end_user.credit_pending,
                 "total_credit": end_user.total_credit,
                 "profile": end_user
             }
@@ -49,7 +60,7 @@ async def add_pending_credit(
     db: AsyncSession
 ) -> Transaction:
     """Add pending credit when payment is uploaded"""
-    credit_info = await get_user_credit_info(user, db)
+    credit_info = await get_user_credit_info(user, db, for_update=True)
     if not credit_info:
         raise ValueError("User profile not found")
 
@@ -57,7 +68,7 @@ async def add_pending_credit(
     balance_before = credit_info["total_credit"]
 
     # Add to pending credit
-    profile.credit_pending = Decimal(str(profile.credit_pending)) + amount
+    profile.credit_pending += amount
     balance_after = profile.total_credit
 
     # Create transaction
@@ -65,8 +76,8 @@ async def add_pending_credit(
         user_id=user.id,
         type=TransactionType.CHARGE_PENDING,
         amount=amount,
-        balance_before=Decimal(str(balance_before)),
-        balance_after=Decimal(str(balance_after)),
+        balance_before=balance_before,
+        balance_after=balance_after,
         reference_type=ReferenceType.PAYMENT,
         reference_id=payment_id,
         notes="Receipt uploaded - awaiting approval"
@@ -85,7 +96,7 @@ async def approve_payment(
     db: AsyncSession
 ) -> Transaction:
     """Approve payment - move from pending to confirmed"""
-    credit_info = await get_user_credit_info(user, db)
+    credit_info = await get_user_credit_info(user, db, for_update=True)
     if not credit_info:
         raise ValueError("User profile not found")
 
@@ -93,8 +104,8 @@ async def approve_payment(
     balance_before = credit_info["total_credit"]
 
     # Move from pending to confirmed
-    profile.credit_pending = Decimal(str(profile.credit_pending)) - amount
-    profile.credit_confirmed = Decimal(str(profile.credit_confirmed)) + amount
+    profile.credit_pending -= amount
+    profile.credit_confirmed += amount
 
     # Clear negative credit timestamp if positive now
     if hasattr(profile, 'negative_credit_since') and profile.total_credit >= 0:
@@ -107,8 +118,8 @@ async def approve_payment(
         user_id=user.id,
         type=TransactionType.CHARGE_APPROVED,
         amount=amount,
-        balance_before=Decimal(str(balance_before)),
-        balance_after=Decimal(str(balance_after)),
+        balance_before=balance_before,
+        balance_after=balance_after,
         reference_type=ReferenceType.PAYMENT,
         reference_id=payment_id,
         notes=notes or "Payment approved",
@@ -128,7 +139,7 @@ async def reject_payment(
     db: AsyncSession
 ) -> Transaction:
     """Reject payment - remove pending credit (may go negative)"""
-    credit_info = await get_user_credit_info(user, db)
+    credit_info = await get_user_credit_info(user, db, for_update=True)
     if not credit_info:
         raise ValueError("User profile not found")
 
@@ -136,7 +147,7 @@ async def reject_payment(
     balance_before = credit_info["total_credit"]
 
     # Remove from pending credit
-    profile.credit_pending = Decimal(str(profile.credit_pending)) - amount
+    profile.credit_pending -= amount
     balance_after = profile.total_credit
 
     # Track when went negative
@@ -149,8 +160,8 @@ async def reject_payment(
         user_id=user.id,
         type=TransactionType.CHARGE_REJECTED,
         amount=-amount,  # Negative because it's removed
-        balance_before=Decimal(str(balance_before)),
-        balance_after=Decimal(str(balance_after)),
+        balance_before=balance_before,
+        balance_after=balance_after,
         reference_type=ReferenceType.PAYMENT,
         reference_id=payment_id,
         notes=notes,
@@ -161,29 +172,76 @@ async def reject_payment(
     return transaction
 
 
-async def deduct_credit(
+async def manual_adjustment(
     user: User,
     amount: Decimal,
-    order_id: int,
+    admin: User,
+    notes: Optional[str],
     db: AsyncSession
 ) -> Transaction:
-    """
-    Deduct credit for an order.
-    Deducts from confirmed first, then pending.
-    """
-    credit_info = await get_user_credit_info(user, db)
+    """Manual credit adjustment by admin (positive adds, negative deducts)"""
+    credit_info = await get_user_credit_info(user, db, for_update=True)
     if not credit_info:
         raise ValueError("User profile not found")
 
     profile = credit_info["profile"]
-    total = credit_info["total_credit"]
+    balance_before = credit_info["total_credit"]
+
+    profile.credit_confirmed += amount
+    balance_after = profile.total_credit
+
+    # Track or clear the negative credit timestamp
+    if hasattr(profile, 'negative_credit_since'):
+        if balance_after >= 0:
+            profile.negative_credit_since = None
+        elif profile.negative_credit_since is None:
+            profile.negative_credit_since = datetime.utcnow()
+
+    # Create transaction
+    transaction = Transaction(
+        user_id=user.id,
+        type=TransactionType.CHARGE_MANUAL,
+        amount=amount,
+        balance_before=balance_before,
+        balance_after=balance_after,
+        reference_type=ReferenceType.MANUAL,
+        notes=notes or "Manual adjustment by admin",
+        created_by=admin.id
+    )
+    db.add(transaction)
 
-    if total < float(amount):
+    return transaction
+
+
+async def deduct_credit(
+    user: User,
+    amount: Decimal,
+    order_id: Optional[int],
+    db: AsyncSession,
+    profile: Optional[Union[Agent, EndUser]] = None,
+    notes: str = "Order created"
+) -> Transaction:
+    """
+    Deduct credit for an order (or, with order_id None, a batch of orders).
+    Deducts from confirmed first, then pending.
+
+    Pass `profile` if the caller already holds it locked
+    (get_user_credit_info(..., for_update=True)) to skip the lookup.
+    """
+    if profile is None:
+        credit_info = await get_user_credit_info(user, db, for_update=True)
+        if not credit_info:
+            raise ValueError("User profile not found")
+        profile = credit_info["profile"]
+
+    total = profile.total_credit
+
+    if total < amount:
         raise ValueError("Insufficient credit")
 
     balance_before = total
-    confirmed = Decimal(str(profile.credit_confirmed))
-    pending = Decimal(str(profile.credit_pending))
+    confirmed = profile.credit_confirmed
+    pending = profile.credit_pending
 
     # Deduct from confirmed first
     if confirmed >= amount:
@@ -206,11 +264,11 @@ async def deduct_credit(
         user_id=user.id,
         type=TransactionType.ORDER_CREATED,
         amount=-amount,  # Negative because it's deducted
-        balance_before=Decimal(str(balance_before)),
-        balance_after=Decimal(str(balance_after)),
+        balance_before=balance_before,
+        balance_after=balance_after,
         reference_type=ReferenceType.ORDER,
         reference_id=order_id,
-        notes="Order created"
+        notes=notes
     )
     db.add(transaction)
 
@@ -220,12 +278,12 @@ async def deduct_credit(
 async def refund_credit(
     user: User,
     amount: Decimal,
-    order_id: int,
+    order_id: Optional[int],
     notes: str,
     db: AsyncSession
 ) -> Transaction:
     """Refund credit for deleted/disabled order"""
-    credit_info = await get_user_credit_info(user, db)
+    credit_info = await get_user_credit_info(user, db, for_update=True)
     if not credit_info:
         raise ValueError("User profile not found")
 
@@ -233,7 +291,7 @@ async def refund_credit(
     balance_before = credit_info["total_credit"]
 
     # Add back to confirmed credit
-    profile.credit_confirmed = Decimal(str(profile.credit_confirmed)) + amount
+    profile.credit_confirmed += amount
 
     # Clear negative timestamp if positive now
     if hasattr(profile, 'negative_credit_since') and profile.total_credit >= 0:
@@ -246,8 +304,8 @@ async def refund_credit(
         user_id=user.id,
         type=TransactionType.ORDER_REFUND,
         amount=amount,  # Positive because it's added back
-        balance_before=Decimal(str(balance_before)),
-        balance_after=Decimal(str(balance_after)),
+        balance_before=balance_before,
+        balance_after=balance_after,
         reference_type=ReferenceType.ORDER,
         reference_id=order_id,
         notes=notes
@@ -0,0 +1,194 @@
+"""
+Negative Credit Enforcement
+Disables the Marzban users of agents whose credit stayed negative too long
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select, update, and_
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.agent import Agent
+from app.models.user import User, UserStatus
+from app.models.order import Order, OrderStatus
+from app.models.marzban_node import MarzbanNode
+from app.models.marzban_user import MarzbanUser, MarzbanUserStatus
+from app.services.marzban_nodes import node_registry
+from app.services import stats
+
+logger = logging.getLogger(__name__)
+
+# Agents negative for longer than this get their users disabled
+NEGATIVE_CREDIT_GRACE = timedelta(hours=24)
+
+# Report of the most recent run (for monitoring)
+last_enforcement_report: Dict[str, Any] = {}
+
+
+async def enforce_negative_credit(
+    concurrency: Optional[int] = None,
+    batch_size: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Disable all active Marzban users of agents negative for more than 24h.
+
+    Active orders of every affected agent are processed together in
+    id-ordered batches. Within a batch, orders are grouped by node and each
+    node receives one concurrent bulk status change (update_users); nodes
+    run in parallel. Orders disabled in Marzban, or already missing there,
+    are marked DISABLED with one UPDATE and the batch is committed. Failed
+    orders stay ACTIVE and are retried on the next run.
+
+    Args:
+        concurrency: Max in-flight Marzban requests per node (default from
+            settings)
+        batch_size: Orders per DB commit (default from settings)
+
+    Returns:
+        Run report with agents processed, users disabled, failures and
+        duration
+    """
+    concurrency = concurrency or settings.NEGATIVE_CREDIT_CONCURRENCY
+    batch_size = batch_size or settings.NEGATIVE_CREDIT_BATCH_SIZE
+
+    report = {
+        "started_at": datetime.utcnow().isoformat(),
+        "agents": 0,
+        "disabled": 0,
+        "missing": 0,
+        "failed": 0,
+        "batches": 0,
+        "per_agent": {},
+        "duration_seconds": 0.0,
+    }
+    started = time.monotonic()
+
+    async with AsyncSessionLocal() as db:
+        cutoff_time = datetime.utcnow() - NEGATIVE_CREDIT_GRACE
+        result = await db.execute(
+            select(Agent.user_id, User.username)
+            .join(User, User.id == Agent.user_id)
+            .where(
+                and_(
+                    Agent.negative_credit_since.isnot(None),
+                    Agent.negative_credit_since < cutoff_time,
+                    Agent.is_negative,
+                    Agent.status == UserStatus.ACTIVE
+                )
+            )
+        )
+        agents = {user_id: username for user_id, username in result.all()}
+        report["agents"] = len(agents)
+        for username in agents.values():
+            logger.warning(
+                f"Agent {username} has negative credit for >24h. "
+                f"Disabling their users..."
+            )
+            report["per_agent"][username] = {"disabled": 0, "failed": 0}
+
+        # Each order is disabled on the node it was created on
+        nodes_result = await db.execute(select(MarzbanNode))
+        nodes = {node.id: node for node in nodes_result.scalars().all()}
+
+        last_id = 0
+        while agents:
+            result = await db.execute(
+                select(Order.id, Order.user_id, Order.node_id, Order.marzban_username)
+                .where(
+                    Order.user_id.in_(agents.keys()),
+                    Order.status == OrderStatus.ACTIVE,
+                    Order.id > last_id
+                )
+                .order_by(Order.id)
+                .limit(batch_size)
+            )
+            batch = result.all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            # One bulk status change per node, run in parallel
+            by_node: Dict[Optional[int], list] = defaultdict(list)
+            for order in batch:
+                by_node[order.node_id].append(order)
+            node_orders = list(by_node.values())
+            node_results = await asyncio.gather(
+                *(
+                    node_registry.get_client(nodes.get(orders[0].node_id)).update_users(
+                        [{"username": o.marzban_username, "status": "disabled"} for o in orders],
+                        concurrency=concurrency
+                    )
+                    for orders in node_orders
+                ),
+                return_exceptions=True
+            )
+
+            disabled_ids = []
+            for orders, results in zip(node_orders, node_results):
+                if isinstance(results, Exception):
+                    results = [results] * len(orders)
+                for order, outcome in zip(orders, results):
+                    agent_report = report["per_agent"][agents[order.user_id]]
+                    if isinstance(outcome, Exception):
+                        agent_report["failed"] += 1
+                        report["failed"] += 1
+                        logger.error(
+                            f"Failed to disable user {order.marzban_username}: {outcome}"
+                        )
+                        continue
+                    if outcome is None:
+                        # Already gone from Marzban; nothing left to disable
+                        report["missing"] += 1
+                        logger.warning(
+                            f"User {order.marzban_username} not found in Marzban"
+                        )
+                    else:
+                        agent_report["disabled"] += 1
+                        report["disabled"] += 1
+                    disabled_ids.append(order.id)
+
+            if disabled_ids:
+                result = await db.execute(
+                    update(Order)
+                    .where(Order.id.in_(disabled_ids), Order.status == OrderStatus.ACTIVE)
+                    .values(status=OrderStatus.DISABLED)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.execute(
+                    update(MarzbanUser)
+                    .where(MarzbanUser.order_id.in_(disabled_ids))
+                    .values(status=MarzbanUserStatus.DISABLED)
+                    .execution_options(synchronize_session=False)
+                )
+                await stats.bump_counters(db, active_orders=-result.rowcount)
+            try:
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+
+            report["batches"] += 1
+
+    for username, agent_report in report["per_agent"].items():
+        logger.info(
+            f"Disabled {agent_report['disabled']} users for agent {username} "
+            f"({agent_report['failed']} failed)"
+        )
+        # TODO: Send notification to agent (email/telegram)
+
+    report["duration_seconds"] = round(time.monotonic() - started, 3)
+    last_enforcement_report.clear()
+    last_enforcement_report.update(report)
+
+    logger.info(
+        f"Negative credit check: {report['agents']} agents, "
+        f"{report['disabled']} users disabled, {report['missing']} missing, "
+        f"{report['failed']} failed "
+        f"in {report['duration_seconds']}s"
+    )
+    return report
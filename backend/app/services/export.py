@@ -0,0 +1,332 @@
+"""
+Transaction Export Service
+Streams transaction reports (XLSX, CSV, Parquet) without loading them into memory
+"""
+import asyncio
+import csv
+import importlib
+import importlib.util
+import io
+import zlib
+from datetime import datetime, date
+from tempfile import SpooledTemporaryFile
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.utils import get_column_letter
+from sqlalchemy import select, Select
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.user import User
+from app.models.transaction import Transaction, TransactionType
+
+# Bytes per chunk sent to the client
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# key -> (header, XLSX column width, Parquet type)
+# Widths are fixed so rows never need a second pass
+TRANSACTION_COLUMNS = {
+    "id": ("ID", 10, "int64"),
+    "date": ("تاریخ", 12, "string"),
+    "time": ("ساعت", 10, "string"),
+    "user": ("کاربر", 20, "string"),
+    "type": ("نوع تراکنش", 18, "string"),
+    "amount": ("مبلغ", 15, "float64"),
+    "balance_before": ("موجودی قبل", 15, "float64"),
+    "balance_after": ("موجودی بعد", 15, "float64"),
+    "notes": ("توضیحات", 50, "string"),
+}
+
+# key -> selected SQL expression
+_COLUMN_SOURCES = {
+    "id": Transaction.id,
+    "date": Transaction.created_at,
+    "time": Transaction.created_at,
+    "user": User.username,
+    "type": Transaction.type,
+    "amount": Transaction.amount,
+    "balance_before": Transaction.balance_before,
+    "balance_after": Transaction.balance_after,
+    "notes": Transaction.notes,
+}
+
+# key -> database value to report value
+_COLUMN_FORMATTERS: Dict[str, Callable[[Any], Any]] = {
+    "id": lambda v: v,
+    "date": lambda v: v.strftime("%Y-%m-%d"),
+    "time": lambda v: v.strftime("%H:%M:%S"),
+    "user": lambda v: v or "",
+    "type": lambda v: v.value,
+    "amount": float,
+    "balance_before": float,
+    "balance_after": float,
+    "notes": lambda v: v or "",
+}
+
+# format -> (media type, file extension, supported compressions)
+EXPORT_FORMATS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx", ()),
+    "csv": ("text/csv; charset=utf-8", "csv", ("gzip", "zstd")),
+    "parquet": ("application/vnd.apache.parquet", "parquet", ("gzip", "zstd")),
+}
+
+# Optional packages needed by some formats/compressions
+_OPTIONAL_MODULES = {"parquet": "pyarrow", "zstd": "zstandard"}
+
+
+def validate_export(
+    fmt: str,
+    columns: Optional[List[str]] = None,
+    compression: Optional[str] = None
+) -> List[str]:
+    """
+    Check export options before streaming starts.
+
+    Args:
+        fmt: "xlsx", "csv" or "parquet"
+        columns: Column keys to include (default: all, in report order)
+        compression: None, "gzip" or "zstd". CSV is compressed as a whole
+            (.csv.gz / .csv.zst); Parquet uses it as its internal codec;
+            XLSX is already a zip archive and takes none.
+
+    Returns:
+        Column keys to export
+
+    Raises:
+        ValueError: If an option is invalid or its package is not installed
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid format. Use one of: {', '.join(EXPORT_FORMATS)}")
+
+    if compression and compression not in EXPORT_FORMATS[fmt][2]:
+        raise ValueError(f"Compression '{compression}' is not supported for {fmt}")
+
+    columns = columns or list(TRANSACTION_COLUMNS)
+    unknown = [c for c in columns if c not in TRANSACTION_COLUMNS]
+    if unknown:
+        raise ValueError(
+            f"Unknown columns: {', '.join(unknown)}. "
+            f"Use any of: {', '.join(TRANSACTION_COLUMNS)}"
+        )
+
+    for option in (fmt, compression):
+        module = _OPTIONAL_MODULES.get(option)
+        if module and importlib.util.find_spec(module) is None:
+            raise ValueError(f"{option} export requires the '{module}' package")
+
+    return columns
+
+
+def export_filename(fmt: str, compression: Optional[str] = None) -> str:
+    """Download filename for a report generated now"""
+    now = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"RAD_Report_{now}.{EXPORT_FORMATS[fmt][1]}"
+    if fmt == "csv" and compression:
+        filename += ".gz" if compression == "gzip" else ".zst"
+    return filename
+
+
+def export_media_type(fmt: str, compression: Optional[str] = None) -> str:
+    if fmt == "csv" and compression:
+        return "application/gzip" if compression == "gzip" else "application/zstd"
+    return EXPORT_FORMATS[fmt][0]
+
+
+def transaction_export_query(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    agent_ids: Optional[List[int]] = None,
+    types: Optional[List[str]] = None,
+    columns: Optional[List[str]] = None
+) -> Select:
+    """Projected (non-ORM) query selecting only the requested columns"""
+    columns = columns or list(TRANSACTION_COLUMNS)
+    query = (
+        select(*(_COLUMN_SOURCES[c].label(c) for c in columns))
+        .select_from(Transaction)
+        .order_by(Transaction.created_at.desc())
+    )
+    if "user" in columns:
+        query = query.outerjoin(User, User.id == Transaction.user_id)
+
+    if date_from:
+        query = query.where(Transaction.created_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        query = query.where(Transaction.created_at <= datetime.combine(date_to, datetime.max.time()))
+    if agent_ids:
+        query = query.where(Transaction.user_id.in_(agent_ids))
+    if types:
+        type_enums = [TransactionType(t) for t in types if t in [e.value for e in TransactionType]]
+        if type_enums:
+            query = query.where(Transaction.type.in_(type_enums))
+
+    return query
+
+
+def transaction_row(row: Sequence[Any], columns: List[str]) -> List[Any]:
+    """Report values for one projected transaction row"""
+    return [_COLUMN_FORMATTERS[c](v) for c, v in zip(columns, row)]
+
+
+async def iter_row_chunks(
+    query: Select,
+    chunk_size: Optional[int] = None
+) -> AsyncIterator[Sequence[Any]]:
+    """
+    Yield query rows in chunks from a server-side cursor.
+
+    Uses its own session: a streaming response outlives the request's
+    `get_db` session.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=chunk_size))
+        async for partition in result.partitions(chunk_size):
+            yield partition
+
+
+def stream_transactions(
+    query: Select,
+    columns: List[str],
+    fmt: str = "xlsx",
+    compression: Optional[str] = None,
+    chunk_size: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """Byte stream of the report in the given format (options from validate_export)"""
+    if fmt == "csv":
+        return _stream_csv(query, columns, compression, chunk_size)
+    if fmt == "parquet":
+        return _stream_parquet(query, columns, compression, chunk_size)
+    return _stream_xlsx(query, columns, chunk_size)
+
+
+async def _stream_csv(
+    query: Select,
+    columns: List[str],
+    compression: Optional[str],
+    chunk_size: Optional[int]
+) -> AsyncIterator[bytes]:
+    """
+    CSV is written and sent chunk by chunk as rows arrive.
+    Starts with a UTF-8 BOM so Excel detects the encoding of Persian text.
+    """
+    if compression == "gzip":
+        compressor = zlib.compressobj(wbits=31)  # gzip container
+    elif compression == "zstd":
+        compressor = importlib.import_module("zstandard").ZstdCompressor().compressobj()
+    else:
+        compressor = None
+
+    def encode(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor else data
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow([TRANSACTION_COLUMNS[c][0] for c in columns])
+
+    async for rows in iter_row_chunks(query, chunk_size):
+        writer.writerows(transaction_row(row, columns) for row in rows)
+        data = encode(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+        if data:
+            yield data
+
+    data = encode(buffer.getvalue())
+    if compressor:
+        data += compressor.flush()
+    if data:
+        yield data
+
+
+async def _stream_parquet(
+    query: Select,
+    columns: List[str],
+    compression: Optional[str],
+    chunk_size: Optional[int]
+) -> AsyncIterator[bytes]:
+    """
+    Each chunk becomes a Parquet row group. The footer is only written at
+    the end, so the file is built in a spooled temp file and then sent.
+    """
+    pa = importlib.import_module("pyarrow")
+    pq = importlib.import_module("pyarrow.parquet")
+
+    schema = pa.schema([(c, getattr(pa, TRANSACTION_COLUMNS[c][2])()) for c in columns])
+
+    def write_chunk(writer, rows: Sequence[Any]) -> None:
+        values = list(zip(*(transaction_row(row, columns) for row in rows)))
+        writer.write_table(pa.table(
+            [pa.array(values[i], type=schema.field(i).type) for i in range(len(columns))],
+            schema=schema
+        ))
+
+    with SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_SIZE) as spool:
+        writer = pq.ParquetWriter(spool, schema, compression=compression or "snappy")
+        try:
+            async for rows in iter_row_chunks(query, chunk_size):
+                await asyncio.to_thread(write_chunk, writer, rows)
+        finally:
+            await asyncio.to_thread(writer.close)
+
+        async for data in _read_spool(spool):
+            yield data
+
+
+def _append_rows(ws, rows: Sequence[Any], columns: List[str]) -> None:
+    for row in rows:
+        ws.append(transaction_row(row, columns))
+
+
+async def _stream_xlsx(
+    query: Select,
+    columns: List[str],
+    chunk_size: Optional[int]
+) -> AsyncIterator[bytes]:
+    """
+    Rows go into a write-only workbook, which keeps them in a temp file
+    instead of memory. An XLSX file is a zip archive that is only complete
+    once saved, so it is saved to a spooled temp file (in memory up to
+    EXPORT_SPOOL_MAX_SIZE, on disk beyond) and then sent in chunks.
+    Workbook work runs in a thread to keep the event loop responsive.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Transactions")
+
+    for col, key in enumerate(columns, 1):
+        ws.column_dimensions[get_column_letter(col)].width = TRANSACTION_COLUMNS[key][1]
+
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
+    header_alignment = Alignment(horizontal="center")
+
+    header = []
+    for key in columns:
+        cell = WriteOnlyCell(ws, value=TRANSACTION_COLUMNS[key][0])
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_alignment
+        header.append(cell)
+    ws.append(header)
+
+    async for rows in iter_row_chunks(query, chunk_size):
+        await asyncio.to_thread(_append_rows, ws, rows, columns)
+
+    with SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_SIZE) as spool:
+        await asyncio.to_thread(wb.save, spool)
+        async for data in _read_spool(spool):
+            yield data
+
+
+async def _read_spool(spool) -> AsyncIterator[bytes]:
+    spool.seek(0)
+    while True:
+        data = await asyncio.to_thread(spool.read, STREAM_CHUNK_SIZE)
+        if not data:
+            break
+        yield data
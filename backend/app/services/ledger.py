@@ -0,0 +1,319 @@
+"""
+Ledger Service
+Agent statements from balance checkpoints and bulk SQL reconciliation of
+stored balances against the transaction ledger
+"""
+import logging
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select, insert, func, case, and_, or_, type_coerce, Numeric
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.agent import Agent
+from app.models.user import User
+from app.models.transaction import Transaction, TransactionType
+from app.models.balance_checkpoint import BalanceCheckpoint
+
+logger = logging.getLogger(__name__)
+
+# Change of total credit caused by a transaction. Approving a payment only
+# moves credit from pending to confirmed, so it does not change the total.
+balance_effect = case(
+    (Transaction.type == TransactionType.CHARGE_APPROVED, 0),
+    else_=Transaction.amount
+)
+
+# Report of the most recent reconciliation (for monitoring)
+last_reconciliation_report: Dict[str, Any] = {}
+
+
+async def balance_at(db: AsyncSession, user_id: int, moment: datetime) -> Decimal:
+    """
+    Ledger balance of a user just before `moment`.
+
+    Starts from the latest checkpoint before `moment` and adds only the
+    transactions after it, so the cost is bounded by the checkpoint interval.
+    """
+    result = await db.execute(
+        select(BalanceCheckpoint.last_transaction_id, BalanceCheckpoint.balance)
+        .where(BalanceCheckpoint.user_id == user_id, BalanceCheckpoint.as_of < moment)
+        .order_by(BalanceCheckpoint.last_transaction_id.desc())
+        .limit(1)
+    )
+    checkpoint = result.first()
+    after_id, balance = checkpoint if checkpoint else (0, Decimal(0))
+
+    result = await db.execute(
+        select(func.coalesce(func.sum(balance_effect), 0))
+        .where(
+            Transaction.user_id == user_id,
+            Transaction.id > after_id,
+            Transaction.created_at < moment
+        )
+    )
+    return Decimal(balance) + Decimal(result.scalar() or 0)
+
+
+async def agent_statement(
+    db: AsyncSession,
+    user_id: int,
+    date_from: date,
+    date_to: date,
+    cursor: Optional[int] = None,
+    limit: int = 50
+) -> Dict[str, Any]:
+    """
+    One page of a user's ledger between two dates (inclusive).
+
+    Args:
+        cursor: Id of the last transaction of the previous page
+        limit: Transactions per page
+
+    Returns:
+        Opening/closing balances and period totals, the page of
+        transactions (oldest first) and the cursor of the next page
+    """
+    start = datetime.combine(date_from, datetime.min.time())
+    end = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+    in_period = and_(
+        Transaction.user_id == user_id,
+        Transaction.created_at >= start,
+        Transaction.created_at < end
+    )
+
+    result = await db.execute(
+        select(
+            func.coalesce(func.sum(case((balance_effect > 0, balance_effect), else_=0)), 0),
+            func.coalesce(func.sum(case((balance_effect < 0, balance_effect), else_=0)), 0)
+        )
+        .where(in_period)
+    )
+    credits, debits = result.one()
+
+    query = select(Transaction).where(in_period).order_by(Transaction.id).limit(limit + 1)
+    if cursor:
+        query = query.where(Transaction.id > cursor)
+    result = await db.execute(query)
+    entries = list(result.scalars().all())
+
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = entries[-1].id
+
+    return {
+        "opening_balance": await balance_at(db, user_id, start),
+        "closing_balance": await balance_at(db, user_id, end),
+        "total_credits": Decimal(credits),
+        "total_debits": Decimal(debits),
+        "entries": entries,
+        "next_cursor": next_cursor,
+    }
+
+
+async def create_checkpoints(db: AsyncSession) -> int:
+    """
+    Checkpoint every user with transactions since their last checkpoint,
+    in one INSERT ... SELECT.
+
+    Later runs only add transactions above the checkpointed id, so a
+    transaction that got a lower id but commits afterwards would be lost.
+    Only transactions older than LEDGER_CHECKPOINT_LAG_SECONDS, and below
+    the id of any newer one, are checkpointed.
+
+    Returns:
+        Number of checkpoints created
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.LEDGER_CHECKPOINT_LAG_SECONDS)
+    result = await db.execute(
+        select(func.min(Transaction.id)).where(Transaction.created_at >= cutoff)
+    )
+    first_recent_id = result.scalar()
+
+    latest = (
+        select(
+            BalanceCheckpoint.user_id,
+            func.max(BalanceCheckpoint.last_transaction_id).label("last_id")
+        )
+        .group_by(BalanceCheckpoint.user_id)
+        .subquery()
+    )
+    checkpoint = aliased(BalanceCheckpoint)
+    previous = (
+        select(checkpoint.user_id, checkpoint.last_transaction_id, checkpoint.balance)
+        .join(
+            latest,
+            and_(
+                checkpoint.user_id == latest.c.user_id,
+                checkpoint.last_transaction_id == latest.c.last_id
+            )
+        )
+        .subquery()
+    )
+    new_checkpoints = (
+        select(
+            Transaction.user_id,
+            func.max(Transaction.id),
+            func.coalesce(previous.c.balance, 0) + func.sum(balance_effect),
+            func.max(Transaction.created_at)
+        )
+        .outerjoin(previous, previous.c.user_id == Transaction.user_id)
+        .where(
+            Transaction.id > func.coalesce(previous.c.last_transaction_id, 0),
+            Transaction.created_at < cutoff
+        )
+        .group_by(Transaction.user_id, previous.c.balance)
+    )
+    if first_recent_id is not None:
+        new_checkpoints = new_checkpoints.where(Transaction.id < first_recent_id)
+
+    result = await db.execute(
+        insert(BalanceCheckpoint).from_select(
+            ["user_id", "last_transaction_id", "balance", "as_of"],
+            new_checkpoints
+        )
+    )
+    await db.commit()
+    return result.rowcount
+
+
+async def reconcile_balances(db: AsyncSession) -> Dict[str, Any]:
+    """
+    Verify every agent's stored credit against the ledger in bulk SQL.
+
+    Per agent, checks that:
+    - confirmed + pending credit equals the sum of balance effects
+    - it equals the balance_after snapshot of the latest transaction
+    - each transaction's balance_before equals the previous balance_after
+    - each transaction's snapshots differ by exactly its balance effect
+
+    Returns:
+        Report with the number of agents checked and the mismatches
+    """
+    started = time.monotonic()
+
+    ledger = (
+        select(
+            Transaction.user_id,
+            func.sum(balance_effect).label("balance"),
+            func.max(Transaction.id).label("last_id")
+        )
+        .group_by(Transaction.user_id)
+        .subquery()
+    )
+    rows = (
+        select(
+            Transaction.user_id,
+            Transaction.balance_before,
+            Transaction.balance_after,
+            balance_effect.label("effect"),
+            func.lag(Transaction.balance_after).over(
+                partition_by=Transaction.user_id,
+                order_by=Transaction.id
+            ).label("previous_after")
+        )
+        .subquery()
+    )
+    checks = (
+        select(
+            rows.c.user_id,
+            func.sum(case(
+                (and_(
+                    rows.c.previous_after.isnot(None),
+                    rows.c.previous_after != rows.c.balance_before
+                ), 1),
+                else_=0
+            )).label("chain_breaks"),
+            func.sum(case(
+                (rows.c.balance_after - rows.c.balance_before != rows.c.effect, 1),
+                else_=0
+            )).label("bad_rows")
+        )
+        .group_by(rows.c.user_id)
+        .subquery()
+    )
+    last_tx = aliased(Transaction)
+
+    stored = (Agent.credit_confirmed + Agent.credit_pending).label("stored")
+    # Decimal with the column scale on every backend (SQLite sums to float)
+    ledger_balance = type_coerce(
+        func.coalesce(ledger.c.balance, 0), Numeric(15, 2)
+    ).label("ledger")
+    chain_breaks = func.coalesce(checks.c.chain_breaks, 0).label("chain_breaks")
+    bad_rows = func.coalesce(checks.c.bad_rows, 0).label("bad_rows")
+
+    result = await db.execute(
+        select(
+            Agent.id,
+            Agent.user_id,
+            User.username,
+            stored,
+            ledger_balance,
+            last_tx.balance_after.label("snapshot"),
+            chain_breaks,
+            bad_rows
+        )
+        .join(User, User.id == Agent.user_id)
+        .outerjoin(ledger, ledger.c.user_id == Agent.user_id)
+        .outerjoin(last_tx, last_tx.id == ledger.c.last_id)
+        .outerjoin(checks, checks.c.user_id == Agent.user_id)
+        .where(
+            or_(
+                stored != ledger_balance,
+                and_(last_tx.balance_after.isnot(None), last_tx.balance_after != stored),
+                chain_breaks > 0,
+                bad_rows > 0
+            )
+        )
+        .order_by(Agent.id)
+    )
+    mismatches = [
+        {
+            "agent_id": row.id,
+            "user_id": row.user_id,
+            "username": row.username,
+            "stored_balance": Decimal(row.stored),
+            "ledger_balance": Decimal(row.ledger),
+            "last_snapshot": Decimal(row.snapshot) if row.snapshot is not None else None,
+            "difference": Decimal(row.stored) - Decimal(row.ledger),
+            "chain_breaks": int(row.chain_breaks),
+            "bad_rows": int(row.bad_rows),
+        }
+        for row in result.all()
+    ]
+
+    result = await db.execute(select(func.count(Agent.id)))
+    report = {
+        "checked_at": datetime.utcnow().isoformat(),
+        "agents": result.scalar() or 0,
+        "mismatches": mismatches,
+        "duration_seconds": round(time.monotonic() - started, 3),
+    }
+    last_reconciliation_report.clear()
+    last_reconciliation_report.update(report)
+
+    for mismatch in mismatches:
+        logger.warning(
+            f"Ledger mismatch for agent {mismatch['username']}: "
+            f"stored {mismatch['stored_balance']}, ledger {mismatch['ledger_balance']}, "
+            f"{mismatch['chain_breaks']} chain breaks, {mismatch['bad_rows']} bad rows"
+        )
+    logger.info(
+        f"Reconciled {report['agents']} agents: {len(mismatches)} mismatches "
+        f"in {report['duration_seconds']}s"
+    )
+    return report
+
+
+async def run_ledger_maintenance() -> Dict[str, Any]:
+    """Checkpoint new transactions, then reconcile (scheduled daily)"""
+    async with AsyncSessionLocal() as db:
+        created = await create_checkpoints(db)
+        report = await reconcile_balances(db)
+    return {"checkpoints": created, **report}
@@ -2,21 +2,72 @@
 Marzban API Client
 Handles all communication with Marzban panel
 """
+import asyncio
+import logging
+import random
 import httpx
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, List
+from jose import JWTError, jwt
 from app.config import settings
+from app.utils.cache import TTLCache, MISSING
+from app.utils.circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# Safe to repeat after a timeout or dropped connection
+IDEMPOTENT_METHODS = {"GET", "DELETE"}
+RETRYABLE_STATUS = {502, 503, 504}
+
+
+class MarzbanUnavailableError(Exception):
+    """Marzban could not be reached, or the circuit breaker is open"""
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    ceiling = min(
+        settings.MARZBAN_RETRY_BACKOFF_MAX,
+        settings.MARZBAN_RETRY_BACKOFF * (2 ** (attempt - 1))
+    )
+    return random.uniform(0, ceiling)
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("MARZBAN_HTTP2 is enabled but h2 is not installed; using HTTP/1.1")
+        return False
 
 
 class MarzbanClient:
     """Async client for Marzban API"""
 
-    def __init__(self):
-        self.base_url = settings.MARZBAN_URL.rstrip("/")
-        self.username = settings.MARZBAN_USERNAME
-        self.password = settings.MARZBAN_PASSWORD
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        username: Optional[str] = None,
+        password: Optional[str] = None
+    ):
+        """Defaults to the panel configured in settings (MARZBAN_*)"""
+        self.base_url = (base_url or settings.MARZBAN_URL).rstrip("/")
+        self.username = username or settings.MARZBAN_USERNAME
+        self.password = password or settings.MARZBAN_PASSWORD
         self.token: Optional[str] = None
         self.token_expires: Optional[datetime] = None
+        self.token_refresh_at: Optional[datetime] = None
+        self._auth_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        # GET /api/user/{username} responses (None for "not found")
+        self.cache = TTLCache(
+            maxsize=settings.MARZBAN_CACHE_SIZE,
+            ttl=settings.MARZBAN_CACHE_TTL
+        )
+        self._inflight: Dict[str, asyncio.Future] = {}
 
         # Configure proxy if set
         proxies = None
@@ -27,22 +78,89 @@ class MarzbanClient:
             }
 
         self.client = httpx.AsyncClient(
-            timeout=30.0,
+            timeout=httpx.Timeout(
+                connect=settings.MARZBAN_CONNECT_TIMEOUT,
+                read=settings.MARZBAN_READ_TIMEOUT,
+                write=settings.MARZBAN_WRITE_TIMEOUT,
+                pool=settings.MARZBAN_POOL_TIMEOUT
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.MARZBAN_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.MARZBAN_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.MARZBAN_KEEPALIVE_EXPIRY
+            ),
+            http2=settings.MARZBAN_HTTP2 and _http2_available(),
             proxies=proxies,
             verify=True  # Set to False if using self-signed certs
         )
 
+        self.breaker = CircuitBreaker(
+            window=settings.MARZBAN_BREAKER_WINDOW,
+            min_calls=settings.MARZBAN_BREAKER_MIN_CALLS,
+            failure_ratio=settings.MARZBAN_BREAKER_FAILURE_RATIO,
+            reset_timeout=settings.MARZBAN_BREAKER_RESET_TIMEOUT
+        )
+
+        # Request counters for pool_stats()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_requests = 0
+
     async def close(self):
         """Close the HTTP client"""
         await self.client.aclose()
 
-    async def authenticate(self) -> str:
-        """Get or refresh authentication token"""
-        # Return cached token if still valid
-        if self.token and self.token_expires and self.token_expires > datetime.utcnow():
+    async def authenticate(self, stale_token: Optional[str] = None) -> str:
+        """
+        Get or refresh authentication token.
+
+        Only one login runs at a time; concurrent callers wait for it and
+        reuse its token. Once the token enters its refresh window a
+        background refresh is started while the current token keeps being
+        served.
+
+        Args:
+            stale_token: Token that Marzban just rejected; forces a new
+                login unless another caller already replaced it
+        """
+        if stale_token is None and self._token_valid():
+            if self._token_needs_refresh():
+                self._schedule_refresh()
             return self.token
 
-        # Get new token
+        async with self._auth_lock:
+            # Another coroutine may have logged in while we were waiting
+            if self._token_valid() and self.token != stale_token:
+                return self.token
+            return await self._login()
+
+    def _token_valid(self) -> bool:
+        return bool(
+            self.token and self.token_expires
+            and self.token_expires > datetime.utcnow()
+        )
+
+    def _token_needs_refresh(self) -> bool:
+        return bool(
+            self.token_refresh_at and self.token_refresh_at <= datetime.utcnow()
+        )
+
+    def _schedule_refresh(self) -> None:
+        """Start a background token refresh unless one is already running"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self) -> None:
+        try:
+            async with self._auth_lock:
+                if self._token_needs_refresh():
+                    await self._login()
+        except Exception as e:
+            # The current token is still valid; the next caller retries
+            logger.warning(f"Background Marzban token refresh failed: {e}")
+
+    async def _login(self) -> str:
+        """POST credentials and store the new token (caller holds the lock)"""
         response = await self.client.post(
             f"{self.base_url}/api/admin/token",
             data={
@@ -55,9 +173,20 @@ class MarzbanClient:
             raise Exception(f"Marzban authentication failed: {response.text}")
 
         data = response.json()
-        self.token = data["access_token"]
-        # Token expires in 1 hour, refresh at 50 minutes
-        self.token_expires = datetime.utcnow() + timedelta(minutes=50)
+        token = data["access_token"]
+
+        # Use the token's own exp claim; fall back to a conservative lifetime
+        now = datetime.utcnow()
+        try:
+            exp = jwt.get_unverified_claims(token).get("exp")
+            expires = datetime.utcfromtimestamp(int(exp))
+        except (JWTError, TypeError, ValueError):
+            expires = now + timedelta(minutes=50)
+
+        margin = timedelta(seconds=settings.MARZBAN_TOKEN_REFRESH_MARGIN)
+        self.token = token
+        self.token_expires = expires - timedelta(seconds=30)  # Clock skew
+        self.token_refresh_at = max(expires - margin, now)
 
         return self.token
 
@@ -68,25 +197,121 @@ class MarzbanClient:
         json: Optional[Dict] = None,
         params: Optional[Dict] = None
     ) -> httpx.Response:
-        """Make authenticated request to Marzban API"""
+        """
+        Make authenticated request to Marzban API.
+
+        Idempotent methods (GET/DELETE) are retried on connection errors and
+        502/503/504 with jittered exponential backoff. Every call goes through
+        the circuit breaker, which fails fast while Marzban is unhealthy.
+
+        Raises:
+            MarzbanUnavailableError: Breaker is open or Marzban is unreachable
+        """
+        if not self.breaker.allow_request():
+            raise MarzbanUnavailableError(
+                "Marzban is unavailable (circuit open), try again later"
+            )
+
+        retries = settings.MARZBAN_RETRY_ATTEMPTS if method in IDEMPOTENT_METHODS else 0
+        attempt = 0
+        try:
+            while True:
+                try:
+                    response = await self._authenticated_send(
+                        method, endpoint, json, params
+                    )
+                except httpx.TransportError as e:
+                    if attempt < retries:
+                        attempt += 1
+                        await asyncio.sleep(_backoff(attempt))
+                        continue
+                    raise MarzbanUnavailableError(f"Could not reach Marzban: {e!r}") from e
+
+                if response.status_code in RETRYABLE_STATUS and attempt < retries:
+                    attempt += 1
+                    await asyncio.sleep(_backoff(attempt))
+                    continue
+                break
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled (e.g. client disconnected): not Marzban's fault
+            self.breaker.release()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def _authenticated_send(
+        self,
+        method: str,
+        endpoint: str,
+        json: Optional[Dict],
+        params: Optional[Dict]
+    ) -> httpx.Response:
         token = await self.authenticate()
 
-        headers = {"Authorization": f"Bearer {token}"}
+        response = await self._send(method, endpoint, token, json, params)
 
-        response = await self.client.request(
-            method,
-            f"{self.base_url}{endpoint}",
-            headers=headers,
-            json=json,
-            params=params
-        )
+        # Token revoked or expired early: log in again and retry once
+        if response.status_code == 401:
+            token = await self.authenticate(stale_token=token)
+            response = await self._send(method, endpoint, token, json, params)
 
         return response
 
+    async def _send(
+        self,
+        method: str,
+        endpoint: str,
+        token: str,
+        json: Optional[Dict],
+        params: Optional[Dict]
+    ) -> httpx.Response:
+        headers = {"Authorization": f"Bearer {token}"}
+
+        self.in_flight += 1
+        self.total_requests += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await self.client.request(
+                method,
+                f"{self.base_url}{endpoint}",
+                headers=headers,
+                json=json,
+                params=params
+            )
+        finally:
+            self.in_flight -= 1
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool occupancy and request counters"""
+        stats = {
+            "max_connections": settings.MARZBAN_MAX_CONNECTIONS,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "total_requests": self.total_requests,
+        }
+
+        # Per-connection state from the underlying httpcore pool, if exposed
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            stats["connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for c in connections if c.is_idle())
+            stats["http2_connections"] = sum(
+                1 for c in connections if "HTTP/2" in c.info()
+            )
+
+        return stats
+
     async def check_username_exists(self, username: str) -> bool:
         """Check if username already exists in Marzban"""
-        response = await self._request("GET", f"/api/user/{username}")
-        return response.status_code == 200
+        return await self.get_user(username) is not None
 
     async def create_user(
         self,
@@ -129,6 +354,7 @@ class MarzbanClient:
         }
 
         response = await self._request("POST", "/api/user", json=payload)
+        self.cache.invalidate(username)
 
         if response.status_code == 200:
             return response.json()
@@ -137,8 +363,59 @@ class MarzbanClient:
         else:
             raise Exception(f"Failed to create Marzban user: {response.text}")
 
-    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
-        """Get user info from Marzban"""
+    async def get_user(
+        self,
+        username: str,
+        use_cache: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Get user info from Marzban.
+
+        Results (including "not found") are cached for MARZBAN_CACHE_TTL
+        seconds, and concurrent lookups of the same user share one request.
+
+        Args:
+            username: Marzban username
+            use_cache: Set to False to force a fresh fetch (the result is
+                still stored in the cache)
+
+        Returns:
+            User data, or None if the user does not exist
+        """
+        if not use_cache:
+            user = await self._fetch_user(username)
+            self.cache.set(username, user)
+            return user
+
+        cached = self.cache.get(username)
+        if cached is not MISSING:
+            return cached
+
+        inflight = self._inflight.get(username)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[username] = future
+        try:
+            user = await self._fetch_user(username)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when nobody else is waiting
+            raise
+        except BaseException:
+            # Cancelled: release waiters instead of leaving them hanging
+            future.cancel()
+            raise
+        else:
+            self.cache.set(username, user)
+            future.set_result(user)
+            return user
+        finally:
+            self._inflight.pop(username, None)
+
+    async def _fetch_user(self, username: str) -> Optional[Dict[str, Any]]:
+        """GET a single user from Marzban, bypassing the cache"""
         response = await self._request("GET", f"/api/user/{username}")
 
         if response.status_code == 200:
@@ -148,58 +425,110 @@ class MarzbanClient:
         else:
             raise Exception(f"Failed to get Marzban user: {response.text}")
 
-    async def update_user(
+    async def iter_users(
         self,
-        username: str,
-        **kwargs
-    ) -> Dict[str, Any]:
-        """Update user in Marzban"""
-        # Get current user data
-        current = await self.get_user(username)
-        if not current:
-            raise Exception(f"User '{username}' not found")
-
-        # Prepare update payload
-        payload = {}
+        page_size: int = 500
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream all users from Marzban using the paginated listing.
 
-        if "status" in kwargs:
-            payload["status"] = kwargs["status"]
+        Args:
+            page_size: Users requested per page
 
-        if "expire" in kwargs:
-            payload["expire"] = kwargs["expire"]
+        Yields:
+            User data dicts, one at a time
+        """
+        offset = 0
+        while True:
+            response = await self._request(
+                "GET",
+                "/api/users",
+                params={"offset": offset, "limit": page_size}
+            )
+            if response.status_code != 200:
+                raise Exception(f"Failed to list Marzban users: {response.text}")
+
+            users = response.json().get("users", [])
+            for user in users:
+                yield user
+
+            if len(users) < page_size:
+                break
+            offset += page_size
 
-        if "data_limit" in kwargs:
-            payload["data_limit"] = kwargs["data_limit"]
+    async def update_user(
+        self,
+        username: str,
+        **kwargs
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Update user in Marzban with a single PUT.
 
-        if "note" in kwargs:
-            payload["note"] = kwargs["note"]
+        Returns:
+            Updated user data, or None if the user does not exist
+        """
+        payload = {
+            field: kwargs[field]
+            for field in ("status", "expire", "data_limit", "note")
+            if field in kwargs
+        }
 
         response = await self._request("PUT", f"/api/user/{username}", json=payload)
+        self.cache.invalidate(username)
 
         if response.status_code == 200:
             return response.json()
+        elif response.status_code == 404:
+            return None
         else:
             raise Exception(f"Failed to update Marzban user: {response.text}")
 
+    async def update_users(
+        self,
+        updates: List[Dict[str, Any]],
+        concurrency: Optional[int] = None
+    ) -> List[Any]:
+        """
+        Apply many updates concurrently (e.g. bulk status changes).
+
+        Args:
+            updates: Items like {"username": "...", "status": "disabled"}
+            concurrency: Max in-flight PUTs (default MARZBAN_SYNC_CONCURRENCY)
+
+        Returns:
+            One result per item, in order: updated user data, None if the
+            user does not exist, or the exception raised for that item
+        """
+        semaphore = asyncio.Semaphore(concurrency or settings.MARZBAN_SYNC_CONCURRENCY)
+
+        async def apply(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            fields = {k: v for k, v in item.items() if k != "username"}
+            async with semaphore:
+                return await self.update_user(item["username"], **fields)
+
+        return await asyncio.gather(
+            *(apply(item) for item in updates),
+            return_exceptions=True
+        )
+
     async def disable_user(self, username: str) -> bool:
         """Disable a user in Marzban"""
         try:
-            await self.update_user(username, status="disabled")
-            return True
+            return await self.update_user(username, status="disabled") is not None
         except Exception:
             return False
 
     async def enable_user(self, username: str) -> bool:
         """Enable a user in Marzban"""
         try:
-            await self.update_user(username, status="active")
-            return True
+            return await self.update_user(username, status="active") is not None
         except Exception:
             return False
 
     async def delete_user(self, username: str) -> bool:
         """Delete a user from Marzban"""
         response = await self._request("DELETE", f"/api/user/{username}")
+        self.cache.invalidate(username)
         return response.status_code == 200
 
     async def get_subscription_url(self, username: str) -> Optional[str]:
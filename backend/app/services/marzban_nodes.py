@@ -0,0 +1,205 @@
+"""
+Marzban Node Registry
+Maps registered Marzban panels to clients and places new users on them
+"""
+import asyncio
+import random
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.marzban_node import MarzbanNode, MarzbanNodeStatus
+from app.models.marzban_user import MarzbanUser
+from app.models.order import Order, OrderStatus
+from app.services.marzban import MarzbanClient, marzban_client
+
+# A candidate is {"node": MarzbanNode, "active_users": int, "client": MarzbanClient}
+PlacementStrategy = Callable[[List[Dict[str, Any]]], Dict[str, Any]]
+
+PLACEMENT_STRATEGIES: Dict[str, PlacementStrategy] = {}
+
+
+def placement_strategy(name: str):
+    """Register a node placement strategy under `name`"""
+    def register(func: PlacementStrategy) -> PlacementStrategy:
+        PLACEMENT_STRATEGIES[name] = func
+        return func
+    return register
+
+
+@placement_strategy("least_users")
+def least_users(candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Node with the fewest active users"""
+    return min(candidates, key=lambda c: c["active_users"])
+
+
+@placement_strategy("weighted")
+def weighted(candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Random node, proportional to its weight"""
+    return random.choices(candidates, weights=[c["node"].weight for c in candidates])[0]
+
+
+@placement_strategy("health_aware")
+def health_aware(candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Least loaded node (active users per unit of weight), skipping nodes
+    whose circuit breaker is not closed unless no healthy node is left.
+    """
+    healthy = [c for c in candidates if c["client"].breaker.state == "closed"]
+    return min(healthy or candidates, key=lambda c: c["active_users"] / c["node"].weight)
+
+
+class MarzbanNodeRegistry:
+    """
+    One MarzbanClient per registered node.
+
+    Orders and Marzban users with node_id NULL live on the default panel
+    configured in settings (the `marzban_client` singleton).
+    """
+
+    def __init__(self):
+        self._clients: Dict[int, MarzbanClient] = {}
+        self._fingerprints: Dict[int, tuple] = {}
+        self._closing: Set[asyncio.Task] = set()
+
+    def get_client(self, node: Optional[MarzbanNode]) -> MarzbanClient:
+        """Client for a node (None = default panel)"""
+        if node is None:
+            return marzban_client
+
+        fingerprint = (node.url, node.username, node.password_encrypted)
+        client = self._clients.get(node.id)
+        if client is None or self._fingerprints[node.id] != fingerprint:
+            if client is not None:
+                # Connection details changed; replace the client. Keep the
+                # close task referenced until it finishes.
+                task = asyncio.create_task(client.close())
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+            client = MarzbanClient(node.url, node.username, node.password)
+            self._clients[node.id] = client
+            self._fingerprints[node.id] = fingerprint
+        return client
+
+    def existing_client(self, node: MarzbanNode) -> Optional[MarzbanClient]:
+        """Client already created for a node, without creating one"""
+        return self._clients.get(node.id)
+
+    async def client_for_node_id(
+        self,
+        db: AsyncSession,
+        node_id: Optional[int]
+    ) -> MarzbanClient:
+        """Client for a stored node id (None = default panel)"""
+        if node_id is None:
+            return marzban_client
+        node = await db.get(MarzbanNode, node_id)
+        if node is None:
+            raise Exception(f"Marzban node {node_id} not found")
+        return self.get_client(node)
+
+    async def client_for_username(
+        self,
+        db: AsyncSession,
+        username: str
+    ) -> MarzbanClient:
+        """Client for the node a Marzban username was created on"""
+        result = await db.execute(
+            select(MarzbanNode)
+            .join(MarzbanUser, MarzbanUser.node_id == MarzbanNode.id)
+            .where(MarzbanUser.username == username)
+        )
+        return self.get_client(result.scalar_one_or_none())
+
+    async def list_nodes(
+        self,
+        db: AsyncSession,
+        statuses: Optional[List[MarzbanNodeStatus]] = None
+    ) -> List[MarzbanNode]:
+        """Registered nodes, optionally filtered by status"""
+        query = select(MarzbanNode).order_by(MarzbanNode.id)
+        if statuses:
+            query = query.where(MarzbanNode.status.in_(statuses))
+        result = await db.execute(query)
+        return list(result.scalars().all())
+
+    async def active_user_counts(self, db: AsyncSession) -> Dict[Optional[int], int]:
+        """Active orders per node id (None = default panel)"""
+        result = await db.execute(
+            select(Order.node_id, func.count(Order.id))
+            .where(Order.status == OrderStatus.ACTIVE)
+            .group_by(Order.node_id)
+        )
+        return {node_id: count for node_id, count in result.all()}
+
+    async def choose_node(
+        self,
+        db: AsyncSession,
+        strategy: Optional[str] = None
+    ) -> Optional[MarzbanNode]:
+        """
+        Pick the node for a new user.
+
+        Args:
+            db: Database session
+            strategy: Placement strategy name (default from settings)
+
+        Returns:
+            Chosen node, or None to use the default panel when no nodes
+            are registered
+
+        Raises:
+            Exception: If every active node is at capacity
+        """
+        nodes = await self.list_nodes(db, [MarzbanNodeStatus.ACTIVE])
+        if not nodes:
+            return None
+
+        counts = await self.active_user_counts(db)
+        candidates = [
+            {"node": node, "active_users": counts.get(node.id, 0), "client": self.get_client(node)}
+            for node in nodes
+            if node.max_users is None or counts.get(node.id, 0) < node.max_users
+        ]
+        if not candidates:
+            raise Exception("All Marzban nodes are at capacity")
+
+        name = strategy or settings.MARZBAN_PLACEMENT_STRATEGY
+        if name not in PLACEMENT_STRATEGIES:
+            raise ValueError(f"Unknown Marzban placement strategy: {name}")
+        return PLACEMENT_STRATEGIES[name](candidates)["node"]
+
+    async def username_exists(self, db: AsyncSession, username: str) -> bool:
+        """Check a username locally and on every node accepting new users"""
+        result = await db.execute(
+            select(Order.id).where(Order.marzban_username == username).limit(1)
+        )
+        if result.first():
+            return True
+
+        nodes = await self.list_nodes(db, [MarzbanNodeStatus.ACTIVE])
+        clients = [self.get_client(node) for node in nodes] or [marzban_client]
+        results = await asyncio.gather(
+            *(client.check_username_exists(username) for client in clients)
+        )
+        return any(results)
+
+    async def close(self) -> None:
+        """Close all node clients"""
+        for client in self._clients.values():
+            await client.close()
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+        self._clients.clear()
+        self._fingerprints.clear()
+
+
+# Singleton instance
+node_registry = MarzbanNodeRegistry()
+
+
+async def get_node_registry() -> MarzbanNodeRegistry:
+    """Dependency to get the Marzban node registry"""
+    return node_registry
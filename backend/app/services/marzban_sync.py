@@ -0,0 +1,497 @@
+"""
+Marzban Sync Service
+Pulls usage and status from Marzban into the local marzban_users table
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, update, values, column, cast, case, or_, bindparam, Integer, String
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.marzban_user import MarzbanUser, MarzbanUserStatus
+from app.models.marzban_node import MarzbanNode, MarzbanNodeStatus
+from app.services.marzban import MarzbanClient
+from app.services.marzban_nodes import node_registry
+
+logger = logging.getLogger(__name__)
+
+# Marzban status -> local status (anything else leaves the row untouched)
+STATUS_MAP = {
+    "disabled": MarzbanUserStatus.DISABLED,
+    "expired": MarzbanUserStatus.EXPIRED,
+    "limited": MarzbanUserStatus.LIMITED,
+}
+
+# Incremental sync: users this close to expiry or to their data limit are
+# checked before everything else
+HOT_EXPIRE_WINDOW = timedelta(hours=24)
+HOT_USAGE_RATIO = 0.9
+
+# Report of the most recent run, exposed for monitoring
+last_sync_report: Dict[str, Any] = {}
+
+# (id, data_used_gb, status name) rows for the bulk UPDATE ... FROM (VALUES ...)
+ChangedRow = Tuple[int, int, str]
+
+
+def extract_usage(
+    user_data: Dict[str, Any],
+    current_status: MarzbanUserStatus
+) -> Tuple[int, MarzbanUserStatus]:
+    """Map a Marzban user payload to local (data_used_gb, status)"""
+    used_bytes = user_data.get("used_traffic") or 0
+    data_used_gb = int(used_bytes / (1024 * 1024 * 1024))
+    new_status = STATUS_MAP.get(user_data.get("status", "active"), current_status)
+    return data_used_gb, new_status
+
+
+def apply_user_data(mu: MarzbanUser, user_data: Dict[str, Any]) -> None:
+    """Copy usage and status from a Marzban user payload onto a local row"""
+    mu.data_used_gb, mu.status = extract_usage(user_data, mu.status)
+    mu.last_synced_at = datetime.utcnow()
+
+
+COUNTERS = ("synced", "changed", "missing", "failed", "orphans", "batches")
+
+
+async def sync_marzban_users(
+    mode: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    batch_size: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Sync active Marzban users into the local database.
+
+    The default panel (users with node_id NULL) and every registered node
+    that still serves users are synced in parallel, each with its own client.
+
+    Args:
+        mode: "bulk" (stream the paginated user listing), "per_user"
+            (one GET per local user) or "incremental" (one GET per user for
+            the most stale/at-risk users only); default from settings
+        concurrency: Max in-flight Marzban requests per node in per-user modes
+        batch_size: Users per DB commit (default from settings)
+
+    Returns:
+        Run report with totals, per-node reports and duration
+    """
+    mode = mode or settings.MARZBAN_SYNC_MODE
+    concurrency = concurrency or settings.MARZBAN_SYNC_CONCURRENCY
+    batch_size = batch_size or settings.MARZBAN_SYNC_BATCH_SIZE
+    if mode not in ("bulk", "per_user", "incremental"):
+        raise ValueError(f"Unknown Marzban sync mode: {mode}")
+
+    report = {
+        "mode": mode,
+        "started_at": datetime.utcnow().isoformat(),
+        **{counter: 0 for counter in COUNTERS},
+        "nodes": {},
+        "duration_seconds": 0.0,
+    }
+    started = time.monotonic()
+
+    async with AsyncSessionLocal() as db:
+        nodes = await node_registry.list_nodes(
+            db, [MarzbanNodeStatus.ACTIVE, MarzbanNodeStatus.DRAINING]
+        )
+        result = await db.execute(
+            select(MarzbanUser.id).where(MarzbanUser.node_id.is_(None)).limit(1)
+        )
+        targets = [None] if result.first() else []
+        targets += nodes
+
+    node_reports = await asyncio.gather(
+        *(_sync_node(node, mode, concurrency, batch_size) for node in targets),
+        return_exceptions=True
+    )
+
+    for node, node_report in zip(targets, node_reports):
+        name = node.name if node else "default"
+        if isinstance(node_report, Exception):
+            logger.error(f"Marzban sync failed for node {name}: {node_report}")
+            node_report = {"error": str(node_report)}
+        else:
+            for counter in COUNTERS:
+                report[counter] += node_report[counter]
+        report["nodes"][name] = node_report
+
+    report["duration_seconds"] = round(time.monotonic() - started, 3)
+    last_sync_report.clear()
+    last_sync_report.update(report)
+
+    logger.info(
+        f"Synced {report['synced']} Marzban users on {len(targets)} node(s) "
+        f"in {mode} mode ({report['changed']} changed, "
+        f"{report['missing']} missing, {report['failed']} failed, "
+        f"{report['orphans']} orphans) in {report['duration_seconds']}s"
+    )
+    return report
+
+
+async def _sync_node(
+    node: Optional[MarzbanNode],
+    mode: str,
+    concurrency: int,
+    batch_size: int
+) -> Dict[str, Any]:
+    """Sync the users of one node (None = default panel)"""
+    client = node_registry.get_client(node)
+    on_node = (
+        MarzbanUser.node_id.is_(None) if node is None
+        else MarzbanUser.node_id == node.id
+    )
+    report = {counter: 0 for counter in COUNTERS}
+
+    if mode == "bulk":
+        await _sync_bulk(report, client, on_node, concurrency, batch_size)
+    elif mode == "per_user":
+        await _sync_per_user(report, client, on_node, concurrency, batch_size)
+    else:
+        await _sync_incremental(
+            report, client, on_node, concurrency, batch_size,
+            settings.MARZBAN_SYNC_INCREMENTAL_LIMIT
+        )
+    return report
+
+
+async def _sync_per_user(
+    report: Dict[str, Any],
+    client: MarzbanClient,
+    on_node: Any,
+    concurrency: int,
+    batch_size: int
+) -> None:
+    """
+    Fetch each active user individually with bounded parallelism.
+
+    Users are processed in id-ordered batches. Within a batch, requests to
+    Marzban run concurrently (limited by a semaphore) and the batch is
+    committed as a whole, so memory and transaction size stay bounded.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(username: str) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            return await client.get_user(username, use_cache=False)
+
+    async with AsyncSessionLocal() as db:
+        last_id = 0
+        while True:
+            result = await db.execute(
+                select(MarzbanUser)
+                .where(
+                    on_node,
+                    MarzbanUser.status == MarzbanUserStatus.ACTIVE,
+                    MarzbanUser.id > last_id
+                )
+                .order_by(MarzbanUser.id)
+                .limit(batch_size)
+            )
+            batch = result.scalars().all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            results = await asyncio.gather(
+                *(fetch(mu.username) for mu in batch),
+                return_exceptions=True
+            )
+
+            for mu, user_data in zip(batch, results):
+                if isinstance(user_data, Exception):
+                    report["failed"] += 1
+                    logger.error(f"Failed to sync user {mu.username}: {user_data}")
+                elif user_data:
+                    apply_user_data(mu, user_data)
+                    report["synced"] += 1
+                    report["changed"] += 1
+                else:
+                    # User not found in Marzban
+                    mu.status = MarzbanUserStatus.DISABLED
+                    report["missing"] += 1
+                    logger.warning(f"User {mu.username} not found in Marzban")
+
+            await _commit_batch(db)
+            report["batches"] += 1
+
+
+async def _sync_bulk(
+    report: Dict[str, Any],
+    client: MarzbanClient,
+    on_node: Any,
+    concurrency: int,
+    batch_size: int
+) -> None:
+    """
+    Stream the Marzban user listing and reconcile it with marzban_users.
+
+    Builds an in-memory username -> local row index and probes it with every
+    streamed Marzban user (hash join), so a full sync costs
+    total_users / page_size HTTP calls. Marzban users unknown locally are
+    reported as orphans. Only rows whose usage or status changed are
+    written; unchanged rows are not touched at all.
+
+    The listing is paged by offset, so users created or deleted on the panel
+    meanwhile can shift pages and hide live users. Local active users that
+    never appear are therefore looked up one by one and only disabled when
+    Marzban confirms they do not exist.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(
+                MarzbanUser.id,
+                MarzbanUser.username,
+                MarzbanUser.status,
+                MarzbanUser.data_used_gb
+            )
+            .where(on_node)
+        )
+        index = {row.username: row for row in result}
+        unseen_active = {
+            row.id for row in index.values()
+            if row.status == MarzbanUserStatus.ACTIVE
+        }
+
+        changed: List[ChangedRow] = []
+        orphans = []
+
+        async for user_data in client.iter_users(
+            page_size=settings.MARZBAN_SYNC_PAGE_SIZE
+        ):
+            row = index.get(user_data.get("username"))
+            if row is None:
+                orphans.append(user_data.get("username"))
+                continue
+            if row.status != MarzbanUserStatus.ACTIVE:
+                continue
+
+            unseen_active.discard(row.id)
+            _diff(row, user_data, changed)
+            report["synced"] += 1
+
+            if len(changed) >= batch_size:
+                report["changed"] += len(changed)
+                await _write_batch(db, changed)
+                report["batches"] += 1
+                changed = []
+
+        if changed:
+            report["changed"] += len(changed)
+            await _write_batch(db, changed)
+            report["batches"] += 1
+
+        # Confirm users missing from the listing before disabling them
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(username: str) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                return await client.get_user(username, use_cache=False)
+
+        unseen_rows = [row for row in index.values() if row.id in unseen_active]
+        missing_ids: List[int] = []
+        for start in range(0, len(unseen_rows), batch_size):
+            batch = unseen_rows[start:start + batch_size]
+            results = await asyncio.gather(
+                *(fetch(row.username) for row in batch),
+                return_exceptions=True
+            )
+
+            changed, gone = [], []
+            for row, user_data in zip(batch, results):
+                if isinstance(user_data, Exception):
+                    report["failed"] += 1
+                    logger.error(f"Failed to check user {row.username}: {user_data}")
+                elif user_data:
+                    # Live user skipped by the listing
+                    _diff(row, user_data, changed)
+                    report["synced"] += 1
+                else:
+                    gone.append(row.id)
+
+            if gone:
+                await db.execute(
+                    update(MarzbanUser)
+                    .where(MarzbanUser.id.in_(gone))
+                    .values(status=MarzbanUserStatus.DISABLED)
+                    .execution_options(synchronize_session=False)
+                )
+            if changed or gone:
+                report["changed"] += len(changed)
+                await _write_batch(db, changed)
+            missing_ids.extend(gone)
+
+        report["missing"] = len(missing_ids)
+        if missing_ids:
+            logger.warning(f"{len(missing_ids)} users not found in Marzban, disabled")
+
+    report["orphans"] = len(orphans)
+    if orphans:
+        logger.warning(
+            f"{len(orphans)} Marzban users are not tracked by RAD Panel "
+            f"(e.g. {', '.join(str(u) for u in orphans[:10])})"
+        )
+
+
+async def _sync_incremental(
+    report: Dict[str, Any],
+    client: MarzbanClient,
+    on_node: Any,
+    concurrency: int,
+    batch_size: int,
+    limit: int
+) -> None:
+    """
+    Re-check only the users most likely to have changed.
+
+    Candidates are active users that were never synced, are about to expire
+    or are close to their data limit, followed by the least recently synced
+    ones, up to `limit` users per run. Rows whose usage and status did not
+    change only get their last_synced_at bumped (so the rotation moves on);
+    changed rows are written with a single UPDATE ... FROM (VALUES ...).
+    """
+    now = datetime.utcnow()
+    hot = or_(
+        MarzbanUser.last_synced_at.is_(None),
+        MarzbanUser.expire_date < now + HOT_EXPIRE_WINDOW,
+        MarzbanUser.data_used_gb >= MarzbanUser.data_limit_gb * HOT_USAGE_RATIO,
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(username: str) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            return await client.get_user(username, use_cache=False)
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(
+                MarzbanUser.id,
+                MarzbanUser.username,
+                MarzbanUser.status,
+                MarzbanUser.data_used_gb
+            )
+            .where(on_node, MarzbanUser.status == MarzbanUserStatus.ACTIVE)
+            .order_by(
+                case((hot, 0), else_=1),
+                MarzbanUser.last_synced_at.asc().nulls_first()
+            )
+            .limit(limit)
+        )
+        candidates = result.all()
+
+        for start in range(0, len(candidates), batch_size):
+            batch = candidates[start:start + batch_size]
+            results = await asyncio.gather(
+                *(fetch(row.username) for row in batch),
+                return_exceptions=True
+            )
+
+            changed: List[ChangedRow] = []
+            unchanged: List[int] = []
+            for row, user_data in zip(batch, results):
+                if isinstance(user_data, Exception):
+                    report["failed"] += 1
+                    logger.error(f"Failed to sync user {row.username}: {user_data}")
+                elif user_data:
+                    _diff(row, user_data, changed, unchanged)
+                    report["synced"] += 1
+                else:
+                    changed.append(
+                        (row.id, row.data_used_gb or 0, MarzbanUserStatus.DISABLED.name)
+                    )
+                    report["missing"] += 1
+                    logger.warning(f"User {row.username} not found in Marzban")
+
+            report["changed"] += len(changed)
+            await _write_batch(db, changed, unchanged)
+            report["batches"] += 1
+
+
+def _diff(
+    row: Any,
+    user_data: Dict[str, Any],
+    changed: List[ChangedRow],
+    unchanged: Optional[List[int]] = None
+) -> None:
+    """
+    Compare a local row with its Marzban payload and queue the result.
+    Unchanged rows are queued only if `unchanged` is given.
+    """
+    data_used_gb, new_status = extract_usage(user_data, row.status)
+    if data_used_gb == (row.data_used_gb or 0) and new_status == row.status:
+        if unchanged is not None:
+            unchanged.append(row.id)
+    else:
+        changed.append((row.id, data_used_gb, new_status.name))
+
+
+async def _write_batch(
+    db,
+    changed: List[ChangedRow],
+    unchanged: Sequence[int] = ()
+) -> None:
+    """
+    Persist a batch of sync results with at most two statements.
+
+    Changed rows are written with one UPDATE joined against a VALUES list;
+    `unchanged` rows only have last_synced_at bumped (incremental mode,
+    whose rotation order depends on it).
+    """
+    now = datetime.utcnow()
+
+    if changed and db.get_bind().dialect.name == "sqlite":
+        # SQLite cannot name VALUES columns (used by tests): one executemany
+        table = MarzbanUser.__table__
+        await db.execute(
+            table.update()
+            .where(table.c.id == bindparam("row_id"))
+            .values(
+                data_used_gb=bindparam("used_gb"),
+                status=bindparam("new_status"),
+                last_synced_at=now
+            ),
+            [
+                {"row_id": row_id, "used_gb": used_gb, "new_status": MarzbanUserStatus[status]}
+                for row_id, used_gb, status in changed
+            ]
+        )
+    elif changed:
+        rows = values(
+            column("id", Integer),
+            column("data_used_gb", Integer),
+            column("status", String),
+            name="changes"
+        ).data(changed)
+        await db.execute(
+            update(MarzbanUser)
+            .where(MarzbanUser.id == rows.c.id)
+            .values(
+                data_used_gb=rows.c.data_used_gb,
+                status=cast(rows.c.status, MarzbanUser.__table__.c.status.type),
+                last_synced_at=now
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    if unchanged:
+        await db.execute(
+            update(MarzbanUser)
+            .where(MarzbanUser.id.in_(unchanged))
+            .values(last_synced_at=now)
+            .execution_options(synchronize_session=False)
+        )
+
+    await _commit_batch(db)
+
+
+async def _commit_batch(db) -> None:
+    """Commit a sync batch and drop it from the session identity map"""
+    try:
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    db.expunge_all()
@@ -38,7 +38,7 @@ def calculate_refund(
         # Not eligible for refund after 24 hours
         return None
 
-    original_price = Decimal(str(order.amount))
+    original_price = order.amount
 
     # If on_hold (never started), full refund
     if marzban_user.status.value == "on_hold":
@@ -54,7 +54,7 @@ def calculate_refund(
         # Get total days from plan (order.plan.days)
         total_days = 30  # Default, should come from plan
 
-        time_refund_ratio = Decimal(str(days_remaining / total_days))
+        time_refund_ratio = Decimal(days_remaining) / Decimal(total_days)
     else:
         time_refund_ratio = Decimal("1.0")
 
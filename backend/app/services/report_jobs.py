@@ -0,0 +1,286 @@
+"""
+Report Jobs Service
+Generates transaction exports in the background and caches the files
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.report_job import ReportJob, ReportJobStatus
+from app.models.transaction import Transaction
+from app.services.export import (
+    EXPORT_FORMATS,
+    validate_export,
+    export_filename,
+    transaction_export_query,
+    stream_transactions
+)
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validated, canonical export parameters (JSON-serialisable).
+    Equivalent requests normalise to equal dicts.
+
+    Raises:
+        ValueError: If the export options are invalid
+    """
+    fmt = params.get("format") or "xlsx"
+    compression = params.get("compression")
+    columns = validate_export(fmt, params.get("columns"), compression)
+
+    def iso(value: Optional[date]) -> Optional[str]:
+        return value.isoformat() if value else None
+
+    return {
+        "date_from": iso(params.get("date_from")),
+        "date_to": iso(params.get("date_to")),
+        "agent_ids": sorted(set(params.get("agent_ids") or [])) or None,
+        "types": sorted(set(params.get("types") or [])) or None,
+        "format": fmt,
+        "columns": columns,
+        "compression": compression,
+    }
+
+
+def report_cache_key(params: Dict[str, Any], watermark: Tuple[int, int]) -> str:
+    """
+    Cache key for a report: normalised params plus the (count, max id) of
+    transactions. Transactions are append-only, so any new transaction
+    changes the key, including one with a lower id that committed late.
+    """
+    payload = json.dumps({"params": params, "watermark": watermark}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def submit_report(
+    db: AsyncSession,
+    user_id: int,
+    params: Dict[str, Any]
+) -> Tuple[ReportJob, bool]:
+    """
+    Submit an export job, reusing an identical one when possible.
+
+    A pending/running job with the same cache key is shared, and a
+    completed one is returned as-is while its file still exists.
+
+    Returns:
+        (job, reused)
+
+    Raises:
+        ValueError: If the export options are invalid
+    """
+    params = normalize_params(params)
+    result = await db.execute(select(func.count(Transaction.id), func.max(Transaction.id)))
+    count, last_id = result.one()
+    cache_key = report_cache_key(params, (count, last_id or 0))
+
+    result = await db.execute(
+        select(ReportJob)
+        .where(
+            ReportJob.cache_key == cache_key,
+            ReportJob.status.in_([
+                ReportJobStatus.PENDING,
+                ReportJobStatus.RUNNING,
+                ReportJobStatus.COMPLETED
+            ])
+        )
+        .order_by(ReportJob.id.desc())
+        .limit(1)
+    )
+    existing = result.scalar_one_or_none()
+    if existing and (
+        existing.status != ReportJobStatus.COMPLETED
+        or (existing.file_path and os.path.exists(existing.file_path))
+    ):
+        return existing, True
+
+    job = ReportJob(created_by=user_id, params=params, cache_key=cache_key)
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+
+    report_worker.enqueue(job.id)
+    return job, False
+
+
+class ReportWorker:
+    """
+    In-process queue of report jobs with a fixed number of worker tasks.
+
+    Jobs live in the database, so pending or interrupted jobs are picked
+    up again when the application restarts. Completed jobs whose file is
+    gone (e.g. REPORT_DIR was not persisted) are marked failed.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._done: Dict[int, asyncio.Event] = {}
+
+    async def start(self, workers: Optional[int] = None) -> None:
+        os.makedirs(settings.REPORT_DIR, exist_ok=True)
+        self._queue = asyncio.Queue()
+
+        async with AsyncSessionLocal() as db:
+            # Jobs cut off by a restart start over
+            await db.execute(
+                update(ReportJob)
+                .where(ReportJob.status == ReportJobStatus.RUNNING)
+                .values(status=ReportJobStatus.PENDING, started_at=None)
+            )
+            result = await db.execute(
+                select(ReportJob.id, ReportJob.file_path)
+                .where(ReportJob.status == ReportJobStatus.COMPLETED)
+            )
+            missing = [
+                job_id for job_id, path in result.all()
+                if not path or not os.path.exists(path)
+            ]
+            if missing:
+                await db.execute(
+                    update(ReportJob)
+                    .where(ReportJob.id.in_(missing))
+                    .values(
+                        status=ReportJobStatus.FAILED,
+                        error="Report file expired; submit the report again"
+                    )
+                )
+                logger.warning(f"{len(missing)} completed report jobs have no file, marked failed")
+            await db.commit()
+            result = await db.execute(
+                select(ReportJob.id)
+                .where(ReportJob.status == ReportJobStatus.PENDING)
+                .order_by(ReportJob.id)
+            )
+            for job_id in result.scalars().all():
+                self.enqueue(job_id)
+
+        for _ in range(workers or settings.REPORT_WORKERS):
+            self._tasks.append(asyncio.create_task(self._run()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def enqueue(self, job_id: int) -> None:
+        self._done.setdefault(job_id, asyncio.Event())
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
+
+    async def wait(self, job_id: int, timeout: float) -> None:
+        """Wait up to `timeout` seconds for a queued job to finish"""
+        event = self._done.get(job_id)
+        if event is None:
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await generate_report(job_id)
+            except Exception as e:
+                logger.error(f"Report job {job_id} crashed: {e}")
+            finally:
+                event = self._done.pop(job_id, None)
+                if event:
+                    event.set()
+                self._queue.task_done()
+
+
+async def generate_report(job_id: int) -> None:
+    """Produce the file of one pending job into REPORT_DIR"""
+    async with AsyncSessionLocal() as db:
+        # Claim the job so it is never generated twice
+        result = await db.execute(
+            update(ReportJob)
+            .where(ReportJob.id == job_id, ReportJob.status == ReportJobStatus.PENDING)
+            .values(status=ReportJobStatus.RUNNING, started_at=datetime.utcnow())
+        )
+        await db.commit()
+        if result.rowcount == 0:
+            return
+
+        job = await db.get(ReportJob, job_id)
+        params = job.params
+        fmt, compression, columns = params["format"], params["compression"], params["columns"]
+
+        def parse_date(value: Optional[str]) -> Optional[date]:
+            return date.fromisoformat(value) if value else None
+
+        query = transaction_export_query(
+            parse_date(params["date_from"]),
+            parse_date(params["date_to"]),
+            params["agent_ids"],
+            params["types"],
+            columns
+        )
+
+        path = os.path.join(settings.REPORT_DIR, f"report_{job.id}.{EXPORT_FORMATS[fmt][1]}")
+        partial_path = path + ".part"
+        try:
+            with open(partial_path, "wb") as f:
+                async for data in stream_transactions(query, columns, fmt, compression):
+                    await asyncio.to_thread(f.write, data)
+            os.replace(partial_path, path)
+        except Exception as e:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            job.status = ReportJobStatus.FAILED
+            job.error = str(e)
+            job.finished_at = datetime.utcnow()
+            await db.commit()
+            logger.error(f"Report job {job_id} failed: {e}")
+            return
+
+        job.status = ReportJobStatus.COMPLETED
+        job.file_path = path
+        job.file_name = export_filename(fmt, compression)
+        job.file_size = os.path.getsize(path)
+        job.finished_at = datetime.utcnow()
+        await db.commit()
+
+        logger.info(f"Report job {job_id} completed ({job.file_size} bytes)")
+
+
+async def cleanup_report_jobs(retention_days: Optional[int] = None) -> int:
+    """Delete report jobs (and their files) older than the retention period"""
+    retention_days = retention_days or settings.REPORT_RETENTION_DAYS
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(ReportJob).where(
+                ReportJob.created_at < cutoff,
+                ReportJob.status.in_([ReportJobStatus.COMPLETED, ReportJobStatus.FAILED])
+            )
+        )
+        jobs = result.scalars().all()
+        for job in jobs:
+            if job.file_path and os.path.exists(job.file_path):
+                os.remove(job.file_path)
+            await db.delete(job)
+        await db.commit()
+
+    return len(jobs)
+
+
+# Singleton instance
+report_worker = ReportWorker()
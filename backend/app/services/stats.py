@@ -0,0 +1,104 @@
+"""
+Stats Service
+Dashboard counters, updated incrementally by the order/payment/agent
+code paths instead of aggregating on every read
+"""
+from decimal import Decimal
+from typing import Any, Dict
+
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.agent import Agent
+from app.models.order import Order, OrderStatus
+from app.models.payment import Payment, PaymentStatus
+from app.models.stats import StatsCounter
+from app.utils.cache import TTLCache, MISSING
+
+AGENTS = "agents"
+ACTIVE_ORDERS = "active_orders"
+PENDING_PAYMENTS = "pending_payments"
+REVENUE = "revenue"  # Sum of approved payments
+COUNTERS = (AGENTS, ACTIVE_ORDERS, PENDING_PAYMENTS, REVENUE)
+
+_counter_cache = TTLCache(maxsize=1, ttl=max(settings.STATS_CACHE_TTL, 1))
+
+
+def insert_for(db: AsyncSession):
+    """Dialect-specific INSERT supporting ON CONFLICT"""
+    dialect = db.get_bind().dialect.name
+    return (sqlite if dialect == "sqlite" else postgresql).insert
+
+
+async def bump_counters(db: AsyncSession, **deltas: Any) -> None:
+    """
+    Add deltas to counters, e.g. bump_counters(db, active_orders=1).
+    Runs in the caller's transaction as an atomic `value = value + delta`.
+    """
+    for name, delta in deltas.items():
+        if name not in COUNTERS:
+            raise ValueError(f"Unknown stats counter: {name}")
+        if not delta:
+            continue
+        await db.execute(
+            update(StatsCounter)
+            .where(StatsCounter.name == name)
+            .values(value=StatsCounter.value + delta)
+        )
+
+
+async def get_counters(db: AsyncSession) -> Dict[str, Decimal]:
+    """All counters in one query; cached for STATS_CACHE_TTL seconds (0 = off)"""
+    if settings.STATS_CACHE_TTL > 0:
+        cached = _counter_cache.get("counters")
+        if cached is not MISSING:
+            return cached
+
+    result = await db.execute(select(StatsCounter.name, StatsCounter.value))
+    counters = {name: Decimal(0) for name in COUNTERS}
+    counters.update({name: value for name, value in result.all()})
+
+    if settings.STATS_CACHE_TTL > 0:
+        _counter_cache.set("counters", counters)
+    return counters
+
+
+async def rebuild_stats(db: AsyncSession) -> Dict[str, Decimal]:
+    """
+    Recompute all counters from the source tables.
+    Used to initialise the tables and to repair drift (e.g. manual DB edits).
+    """
+    totals = {
+        AGENTS: select(func.count(Agent.id)),
+        ACTIVE_ORDERS: select(func.count(Order.id)).where(Order.status == OrderStatus.ACTIVE),
+        PENDING_PAYMENTS: select(func.count(Payment.id)).where(Payment.status == PaymentStatus.PENDING),
+        REVENUE: select(func.sum(Payment.amount)).where(Payment.status == PaymentStatus.APPROVED),
+    }
+    counters = {}
+    for name, query in totals.items():
+        result = await db.execute(query)
+        counters[name] = Decimal(result.scalar() or 0)
+
+    insert = insert_for(db)
+    stmt = insert(StatsCounter).values([
+        {"name": name, "value": value} for name, value in counters.items()
+    ])
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[StatsCounter.name],
+            set_={"value": stmt.excluded.value}
+        )
+    )
+
+    await db.commit()
+    _counter_cache.clear()
+    return counters
+
+
+async def ensure_stats(db: AsyncSession) -> None:
+    """Build the stats tables on first start"""
+    result = await db.execute(select(func.count()).select_from(StatsCounter))
+    if (result.scalar() or 0) < len(COUNTERS):
+        await rebuild_stats(db)
@@ -0,0 +1,113 @@
+"""
+Circuit breaker for calls to external services
+"""
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a dependency is unhealthy.
+
+    Outcomes of the last `window` calls are kept; once at least `min_calls`
+    are recorded and the failure ratio reaches `failure_ratio`, the breaker
+    opens and rejects calls for `reset_timeout` seconds. After that a single
+    probe call is let through (half-open): success closes the breaker,
+    failure opens it again. Outcomes of calls that finish while the breaker
+    is open (started before it opened) are ignored.
+
+    Not thread-safe; intended for use from a single asyncio event loop.
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 10,
+        failure_ratio: float = 0.5,
+        reset_timeout: float = 30.0
+    ):
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.reset_timeout = reset_timeout
+        self._outcomes: deque = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Return True if a call may proceed; the caller must then record its outcome"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        if self._state == OPEN:
+            return
+        if self._state == HALF_OPEN:
+            self._close()
+        self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        if self._state == OPEN:
+            # Must not push the reset deadline out
+            return
+        if self._state == HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append(False)
+        failures = self._outcomes.count(False)
+        if (
+            len(self._outcomes) >= self.min_calls
+            and failures / len(self._outcomes) >= self.failure_ratio
+        ):
+            self._open()
+
+    def release(self) -> None:
+        """Give up an allowed call without an outcome (e.g. it was cancelled)"""
+        self._probe_in_flight = False
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self.times_opened += 1
+
+    def _close(self) -> None:
+        self._state = CLOSED
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._outcomes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Current state and counters for monitoring"""
+        state = self.state
+        retry_in = None
+        if state == OPEN:
+            retry_in = round(self.reset_timeout - (time.monotonic() - self._opened_at), 1)
+        return {
+            "state": state,
+            "recent_calls": len(self._outcomes),
+            "recent_failures": self._outcomes.count(False),
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+            "retry_in_seconds": retry_in,
+        }
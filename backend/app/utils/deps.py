@@ -6,14 +6,39 @@ from fastapi import Depends, HTTPException, status, Cookie
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.orm import make_transient_to_detached
 
+from app.config import settings
 from app.database import get_db
+from app.utils.cache import TTLCache, MISSING
 from app.utils.security import decode_token
 from app.models.user import User, UserRole, UserStatus
 
 # HTTP Bearer token
 security = HTTPBearer(auto_error=False)
 
+# Authenticated users by id, so most requests authorise without a DB query.
+# Entries are detached snapshots; see invalidate_principal.
+principal_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE,
+    ttl=max(settings.PRINCIPAL_CACHE_TTL, 1)
+)
+
+
+def invalidate_principal(user_id: int) -> None:
+    """
+    Drop a cached user. Call after changing a user's status, role,
+    password or token_version so the change applies on the next request.
+    """
+    principal_cache.invalidate(user_id)
+
+
+def _snapshot(user: User) -> User:
+    """Detached copy of a loaded user's columns, safe to share via the cache"""
+    copy = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+    make_transient_to_detached(copy)
+    return copy
+
 
 async def get_current_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
@@ -49,21 +74,41 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    user_id: int = payload.get("sub")
-    if user_id is None:
+    try:
+        # "sub" is a string per RFC 7519 (older tokens carry an int)
+        user_id = int(payload.get("sub"))
+    except (TypeError, ValueError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token payload",
         )
 
-    # Get user from database
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalar_one_or_none()
+    cached = MISSING
+    if settings.PRINCIPAL_CACHE_TTL > 0:
+        cached = principal_cache.get(user_id)
 
-    if user is None:
+    if cached is not MISSING:
+        # Attach a copy to this request's session without querying
+        user = await db.merge(cached, load=False)
+    else:
+        # Get user from database
+        result = await db.execute(select(User).where(User.id == user_id))
+        user = result.scalar_one_or_none()
+
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found",
+            )
+
+        if settings.PRINCIPAL_CACHE_TTL > 0:
+            principal_cache.set(user_id, _snapshot(user))
+
+    if payload.get("ver", 0) != user.token_version:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found",
+            detail="Token has been revoked",
+            headers={"WWW-Authenticate": "Bearer"},
         )
 
     if user.status != UserStatus.ACTIVE:
@@ -0,0 +1,97 @@
+"""
+Keyset pagination on (created_at, id), newest first
+
+Lists return an opaque `next_cursor`; passing it back continues after the
+last row without OFFSET, so every page costs the same regardless of depth.
+`page` still works for the first pages and for older clients.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import Select, func, literal, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Opaque cursor pointing at a row"""
+    data = json.dumps([created_at.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+async def paginate(
+    db: AsyncSession,
+    query: Select,
+    model: Any,
+    page: int,
+    page_size: int,
+    cursor: Optional[str] = None
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    One page of `query` ordered by (created_at, id) descending.
+
+    Args:
+        model: Mapped class with created_at and id columns
+        page: Used only without a cursor (OFFSET)
+        cursor: next_cursor of the previous page
+
+    Returns:
+        The rows and the cursor of the next page (None on the last page)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.where(
+            tuple_(model.created_at, model.id) <
+            tuple_(literal(created_at, model.created_at.type), literal(row_id, model.id.type))
+        )
+    else:
+        query = query.offset((page - 1) * page_size)
+
+    result = await db.execute(query.limit(page_size + 1))
+    rows = list(result.unique().scalars().all())
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+async def count_rows(db: AsyncSession, query: Select) -> Tuple[int, bool]:
+    """
+    Count the rows of `query`, stopping at PAGINATION_COUNT_LIMIT.
+
+    Returns:
+        (total, exact) - exact is False when the limit was hit, in which
+        case there are at least `total` rows
+    """
+    limit = settings.PAGINATION_COUNT_LIMIT
+    query = query.order_by(None)
+    if limit > 0:
+        query = query.limit(limit + 1)
+
+    result = await db.execute(select(func.count()).select_from(query.subquery()))
+    total = result.scalar() or 0
+    if limit > 0 and total > limit:
+        return limit, False
+    return total, True
@@ -0,0 +1,110 @@
+"""
+HTTP Range support for file downloads (single byte range)
+"""
+import asyncio
+import os
+from typing import AsyncIterator, Optional, Tuple
+
+from fastapi.responses import Response, StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a Range header into an inclusive (start, end) byte range.
+
+    Returns None when the whole file should be sent: no header, a unit
+    other than bytes, or several ranges (allowed to be ignored by RFC 9110).
+
+    Raises:
+        ValueError: If the range is malformed or cannot be satisfied
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    start_text, sep, end_text = spec.strip().partition("-")
+    if not sep:
+        raise ValueError("Malformed range")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: last N bytes
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise ValueError("Empty suffix range")
+            start = max(size - suffix, 0)
+            end = size - 1
+    except (TypeError, ValueError):
+        raise ValueError("Malformed range")
+
+    if start < 0 or start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+async def _iter_file(path: str, start: int, length: int) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        await asyncio.to_thread(f.seek, start)
+        remaining = length
+        while remaining > 0:
+            data = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def file_response(
+    path: str,
+    filename: str,
+    media_type: str,
+    range_header: Optional[str] = None,
+    if_range: Optional[str] = None
+) -> Response:
+    """
+    Serve a file, honouring a single-range Range request (206) so
+    interrupted downloads can resume.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f"attachment; filename={filename}",
+    }
+
+    # A stale If-Range means the client's partial copy is outdated
+    if if_range and if_range != etag:
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(
+            status_code=416,
+            headers={"Content-Range": f"bytes */{size}", "Accept-Ranges": "bytes"}
+        )
+
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1 if size else 0
+    headers["Content-Length"] = str(length)
+
+    return StreamingResponse(
+        _iter_file(path, start, length),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers
+    )
@@ -0,0 +1,219 @@
+"""
+Rate limiting - token buckets per client IP, username, user or globally
+
+Buckets live in process memory by default. Set RATE_LIMIT_REDIS_URL to
+share them between processes (requires the `redis` package).
+"""
+import ipaddress
+import logging
+import math
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+from app.config import settings
+from app.utils.security import decode_token
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ("ip", "username", "user", "global")
+
+
+class MemoryBucketStore:
+    """
+    Token buckets in process memory, bounded by LRU eviction.
+
+    Not thread-safe; intended for use from a single asyncio event loop.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def take(self, key: str, capacity: int, rate: float, cost: int = 1) -> float:
+        """
+        Take `cost` tokens from a bucket refilled at `rate` tokens per second.
+
+        Returns:
+            0 if allowed, otherwise seconds until enough tokens are available
+        """
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+class RedisBucketStore:
+    """
+    Token buckets in Redis, shared by all processes. The update runs as one
+    Lua script so concurrent requests cannot overspend a bucket.
+    """
+
+    SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, client: Any, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBucketStore":
+        import redis.asyncio as redis
+        return cls(redis.from_url(url))
+
+    async def take(self, key: str, capacity: int, rate: float, cost: int = 1) -> float:
+        wait = await self.client.eval(
+            self.SCRIPT, 1, self.prefix + key, capacity, rate, time.time(), cost
+        )
+        return float(wait)
+
+
+_store = None
+
+
+def get_rate_limit_store():
+    """The configured bucket store (created on first use)"""
+    global _store
+    if _store is None:
+        if settings.RATE_LIMIT_REDIS_URL:
+            _store = RedisBucketStore.from_url(settings.RATE_LIMIT_REDIS_URL)
+        else:
+            _store = MemoryBucketStore(settings.RATE_LIMIT_MAX_KEYS)
+    return _store
+
+
+def set_rate_limit_store(store: Any) -> None:
+    """Use another store (anything with `async take(key, capacity, rate, cost)`)"""
+    global _store
+    _store = store
+
+
+@lru_cache(maxsize=8)
+def _networks(proxies: Tuple[str, ...]) -> Tuple[Any, ...]:
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in _networks(tuple(settings.RATE_LIMIT_TRUSTED_PROXIES)))
+
+
+def client_ip(request: Request) -> str:
+    """
+    Client address. X-Real-IP (set by nginx) is used only when the peer is
+    in RATE_LIMIT_TRUSTED_PROXIES; anyone else could forge it.
+    """
+    peer = request.client.host if request.client else "unknown"
+    if settings.RATE_LIMIT_TRUSTED_PROXIES and _is_trusted_proxy(peer):
+        real_ip = request.headers.get("x-real-ip")
+        if real_ip:
+            return real_ip.strip()
+    return peer
+
+
+async def _scope_key(request: Request, scope: str) -> Optional[str]:
+    if scope == "global":
+        return "all"
+    if scope == "ip":
+        return client_ip(request)
+    if scope == "username":
+        # JSON body field; Starlette caches the body for the endpoint
+        try:
+            body = await request.json()
+        except Exception:
+            return None
+        username = body.get("username") if isinstance(body, dict) else None
+        return str(username).lower() if username else None
+    if scope == "user":
+        # Authenticated user id from the (cached) token, else the client IP
+        token = request.cookies.get("access_token")
+        authorization = request.headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            token = authorization[7:]
+        payload = decode_token(token) if token else None
+        if payload and payload.get("sub") is not None:
+            return f"user:{payload['sub']}"
+        return f"ip:{client_ip(request)}"
+    raise ValueError(f"Unknown rate limit scope: {scope}")
+
+
+def rate_limit(name: str, per_minute: int, scope: str = "ip", burst: Optional[int] = None):
+    """
+    Dependency factory limiting requests with a token bucket.
+    Usage: dependencies=[Depends(rate_limit("login:ip", 10))]
+
+    Args:
+        name: Bucket namespace, unique per limit
+        per_minute: Sustained requests per minute (0 = unlimited)
+        scope: "ip", "username" (JSON body field), "user" or "global"
+        burst: Bucket size (default per_minute)
+
+    Raises:
+        HTTPException: 429 with Retry-After when the bucket is empty
+    """
+    if scope not in SCOPES:
+        raise ValueError(f"Unknown rate limit scope: {scope}")
+
+    capacity = burst or per_minute
+    rate = per_minute / 60.0
+
+    async def limiter(request: Request) -> None:
+        if not settings.RATE_LIMIT_ENABLED or per_minute <= 0:
+            return
+
+        key = await _scope_key(request, scope)
+        if key is None:
+            return
+
+        try:
+            wait = await get_rate_limit_store().take(f"{name}:{key}", capacity, rate)
+        except Exception as e:
+            # Fail open: an unavailable shared store must not lock everyone out
+            logger.warning(f"Rate limit store error ({name}): {e}")
+            return
+
+        if wait > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, try again later",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+    return limiter
@@ -1,26 +1,211 @@
 """
-Security utilities - JWT tokens and password hashing
+Security utilities - JWT tokens, password hashing and secret encryption
 """
+import asyncio
+import base64
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional, Tuple
+from cryptography.fernet import Fernet, InvalidToken
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from app.config import settings
+from app.utils.cache import TTLCache, MISSING
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing. Hashes with a different cost than BCRYPT_ROUNDS are
+# reported as needing an update, so they are rehashed on the next login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
 
 
 def hash_password(password: str) -> str:
-    """Hash a password using bcrypt"""
+    """Hash a password using bcrypt (blocking; use password_hasher in handlers)"""
     return pwd_context.hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
+    """Verify a password against its hash (blocking; use password_hasher in handlers)"""
     return pwd_context.verify(plain_password, hashed_password)
 
 
+@lru_cache(maxsize=1)
+def _fernet() -> Fernet:
+    key = settings.SECRET_ENCRYPTION_KEY
+    if not key:
+        key = base64.urlsafe_b64encode(hashlib.sha256(settings.SECRET_KEY.encode()).digest())
+    return Fernet(key)
+
+
+def encrypt_secret(value: str) -> str:
+    """Encrypt a credential for storage (e.g. a Marzban node password)"""
+    return _fernet().encrypt(value.encode()).decode()
+
+
+def decrypt_secret(token: str) -> str:
+    """
+    Decrypt a value from encrypt_secret.
+
+    Raises:
+        ValueError: If the token was encrypted with another key or is corrupt
+    """
+    try:
+        return _fernet().decrypt(token.encode()).decode()
+    except InvalidToken:
+        raise ValueError("Cannot decrypt secret; was SECRET_ENCRYPTION_KEY or SECRET_KEY changed?")
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many password operations are already queued"""
+    pass
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a bounded thread pool so it never blocks the event loop.
+
+    bcrypt releases the GIL, so `workers` hashes run in parallel. At most
+    `max_queue` further operations wait for a worker; beyond that callers
+    get PasswordHasherBusy (served as 503) instead of an ever-growing queue.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 32):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_seconds = 0.0
+        self.work_seconds = 0.0
+
+    async def _run(self, func: Callable, *args: Any) -> Any:
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy("Too many login attempts in progress, try again shortly")
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="password"
+            )
+
+        def timed() -> Tuple[Any, float, float]:
+            started = time.monotonic()
+            return func(*args), started, time.monotonic()
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        queued = time.monotonic()
+        try:
+            result, started, finished = await asyncio.get_running_loop().run_in_executor(
+                self._executor, timed
+            )
+        finally:
+            self.in_flight -= 1
+
+        self.completed += 1
+        self.wait_seconds += started - queued
+        self.work_seconds += finished - started
+        return result
+
+    async def hash(self, password: str) -> str:
+        """Hash a password"""
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verify a password.
+
+        Returns:
+            (valid, new_hash) - new_hash is set when the stored hash uses
+            outdated cost parameters and should be replaced
+        """
+        valid, new_hash = await self._run(pwd_context.verify_and_update, password, hashed)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "avg_wait_ms": round(self.wait_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+            "avg_work_ms": round(self.work_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+# Singleton instance
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
+
+
+class JoseBackend:
+    """python-jose (default)"""
+    errors = (JWTError,)
+
+    def encode(self, claims: Dict[str, Any], key: str, algorithm: str) -> str:
+        return jwt.encode(claims, key, algorithm=algorithm)
+
+    def decode(self, token: str, key: str, algorithms: list) -> Dict[str, Any]:
+        return jwt.decode(token, key, algorithms=algorithms)
+
+
+class PyJWTBackend:
+    """PyJWT (optional dependency, faster)"""
+
+    def __init__(self):
+        import jwt as pyjwt
+        self._jwt = pyjwt
+        self.errors = (pyjwt.PyJWTError,)
+
+    def encode(self, claims: Dict[str, Any], key: str, algorithm: str) -> str:
+        return self._jwt.encode(claims, key, algorithm=algorithm)
+
+    def decode(self, token: str, key: str, algorithms: list) -> Dict[str, Any]:
+        return self._jwt.decode(token, key, algorithms=algorithms)
+
+
+JWT_BACKENDS = {"jose": JoseBackend, "pyjwt": PyJWTBackend}
+_jwt_backend = None
+
+
+def get_jwt_backend():
+    """The JWT implementation selected by JWT_BACKEND"""
+    global _jwt_backend
+    if _jwt_backend is None:
+        backend = JWT_BACKENDS.get(settings.JWT_BACKEND)
+        if backend is None:
+            raise ValueError(
+                f"Unknown JWT backend '{settings.JWT_BACKEND}'. "
+                f"Use one of: {', '.join(JWT_BACKENDS)}"
+            )
+        _jwt_backend = backend()
+    return _jwt_backend
+
+
+# Verified token payloads by SHA-256 of the token, each kept until its exp
+token_cache = TTLCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -31,14 +216,34 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.utcnow() + timedelta(days=settings.ACCESS_TOKEN_EXPIRE_DAYS)
 
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    encoded_jwt = get_jwt_backend().encode(to_encode, settings.SECRET_KEY, settings.ALGORITHM)
     return encoded_jwt
 
 
 def decode_token(token: str) -> Optional[dict]:
-    """Decode and validate a JWT token"""
+    """
+    Decode and validate a JWT token.
+
+    Valid tokens are cached (TOKEN_CACHE_SIZE, 0 = off) until their exp or
+    TOKEN_CACHE_TTL, whichever is first, so a token polled repeatedly is
+    verified once. Invalid tokens are not cached.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    if settings.TOKEN_CACHE_SIZE > 0:
+        cached = token_cache.get(key)
+        if cached is not MISSING:
+            return dict(cached)
+
+    backend = get_jwt_backend()
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
-    except JWTError:
+        payload = backend.decode(token, settings.SECRET_KEY, [settings.ALGORITHM])
+    except backend.errors:
         return None
+
+    if settings.TOKEN_CACHE_SIZE > 0:
+        ttl = settings.TOKEN_CACHE_TTL
+        if isinstance(payload.get("exp"), (int, float)):
+            ttl = min(ttl, payload["exp"] - time.time())
+        if ttl > 0:
+            token_cache.set(key, dict(payload), ttl=ttl)
+    return payload
@@ -0,0 +1,62 @@
+"""
+Micro-benchmark of per-request token verification.
+
+Compares decode_token with and without the verified-token cache for every
+installed JWT backend. Run from the backend directory:
+
+    python scripts/bench_auth.py [--iterations 20000]
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings  # noqa: E402
+from app.utils import security  # noqa: E402
+
+
+def bench(label: str, func, iterations: int) -> float:
+    seconds = min(timeit.repeat(func, number=iterations, repeat=3))
+    per_call = seconds / iterations * 1e6
+    print(f"{label:<32} {per_call:8.2f} us/request")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    backends = ["jose"]
+    if importlib.util.find_spec("jwt") is not None:
+        backends.append("pyjwt")
+
+    results = {}
+    for name in backends:
+        settings.JWT_BACKEND = name
+        security._jwt_backend = None
+        token = security.create_access_token({"sub": "1", "role": "AGENT", "ver": 0})
+
+        settings.TOKEN_CACHE_SIZE = 0
+        results[f"{name} uncached"] = bench(
+            f"{name}, no cache", lambda: security.decode_token(token), args.iterations
+        )
+
+        settings.TOKEN_CACHE_SIZE = 10000
+        security.token_cache.maxsize = settings.TOKEN_CACHE_SIZE
+        security.token_cache.clear()
+        results[f"{name} cached"] = bench(
+            f"{name}, verified-token cache", lambda: security.decode_token(token), args.iterations
+        )
+
+    baseline = results["jose uncached"]
+    print()
+    for label, per_call in results.items():
+        print(f"{label:<32} {baseline / per_call:6.1f}x vs jose uncached")
+
+
+if __name__ == "__main__":
+    main()
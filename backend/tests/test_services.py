@@ -1,9 +1,14 @@
 """
 Service Layer Tests
 """
+import asyncio
 import pytest
 from decimal import Decimal
-from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import select
+from datetime import date, datetime, timedelta, timezone
 
 from app.services.credit import (
     add_pending_credit,
@@ -11,12 +16,23 @@ from app.services.credit import (
     reject_payment,
     deduct_credit,
     refund_credit,
+    manual_adjustment,
 )
 from app.services.refund import calculate_refund
+from app.services.ledger import create_checkpoints, agent_statement, reconcile_balances
+from app.services.analytics import hour_of
 from app.models.agent import Agent
 from app.models.user import User, UserRole
 from app.models.payment import Payment, PaymentStatus
-from app.models.transaction import TransactionType
+from app.models.transaction import Transaction, TransactionType
+from app.models.balance_checkpoint import BalanceCheckpoint
+from app.models.marzban_user import MarzbanUser, MarzbanUserStatus
+from app.models.order import Order
+from app.models.plan import Plan
+from app.models.stats import StatsCounter, StatsHourlySales
+from app.schemas.order import OrderBulkCreate
+from app.services import analytics, marzban_sync
+from app.api.orders import create_orders_bulk
 from app.utils.security import hash_password
 
 
@@ -216,3 +232,311 @@ async def test_negative_credit(test_session):
 
     await test_session.refresh(agent)
     assert (agent.credit_confirmed + agent.credit_pending) == Decimal("-50000")
+
+
+@pytest.mark.asyncio
+async def test_manual_adjustment(test_session):
+    """Test admin adjustment logs balances and tracks negative credit"""
+    admin = User(username="admin5", password_hash="x", role=UserRole.ADMIN)
+    user = User(username="test_agent5", password_hash="x", role=UserRole.AGENT)
+    test_session.add_all([admin, user])
+    await test_session.commit()
+
+    agent = Agent(
+        user_id=user.id,
+        first_name="Test",
+        last_name="Agent",
+        credit_confirmed=Decimal("1000"),
+        credit_pending=Decimal("500"),
+    )
+    test_session.add(agent)
+    await test_session.commit()
+
+    transaction = await manual_adjustment(user, Decimal("-2000"), admin, None, test_session)
+    await test_session.commit()
+
+    assert transaction.type == TransactionType.CHARGE_MANUAL
+    assert transaction.balance_before == Decimal("1500")
+    assert transaction.balance_after == Decimal("-500")
+    assert agent.credit_confirmed == Decimal("-1000")
+    assert agent.negative_credit_since is not None
+
+    await manual_adjustment(user, Decimal("600"), admin, "Top-up", test_session)
+    await test_session.commit()
+    assert agent.total_credit == Decimal("100")
+    assert agent.negative_credit_since is None
+
+
+@pytest.mark.asyncio
+async def test_checkpoints_and_statement_balances(test_session):
+    """Test statement balances from checkpoints match a plain ledger sum"""
+    user = User(username="ledger_agent", password_hash="x", role=UserRole.AGENT)
+    test_session.add(user)
+    await test_session.commit()
+
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = [
+        # (days ago, type, amount) - approvals do not change the total
+        (5, TransactionType.CHARGE_PENDING, Decimal("1000")),
+        (4, TransactionType.CHARGE_APPROVED, Decimal("1000")),
+        (3, TransactionType.ORDER_CREATED, Decimal("-300")),
+        (2, TransactionType.ORDER_REFUND, Decimal("100")),
+        (2, TransactionType.ORDER_CREATED, Decimal("-250")),
+        (1, TransactionType.CHARGE_MANUAL, Decimal("50")),
+    ]
+    balance = Decimal(0)
+    for days_ago, tx_type, amount in rows:
+        effect = Decimal(0) if tx_type == TransactionType.CHARGE_APPROVED else amount
+        test_session.add(Transaction(
+            user_id=user.id, type=tx_type, amount=amount,
+            balance_before=balance, balance_after=balance + effect,
+            created_at=today - timedelta(days=days_ago) + timedelta(hours=12),
+        ))
+        balance += effect
+    # Too recent to checkpoint
+    test_session.add(Transaction(
+        user_id=user.id, type=TransactionType.ORDER_CREATED, amount=Decimal("-20"),
+        balance_before=balance, balance_after=balance - 20,
+        created_at=datetime.utcnow(),
+    ))
+    await test_session.commit()
+
+    assert await create_checkpoints(test_session) == 1
+    checkpoint = (await test_session.execute(select(BalanceCheckpoint))).scalar_one()
+    assert checkpoint.balance == Decimal("600")
+
+    # The recent transaction is left for a later run
+    assert await create_checkpoints(test_session) == 0
+
+    async def plain_sum(before: datetime) -> Decimal:
+        result = await test_session.execute(
+            select(Transaction).where(Transaction.user_id == user.id, Transaction.created_at < before)
+        )
+        return sum(
+            (t.amount for t in result.scalars() if t.type != TransactionType.CHARGE_APPROVED),
+            Decimal(0)
+        )
+
+    day = (today - timedelta(days=2)).date()
+    statement = await agent_statement(test_session, user.id, day, day)
+    assert statement["opening_balance"] == await plain_sum(today - timedelta(days=2))
+    assert statement["closing_balance"] == await plain_sum(today - timedelta(days=1))
+    assert statement["total_credits"] == Decimal("100")
+    assert statement["total_debits"] == Decimal("-250")
+    assert len(statement["entries"]) == 2
+
+    statement = await agent_statement(test_session, user.id, today.date(), today.date())
+    assert statement["opening_balance"] == Decimal("600")
+    assert statement["closing_balance"] == Decimal("580")
+
+
+@pytest.mark.asyncio
+async def test_reconcile_reports_exact_differences(test_session):
+    """Test reconciliation reports a one-cent mismatch exactly, as Decimal"""
+    user = User(username="cent_agent", password_hash="x", role=UserRole.AGENT)
+    test_session.add(user)
+    await test_session.commit()
+    test_session.add_all([
+        Agent(user_id=user.id, first_name="Cent", last_name="Agent",
+              credit_confirmed=Decimal("100.11"), credit_pending=Decimal("0")),
+        Transaction(user_id=user.id, type=TransactionType.CHARGE_MANUAL, amount=Decimal("100.10"),
+                    balance_before=Decimal("0"), balance_after=Decimal("100.10")),
+    ])
+    await test_session.commit()
+
+    report = await reconcile_balances(test_session)
+
+    assert report["agents"] == 1
+    mismatch = report["mismatches"][0]
+    assert mismatch["stored_balance"] == Decimal("100.11")
+    assert mismatch["ledger_balance"] == Decimal("100.10")
+    assert mismatch["difference"] == Decimal("0.01")
+    assert isinstance(mismatch["difference"], Decimal)
+
+
+def test_hour_of_uses_utc():
+    """Test rollup hour buckets are naive UTC whatever the input zone"""
+    tehran = timezone(timedelta(hours=3, minutes=30))
+
+    assert hour_of(datetime(2026, 1, 1, 3, 45, tzinfo=tehran)) == datetime(2026, 1, 1, 0, 0)
+    assert hour_of(datetime(2026, 1, 1, 3, 45)) == datetime(2026, 1, 1, 3, 0)
+
+
+def test_apply_marzban_user_data():
+    """Test copying Marzban usage/status onto a local row"""
+    from app.models.marzban_user import MarzbanUser, MarzbanUserStatus
+    from app.services.marzban_sync import apply_user_data
+
+    mu = MarzbanUser(username="sync_user", status=MarzbanUserStatus.ACTIVE)
+
+    apply_user_data(mu, {"used_traffic": 3 * 1024 ** 3, "status": "active"})
+    assert mu.data_used_gb == 3
+    assert mu.status == MarzbanUserStatus.ACTIVE
+    assert mu.last_synced_at is not None
+
+    apply_user_data(mu, {"used_traffic": None, "status": "limited"})
+    assert mu.data_used_gb == 0
+    assert mu.status == MarzbanUserStatus.LIMITED
+
+
+class FailingMarzban:
+    """Marzban client stub failing for the usernames in `fail`"""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.created = []
+        self.deleted = []
+
+    async def create_user(self, username, **kwargs):
+        await asyncio.sleep(0)
+        if username in self.fail:
+            raise Exception("502 Bad Gateway")
+        self.created.append(username)
+        return {"expire": None, "subscription_url": f"https://sub/{username}"}
+
+    async def delete_user(self, username):
+        self.deleted.append(username)
+        return True
+
+
+class StubRegistry:
+    def __init__(self, client):
+        self.client = client
+
+    async def choose_node(self, db):
+        return None
+
+    def get_client(self, node):
+        return self.client
+
+
+@pytest.mark.asyncio
+async def test_bulk_orders_partial_failure(test_session, monkeypatch):
+    """Test bulk orders charge only created users and roll back a failed save"""
+    user = User(username="bulk_agent", password_hash="x", role=UserRole.AGENT)
+    plan = Plan(name="Monthly", days=30, data_limit_gb=50, price_public=Decimal("150"),
+                price_agent=Decimal("100"))
+    test_session.add_all([user, plan])
+    await test_session.commit()
+    test_session.add(Agent(user_id=user.id, first_name="Bulk", last_name="Agent",
+                           credit_confirmed=Decimal("1000"), credit_pending=Decimal("0")))
+    test_session.add(StatsCounter(name="active_orders", value=0))
+    await test_session.commit()
+
+    # Oversized patterns are rejected before their usernames are generated
+    huge = OrderBulkCreate(plan_id=plan.id, pattern="shop{n}", count=10 ** 9)
+    with pytest.raises(HTTPException) as exc:
+        await create_orders_bulk(huge, user, test_session, StubRegistry(FailingMarzban()))
+    assert exc.value.status_code == 400
+
+    marzban = FailingMarzban(fail={"shop3", "shop5"})
+    request = OrderBulkCreate(plan_id=plan.id, pattern="shop{n}", start=1, count=6)
+    response = await create_orders_bulk(request, user, test_session, StubRegistry(marzban))
+
+    assert (response.created, response.failed) == (4, 2)
+    assert response.amount_charged == Decimal("400")
+    assert response.amount_refunded == Decimal("200")
+    assert [item.username for item in response.items if not item.success] == ["shop3", "shop5"]
+
+    agent = (await test_session.execute(select(Agent).where(Agent.user_id == user.id))).scalar_one()
+    assert agent.credit_confirmed == Decimal("600")
+    result = await test_session.execute(
+        select(Transaction.type, Transaction.amount).where(Transaction.user_id == user.id)
+        .order_by(Transaction.id)
+    )
+    assert [(t, abs(a)) for t, a in result.all()] == [
+        (TransactionType.ORDER_CREATED, Decimal("600")),
+        (TransactionType.ORDER_REFUND, Decimal("200")),
+    ]
+    assert len((await test_session.execute(select(Order))).scalars().all()) == 4
+
+    counter = await test_session.get(StatsCounter, "active_orders")
+    assert counter.value == 4
+    rollup = (await test_session.execute(select(StatsHourlySales))).scalar_one()
+    assert (rollup.orders, rollup.sales, rollup.refunds) == (4, Decimal("400"), 0)
+
+    # Saving the orders fails: created users are deleted and all is refunded
+    async def broken_record_sale(*args, **kwargs):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(analytics, "record_sale", broken_record_sale)
+    marzban = FailingMarzban(fail={"cafe2"})
+    request = OrderBulkCreate(plan_id=plan.id, usernames=["cafe1", "cafe2", "cafe3"])
+    with pytest.raises(HTTPException) as exc:
+        await create_orders_bulk(request, user, test_session, StubRegistry(marzban))
+
+    assert exc.value.status_code == 500
+    assert sorted(marzban.deleted) == ["cafe1", "cafe3"]
+    await test_session.refresh(agent)
+    assert agent.credit_confirmed == Decimal("600")
+    assert len((await test_session.execute(select(Order))).scalars().all()) == 4
+    await test_session.refresh(counter)
+    assert counter.value == 4
+
+
+class ListingMarzban:
+    """Marzban client stub serving a fixed user listing"""
+
+    def __init__(self, users):
+        self.users = {user["username"]: user for user in users}
+
+    async def iter_users(self, page_size=None):
+        for user in self.users.values():
+            yield user
+
+    async def get_user(self, username, use_cache=True):
+        return self.users.get(username)
+
+
+@pytest.mark.asyncio
+async def test_bulk_sync_skips_unchanged_rows(test_engine, test_session, monkeypatch):
+    """Test a bulk sync writes only rows whose usage or status changed"""
+    user = User(username="sync_agent", password_hash="x", role=UserRole.AGENT)
+    plan = Plan(name="Monthly", days=30, data_limit_gb=50, price_public=1, price_agent=1)
+    test_session.add_all([user, plan])
+    await test_session.flush()
+    synced_at = datetime(2026, 1, 1)
+    for name, used_gb in (("same", 2), ("grew", 2)):
+        order = Order(user_id=user.id, plan_id=plan.id, amount=1, marzban_username=name)
+        test_session.add(MarzbanUser(
+            order=order, username=name, data_used_gb=used_gb,
+            status=MarzbanUserStatus.ACTIVE, last_synced_at=synced_at
+        ))
+    await test_session.commit()
+
+    monkeypatch.setattr(
+        marzban_sync, "AsyncSessionLocal",
+        async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False)
+    )
+    statements = []
+    event.listen(
+        test_engine.sync_engine, "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement)
+    )
+
+    client = ListingMarzban([
+        {"username": "same", "used_traffic": 2 * 1024 ** 3, "status": "active"},
+        {"username": "grew", "used_traffic": 5 * 1024 ** 3, "status": "active"},
+    ])
+    report = {counter: 0 for counter in marzban_sync.COUNTERS}
+    await marzban_sync._sync_bulk(report, client, MarzbanUser.node_id.is_(None), 2, 100)
+
+    assert (report["synced"], report["changed"], report["missing"]) == (2, 1, 0)
+    updates = [s for s in statements if s.lstrip().upper().startswith("UPDATE")]
+    assert len(updates) == 1
+
+    rows = {
+        mu.username: mu
+        for mu in (await test_session.execute(
+            select(MarzbanUser).execution_options(populate_existing=True)
+        )).scalars()
+    }
+    assert rows["same"].last_synced_at.replace(tzinfo=None) == synced_at
+    assert rows["grew"].data_used_gb == 5
+    assert rows["grew"].last_synced_at.replace(tzinfo=None) > synced_at
+
+    # Nothing changed at all: no statement but the initial SELECT
+    statements.clear()
+    client.users["grew"]["used_traffic"] = 5 * 1024 ** 3
+    await marzban_sync._sync_bulk(report, client, MarzbanUser.node_id.is_(None), 2, 100)
+    assert [s for s in statements if not s.lstrip().upper().startswith("SELECT")] == []
@@ -0,0 +1,238 @@
+"""
+Utility Tests
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import Depends, FastAPI
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import select
+
+from app.utils.cache import TTLCache, MISSING
+from app.utils.circuit_breaker import CircuitBreaker
+from app.utils.range_requests import parse_range
+from app.config import settings
+from app.models.order import Order
+from app.models.plan import Plan
+from app.models.user import User, UserRole
+from app.utils.deps import get_current_user
+from app.utils.pagination import encode_cursor, decode_cursor, paginate
+from app.utils.rate_limit import MemoryBucketStore, rate_limit, set_rate_limit_store
+
+
+def test_ttl_cache_lru_eviction():
+    """Test that the least recently used key is evicted first"""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_ttl_cache_expiry_and_none_values():
+    """Test per-key expiry and caching of None"""
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("gone", "value", ttl=0)
+    cache.set("empty", None)
+
+    assert cache.get("gone") is MISSING
+    assert cache.get("empty") is None
+
+    cache.invalidate("empty")
+    assert cache.get("empty") is MISSING
+    assert cache.stats()["hits"] == 1
+
+
+def test_circuit_breaker_opens_and_probes():
+    """Test open -> half-open -> closed transitions"""
+    breaker = CircuitBreaker(window=4, min_calls=4, failure_ratio=0.5, reset_timeout=60)
+
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.allow_request() is False
+
+    # Reset timeout elapsed: exactly one probe is allowed
+    breaker.reset_timeout = 0
+    assert breaker.allow_request() is True
+    assert breaker.allow_request() is False
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow_request() is True
+
+
+def test_circuit_breaker_ignores_outcomes_while_open():
+    """Test late failures neither extend the open period nor count as openings"""
+    breaker = CircuitBreaker(window=2, min_calls=2, failure_ratio=0.5, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    opened_at = breaker._opened_at
+
+    # Calls started before the breaker opened finish afterwards
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker._opened_at == opened_at
+    assert breaker.stats()["times_opened"] == 1
+
+    # A cancelled probe frees the slot for the next one
+    breaker.reset_timeout = 0
+    assert breaker.allow_request() is True
+    breaker.release()
+    assert breaker.allow_request() is True
+
+
+def test_parse_range():
+    """Test single byte-range parsing for resumable downloads"""
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+
+    # Multiple ranges and other units are ignored (whole file is sent)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+
+    for header in ("bytes=100-", "bytes=9-3", "bytes=abc", "bytes=-0"):
+        with pytest.raises(ValueError):
+            parse_range(header, 100)
+
+
+@pytest.mark.asyncio
+async def test_memory_bucket_store():
+    """Test token bucket burst, retry delay and LRU bound"""
+    store = MemoryBucketStore(max_keys=2)
+
+    assert await store.take("a", capacity=2, rate=1.0) == 0
+    assert await store.take("a", capacity=2, rate=1.0) == 0
+    assert 0 < await store.take("a", capacity=2, rate=1.0) <= 1  # ~1s to the next token
+    assert await store.take("b", capacity=2, rate=1.0) == 0
+
+    await store.take("c", capacity=2, rate=1.0)  # Evicts "a", which starts full again
+    assert await store.take("a", capacity=2, rate=1.0) == 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_dependency(monkeypatch):
+    """Test 429 + Retry-After per username, and X-Real-IP only from trusted proxies"""
+    set_rate_limit_store(MemoryBucketStore())
+    app = FastAPI()
+
+    @app.post("/login", dependencies=[
+        Depends(rate_limit("test:ip", 3)),
+        Depends(rate_limit("test:username", 2, scope="username")),
+    ])
+    async def login(body: dict):
+        return {"username": body["username"]}
+
+    transport = ASGITransport(app=app, client=("10.0.0.5", 1234))
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        for _ in range(2):
+            response = await client.post("/login", json={"username": "Alice"})
+            assert response.status_code == 200
+            assert response.json() == {"username": "Alice"}  # Body still readable
+
+        response = await client.post("/login", json={"username": "alice"})
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+        # Per-IP bucket: the forged header is ignored from an untrusted peer
+        monkeypatch.setattr(settings, "RATE_LIMIT_TRUSTED_PROXIES", [])
+        response = await client.post(
+            "/login", json={"username": "bob"}, headers={"X-Real-IP": "1.2.3.4"}
+        )
+        assert response.status_code == 429
+
+        # Behind a trusted proxy each real client gets its own bucket
+        monkeypatch.setattr(settings, "RATE_LIMIT_TRUSTED_PROXIES", ["10.0.0.0/8"])
+        response = await client.post(
+            "/login", json={"username": "bob"}, headers={"X-Real-IP": "1.2.3.4"}
+        )
+        assert response.status_code == 200
+
+    set_rate_limit_store(None)
+
+
+def test_cursor_round_trip():
+    """Test opaque cursors decode to what was encoded"""
+    naive = datetime(2026, 1, 2, 3, 4, 5, 678901)
+    aware = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+    assert decode_cursor(encode_cursor(naive, 42)) == (naive, 42)
+    assert decode_cursor(encode_cursor(aware, 7)) == (aware, 7)
+    assert "=" not in encode_cursor(naive, 42)
+
+    for cursor in ("garbage", "", encode_cursor(naive, 1)[:-3], "WzFd"):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+async def _add_orders(session, count: int) -> User:
+    user = User(username="pager", password_hash="x", role=UserRole.AGENT)
+    plan = Plan(name="p", days=30, data_limit_gb=10, price_public=1, price_agent=1)
+    session.add_all([user, plan])
+    await session.flush()
+
+    start = datetime(2026, 1, 1)
+    for i in range(count):
+        # Three orders per timestamp, so pages split rows with equal created_at
+        session.add(Order(
+            user_id=user.id, plan_id=plan.id, amount=1, marzban_username=f"pager{i}",
+            created_at=start + timedelta(minutes=i // 3)
+        ))
+    await session.commit()
+    return user
+
+
+@pytest.mark.asyncio
+async def test_paginate_cursor_with_equal_timestamps(test_session):
+    """Test cursor pages neither repeat nor skip rows and match OFFSET order"""
+    await _add_orders(test_session, 23)
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = await paginate(test_session, select(Order), Order, 1, 5, cursor)
+        seen += [row.id for row in rows]
+        if cursor is None:
+            break
+
+    expected = (await test_session.execute(
+        select(Order.id).order_by(Order.created_at.desc(), Order.id.desc())
+    )).scalars().all()
+    assert seen == list(expected)
+    assert len(set(seen)) == 23
+
+    rows, cursor = await paginate(test_session, select(Order), Order, 2, 5)
+    assert [row.id for row in rows] == list(expected[5:10])
+    assert cursor is not None
+
+
+@pytest.mark.asyncio
+async def test_list_orders_invalid_cursor(test_app, test_session):
+    """Test a malformed cursor is a 400, and next_cursor continues the list"""
+    user = await _add_orders(test_session, 4)
+    test_app.dependency_overrides[get_current_user] = lambda: user
+
+    transport = ASGITransport(app=test_app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get("/api/orders/my", params={"cursor": "garbage"})
+        assert response.status_code == 400
+
+        first = (await client.get("/api/orders/my", params={"page_size": 3})).json()
+        assert first["total"] == 4 and first["total_exact"] is True
+        second = (await client.get(
+            "/api/orders/my",
+            params={"page_size": 3, "cursor": first["next_cursor"], "include_total": False}
+        )).json()
+        assert len(second["orders"]) == 1 and second["total"] is None
+        assert second["next_cursor"] is None